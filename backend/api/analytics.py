@@ -0,0 +1,170 @@
+"""
+Time-bucketed analytics.
+
+Each metric is counted per hour and per day in AnalyticsBucket rows. Signals add to
+the buckets covering an event as it happens (and take reviews, likes and users back
+out of the bucket they were counted in when they are deleted), so the counts of
+those three metrics always add up to the live row counts.
+
+A window is answered by summing the day buckets it fully covers plus the hour
+buckets at its ragged ends, so /api/analytics/ never scans the base tables however
+far back it looks. `manage.py rebuild_analytics` recomputes the buckets from the
+base tables, e.g. after bulk loads that skip the signals.
+"""
+import re
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import AnalyticsBucket, DiaryEntry, Review, ReviewLike
+
+REVIEWS = 'reviews'
+LIKES = 'likes'
+SIGNUPS = 'signups'
+DIARY_METRICS = {status: f'diary_{status.replace("-", "_")}' for status, _ in DiaryEntry.STATUS_CHOICES}
+METRICS = [REVIEWS, LIKES, SIGNUPS] + list(DIARY_METRICS.values())
+
+# Metrics that can be recomputed from a timestamp on the base table. Diary transitions
+# leave no history behind, so their buckets only ever come from the signals.
+SOURCES = {
+    REVIEWS: (Review, 'created_at'),
+    LIKES: (ReviewLike, 'created_at'),
+    SIGNUPS: (User, 'date_joined'),
+}
+
+HOUR = 'hour'
+DAY = 'day'
+GRANULARITIES = {HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+# Longest series returned in one response, e.g. 41 days by the hour
+MAX_POINTS = 1000
+
+RANGE_PATTERN = re.compile(r'^(\d+)([hd])$')
+
+
+def parse_range(value):
+    """'24h', '7d', ... as a timedelta. Raises ValueError for anything else."""
+    match = RANGE_PATTERN.match(value or '')
+    if not match or not int(match[1]):
+        raise ValueError(f'Invalid range {value!r}; use a number of hours or days such as 24h or 30d')
+    return timedelta(**{'hours' if match[2] == 'h' else 'days': int(match[1])})
+
+
+def bucket_start(moment, granularity):
+    """Start in UTC of the bucket containing moment."""
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == DAY else moment
+
+
+def add_to_bucket(metric, granularity, start, delta):
+    bucket = AnalyticsBucket.objects.filter(metric=metric, granularity=granularity, start=start)
+    if bucket.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            AnalyticsBucket.objects.create(metric=metric, granularity=granularity, start=start, count=delta)
+    except IntegrityError:
+        # Another request created the bucket in between
+        bucket.update(count=F('count') + delta)
+
+
+def record_event(metric, moment=None, delta=1):
+    """Count an event (or with delta=-1 take one back) in the hour and day buckets of its time."""
+    moment = moment or timezone.now()
+    for granularity in GRANULARITIES:
+        add_to_bucket(metric, granularity, bucket_start(moment, granularity), delta)
+
+
+def record_row(instance, delta=1):
+    """Count a created row of a SOURCES model (or with delta=-1 a deleted one) at its own timestamp."""
+    for metric, (model, field) in SOURCES.items():
+        if isinstance(instance, model):
+            record_event(metric, getattr(instance, field), delta)
+
+
+def record_rows(instances, delta=1):
+    """record_row() for rows written in bulk, with one update per bucket they fall in."""
+    counts = Counter()
+    for instance in instances:
+        for metric, (model, field) in SOURCES.items():
+            if isinstance(instance, model):
+                for granularity in GRANULARITIES:
+                    counts[metric, granularity, bucket_start(getattr(instance, field), granularity)] += delta
+    for (metric, granularity, start), count in counts.items():
+        add_to_bucket(metric, granularity, start, count)
+
+
+def window_filter(start, end):
+    """
+    Buckets covering [start, end): whole days where the window spans them, hours at either end.
+    start=None means since the first bucket. The bucket holding end is included.
+    """
+    day_end = bucket_start(end, DAY)
+    if start is None:
+        return Q(granularity=DAY, start__lt=day_end) | Q(granularity=HOUR, start__gte=day_end, start__lt=end)
+
+    start = bucket_start(start, HOUR)
+    day_start = bucket_start(start, DAY)
+    if day_start < start:
+        day_start += GRANULARITIES[DAY]
+    if day_start >= day_end:
+        return Q(granularity=HOUR, start__gte=start, start__lt=end)
+    return (
+        Q(granularity=HOUR, start__gte=start, start__lt=day_start)
+        | Q(granularity=DAY, start__gte=day_start, start__lt=day_end)
+        | Q(granularity=HOUR, start__gte=day_end, start__lt=end)
+    )
+
+
+def totals(metrics, start=None, end=None):
+    """{metric: events between start and end}, in one query over the buckets."""
+    rows = (
+        AnalyticsBucket.objects.filter(window_filter(start, end or timezone.now()), metric__in=metrics)
+        .order_by().values('metric').annotate(total=Sum('count')).values_list('metric', 'total')
+    )
+    return {metric: 0 for metric in metrics} | dict(rows)
+
+
+def series(metrics, start, end, granularity):
+    """{metric: [{'start': ..., 'count': ...}, ...]} with one point per bucket from start to end, zeros included."""
+    step = GRANULARITIES[granularity]
+    first = bucket_start(start, granularity)
+    counts = {
+        (metric, bucket): count
+        for metric, bucket, count in AnalyticsBucket.objects.filter(
+            metric__in=metrics, granularity=granularity, start__gte=first, start__lt=end,
+        ).values_list('metric', 'start', 'count')
+    }
+    points = []
+    while first < end:
+        points.append(first)
+        first += step
+    return {
+        metric: [{'start': point, 'count': counts.get((metric, point), 0)} for point in points]
+        for metric in metrics
+    }
+
+
+def rebuild_buckets(metrics=None):
+    """Recompute the buckets of the given SOURCES metrics (all of them by default) from the base tables."""
+    metrics = list(metrics or SOURCES)
+    created = 0
+    with transaction.atomic():
+        AnalyticsBucket.objects.filter(metric__in=metrics).delete()
+        for metric in metrics:
+            model, field = SOURCES[metric]
+            for granularity in GRANULARITIES:
+                rows = (
+                    model.objects.order_by().annotate(bucket=Trunc(field, granularity, tzinfo=dt_timezone.utc))
+                    .values('bucket').annotate(n=Count('pk')).values_list('bucket', 'n')
+                )
+                created += len(AnalyticsBucket.objects.bulk_create(
+                    [AnalyticsBucket(metric=metric, granularity=granularity, start=bucket, count=n) for bucket, n in rows],
+                    batch_size=1000,
+                ))
+    return created
@@ -0,0 +1,167 @@
+"""
+Bulk writes for imports (e.g. a Goodreads reading history): diary entries, reviews
+and review likes of one user, a batch per request.
+
+A batch is validated as a whole, the books or reviews it points to are looked up in
+one query, and its rows are written with one upsert on their (user, book) unique key
+(likes: one insert of those missing), inside one transaction. bulk_create() skips the
+model signals, so each batch applies their effects itself, batched: each affected book's
+ratings change once (in one UPDATE per distinct change), the user's stats are
+refreshed once, each analytics bucket is updated once, books' trending scores change
+in one UPDATE per distinct change, and the new activities are inserted and fanned out
+together.
+
+The user's existing rows are read first, which tells new rows from updated ones and
+gives the old values the rating and analytics changes start from. Fields an item
+leaves out keep their current value on rows that exist.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .analytics import DIARY_METRICS, record_event, record_rows
+from .caching import bump_versions
+from .feed import LIKED_REVIEW, REVIEWED, record_activities
+from .models import Activity, DiaryEntry, Review, ReviewLike
+from .ratings import apply_rating_changes, to_rating
+from .stats import add_likes_received, refresh_user_stats, update_books_read_by_year
+from .trending import DIARY_WEIGHTS, LIKE_WEIGHT, REVIEW_WEIGHT, add_events
+
+
+def check_targets(items, key, model):
+    """
+    Make sure each item's key is the id of an existing model row, used once in the batch.
+    Raises ValidationError with one entry per item, like ListSerializer does.
+    """
+    ids = [item.get(key) for item in items]
+    found = set(model.objects.filter(pk__in={pk for pk in ids if pk is not None}).values_list('pk', flat=True))
+    errors, seen = [], set()
+    for pk in ids:
+        if pk is None:
+            errors.append({key: ['This field is required.']})
+        elif pk not in found:
+            errors.append({key: [f'Invalid pk "{pk}" - object does not exist.']})
+        elif pk in seen:
+            errors.append({key: ['Appears more than once in this batch.']})
+        else:
+            errors.append({})
+        seen.add(pk)
+    if any(errors):
+        raise serializers.ValidationError(errors)
+
+
+def upsert_diary_entries(user, items):
+    """Create or update the user's diary entries for the books of items. Returns (created, updated)."""
+    status_default = DiaryEntry._meta.get_field('status').get_default()
+    now = timezone.now()
+    today = now.date()
+    with transaction.atomic():
+        existing = {
+            row['book_id']: row
+            for row in DiaryEntry.objects.filter(user=user, book_id__in=[item['book_id'] for item in items])
+            .values('book_id', 'status', 'read_date')
+        }
+        entries, transitions, events = [], Counter(), []
+        for item in items:
+            old = existing.get(item['book_id'], {'status': status_default, 'read_date': None})
+            status = item.get('status', old['status'])
+            read_date = item.get('read_date', old['read_date'])
+            if status == 'read' and read_date is None:
+                read_date = today  # As DiaryEntryViewSet does for single entries
+            if item['book_id'] not in existing or status != old['status']:
+                transitions[DIARY_METRICS[status]] += 1
+                events.append((item['book_id'], DIARY_WEIGHTS[status], now))
+            entries.append(DiaryEntry(user=user, book_id=item['book_id'], status=status, read_date=read_date))
+        DiaryEntry.objects.bulk_create(
+            entries, update_conflicts=True, unique_fields=['user', 'book'], update_fields=['status', 'read_date'],
+        )
+        for metric, count in transitions.items():
+            record_event(metric, delta=count)
+        add_events(events)
+        update_books_read_by_year(user.pk)
+    return len(items) - len(existing), len(existing)
+
+
+def upsert_reviews(user, items):
+    """Create or update the user's reviews of the books of items. Returns (created, updated)."""
+    rating_default = Review._meta.get_field('rating').get_default()
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            row['book_id']: row
+            for row in Review.objects.filter(user=user, book_id__in=[item['book_id'] for item in items])
+            .values('book_id', 'rating', 'text')
+        }
+        reviews, changes = [], {}
+        for item in items:
+            old = existing.get(item['book_id'])
+            old_rating = old['rating'] if old else None
+            rating = to_rating(item.get('rating', rating_default if old is None else old_rating))
+            text = item.get('text', old['text'] if old else '')
+            reviews.append(Review(user=user, book_id=item['book_id'], rating=rating, text=text))
+            if rating != old_rating:
+                changes[item['book_id']] = (old_rating, rating)
+        Review.objects.bulk_create(
+            reviews, update_conflicts=True, unique_fields=['user', 'book'], update_fields=['rating', 'text', 'updated_at'],
+        )
+        apply_rating_changes(changes)
+        if changes:
+            refresh_user_stats(user.pk)
+            bump_versions(changes)
+        created = [review for review in reviews if review.book_id not in existing]
+        record_rows(created)
+        add_events([(review.book_id, REVIEW_WEIGHT, now) for review in created])
+        record_activities(user.pk, [
+            Activity(user=user, action=REVIEWED, book_id=review.book_id, review_id=review.pk) for review in created
+        ])
+    return len(created), len(existing)
+
+
+def add_review_likes(user, review_ids):
+    """Like the given reviews as user, skipping those already liked. Returns (created, unchanged)."""
+    now = timezone.now()
+    with transaction.atomic():
+        # A concurrent like of a locked review (its insert and likes_count update touch the review
+        # row) commits before `liked` is read or waits for this transaction, so every like
+        # inserted below is new. Locked in pk order so concurrent batches can't deadlock.
+        locked = list(
+            Review.objects.select_for_update().filter(pk__in=set(review_ids)).order_by('pk')
+            .values_list('pk', 'user_id', 'book_id')
+        )
+        liked = set(ReviewLike.objects.filter(user=user, review_id__in=review_ids).values_list('review_id', flat=True))
+        targets = {pk: (author_id, book_id) for pk, author_id, book_id in locked if pk not in liked}
+        likes = ReviewLike.objects.bulk_create([ReviewLike(user=user, review_id=pk) for pk in review_ids if pk in targets])
+        if likes:
+            Review.objects.filter(pk__in=targets).update(likes_count=F('likes_count') + 1)
+            add_likes_received(Counter(author_id for author_id, _ in targets.values()))
+            record_rows(likes)
+            add_events([(book_id, LIKE_WEIGHT, now) for author_id, book_id in targets.values()])
+            record_activities(user.pk, [
+                Activity(user=user, action=LIKED_REVIEW, book_id=book_id, target_user_id=author_id, review_id=pk)
+                for pk, (author_id, book_id) in targets.items()
+            ])
+    return len(targets), len(liked)
+
+
+class BulkWriteMixin:
+    """
+    POST <list route>/bulk/ with a JSON list of the items create() takes, up to
+    settings.BULK_MAX_ITEMS of them. Each item names the bulk_target row it is about by
+    bulk_key. Views using it set both and define bulk_write(items), which writes the
+    validated items and returns the response data.
+    """
+    bulk_key = None
+    bulk_target = None
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data, many=True, max_length=settings.BULK_MAX_ITEMS)
+        serializer.is_valid(raise_exception=True)
+        check_targets(serializer.validated_data, self.bulk_key, self.bulk_target)
+        return Response(self.bulk_write(serializer.validated_data))
@@ -0,0 +1,112 @@
+"""
+Versioned response cache for the book catalog.
+
+Cached responses are keyed by a version number rather than deleted on writes: the
+catalog version covers list pages and each book has its own version for detail
+pages. Signals in models.py bump the versions after a write commits, which makes
+every older cache entry unreachable at once. Versions are nanosecond timestamps,
+so they also serve as the Last-Modified value, and with the version in the ETag
+a conditional request can get a 304 without hitting the database.
+
+Storage is whatever CACHES['default'] is: local memory unless CACHE_URL points at
+a shared backend such as Redis. With local memory every worker keeps its own
+versions, so BOOK_CACHE_TIMEOUT bounds how stale another worker's copy can get.
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'books:version:catalog'
+
+
+def book_version_key(book_id):
+    return f'books:version:{book_id}'
+
+
+def get_versions(keys):
+    """Current version for each key, starting a fresh one for keys that are missing or evicted."""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key) or time.time_ns()
+    return [versions[key] for key in keys]
+
+
+def bump_versions(book_ids=(), catalog=True):
+    """Invalidate the catalog and the given books once the current transaction commits."""
+    keys = [book_version_key(book_id) for book_id in book_ids]
+    if catalog:
+        keys.append(CATALOG_VERSION_KEY)
+    if not keys:
+        return
+
+    def bump():
+        version = time.time_ns()
+        cache.set_many({key: version for key in keys}, None)
+
+    transaction.on_commit(bump)
+
+
+class CachedLookup:
+    """The versions, validators and cache entry of one GET, shared by the sync and async paths below."""
+
+    def __init__(self, request, namespace, version_keys):
+        versions = get_versions(version_keys)
+        params = sorted(request.query_params.lists())
+        digest = hashlib.sha1(repr((request.get_host(), params)).encode()).hexdigest()[:16]
+        version_tag = '-'.join(str(version) for version in versions)
+
+        self.etag = f'"{namespace}-{version_tag}-{digest}"'
+        self.last_modified = max(versions) // 1_000_000_000
+        self.key = f'{namespace}:{version_tag}:{digest}'
+
+        self.response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if self.response is None:
+            data = cache.get(self.key)
+            if data is not None:
+                self.response = Response(data)
+
+    def store(self, response):
+        cache.set(self.key, response.data, settings.BOOK_CACHE_TIMEOUT)
+
+    def finish(self, response):
+        response['ETag'] = self.etag
+        response['Last-Modified'] = http_date(self.last_modified)
+        # Responses depend on authentication, so only the client itself may reuse them, after revalidating
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def cached_response(request, namespace, version_keys, build_response):
+    """
+    Serve a GET from the cache, or a 304 if the client's copy is still current.
+    build_response is only called on a miss; its data is stored under the current versions.
+    """
+    lookup = CachedLookup(request, namespace, version_keys)
+    response = lookup.response
+    if response is None:
+        response = build_response()
+        if response.status_code != 200:
+            return response
+        lookup.store(response)
+    return lookup.finish(response)
+
+
+async def acached_response(request, namespace, version_keys, build_response):
+    """cached_response() for async views: build_response is a coroutine function, cache calls run in a thread."""
+    lookup = await sync_to_async(CachedLookup)(request, namespace, version_keys)
+    response = lookup.response
+    if response is None:
+        response = await build_response()
+        if response.status_code != 200:
+            return response
+        await sync_to_async(lookup.store)(response)
+    return lookup.finish(response)
@@ -0,0 +1,118 @@
+"""
+Async views and the queries they run concurrently.
+
+Django's async ORM methods (aget(), acount(), ...) hand every query of a request to
+the same thread, one after another. run_queries() instead runs independent blocking
+calls at the same time on a pool of settings.ASYNC_QUERY_THREADS threads, each with
+its own database connection, so a view waits for the slowest query rather than for
+the sum of them. Pool threads are long-lived, so their connections follow
+CONN_MAX_AGE like those of request threads.
+
+connection.execute_wrapper() only wraps the queries of the thread that installs it.
+query_wrapper() installs a wrapper for the current context instead: every connection
+runs the wrappers of the context its query was issued from, and contexts are carried
+into sync_to_async() threads and into run_queries(). This keeps the metrics sampler,
+the profiler and the benchmark seeing every query of a request wherever it runs.
+
+DRF has no async views, so async_api_view() runs DRF's request handling
+(authentication, permissions, content negotiation, error responses) in a thread and
+only the view function itself on the event loop.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.decorators import api_view
+
+_wrappers = contextvars.ContextVar('query_wrappers', default=())
+_executor = None
+
+# Methods an async view serves itself; the rest go to its sync fallback
+ASYNC_METHODS = ('GET', 'HEAD')
+
+
+def run_wrappers(execute, sql, params, many, context):
+    """Installed on every connection: applies the query wrappers of the current context."""
+    for wrapper in reversed(_wrappers.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_wrappers(sender, connection, **kwargs):
+    connection.execute_wrappers.insert(0, run_wrappers)
+
+
+@contextmanager
+def query_wrapper(wrapper):
+    """Like connection.execute_wrapper(wrapper), for queries on any thread of the current context."""
+    token = _wrappers.set(_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _wrappers.reset(token)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.ASYNC_QUERY_THREADS, thread_name_prefix='queries')
+    return _executor
+
+
+def run_in_pool(call):
+    # What request_started and request_finished do for request threads
+    close_old_connections()
+    try:
+        return call()
+    finally:
+        close_old_connections()
+
+
+async def run_queries(*calls):
+    """Results of the blocking calls (ORM queries and whatever needs them), run concurrently."""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    return await asyncio.gather(*(
+        loop.run_in_executor(executor, contextvars.copy_context().run, run_in_pool, call) for call in calls
+    ))
+
+
+def async_api_view(fallback=None):
+    """
+    @api_view(['GET']) for an async view function, used the same way with DRF's
+    @permission_classes() and other policy decorators under it. Methods other than
+    GET and HEAD go to fallback, a sync view, or get DRF's own OPTIONS and 405 answers.
+    """
+    def decorator(func):
+        drf_view = api_view(['GET'])(func)
+        fallback_view = sync_to_async(fallback or drf_view)
+
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in ASYNC_METHODS:
+                return await fallback_view(request, *args, **kwargs)
+            # APIView.dispatch(), with the handler awaited and the rest run in a thread
+            self = drf_view.cls(**drf_view.initkwargs)
+            self.setup(request, *args, **kwargs)
+            request = self.initialize_request(request, *args, **kwargs)
+            self.request = request
+            self.headers = self.default_response_headers
+            try:
+                await sync_to_async(self.initial)(request, *args, **kwargs)
+                response = await func(request, *args, **kwargs)
+            except Exception as exc:
+                response = await sync_to_async(self.handle_exception)(exc)
+            self.response = self.finalize_response(request, response, *args, **kwargs)
+            return self.response
+
+        view.csrf_exempt = True
+        return view
+    return decorator
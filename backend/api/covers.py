@@ -0,0 +1,281 @@
+"""
+Resized WebP covers, so book lists load thumbnails instead of full-size originals.
+
+Every book with a cover (the stored `cover` file, or else `cover_url`) has a cover_key:
+a hash of that source, kept in sync by Book.save() and the importers. API responses give
+the URLs of its variants, /api/covers/<cover_key>/<width>.webp for each width in
+VARIANTS. A URL names its source and size, so its content never changes: responses are
+sent with a year-long immutable Cache-Control, and books sharing a cover share its files.
+A new cover gives the book a new key and new URLs.
+
+Variants are files named after the key and width in COVER_CACHE_DIR, an LRU bounded by
+COVER_CACHE_MAX_BYTES that every process shares: serving a file touches its mtime, and
+once a process has written more than the limit allows, it scans the directory and deletes
+the least recently used files down to LOW_WATER of it. Processes only see each other's
+writes at that scan, so the directory can briefly overshoot by what they wrote since.
+
+A request for a variant that isn't cached looks the source up by key and hands it to a
+pool of COVER_WORKERS threads per process, which fetches it once, renders every width
+(Pillow releases the GIL while decoding, resizing and encoding) and writes them to the
+cache. Requests for the same source wait on the same job. A request waits up to
+COVER_RENDER_TIMEOUT for it and is otherwise redirected to the original image, as are
+requests while the queue is full and, for FAILURE_TIMEOUT, those for a source that could
+not be fetched or decoded. `manage.py generate_covers` renders the whole catalog ahead.
+A cover_url is only fetched from COVER_SOURCE_HOSTS, redirects included, so the workers
+can't be pointed at internal services.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Book
+
+# Variant name: width in pixels; originals narrower than a width are not scaled up
+VARIANTS = {'thumbnail': 200, 'medium': 400, 'large': 800}
+WIDTHS = set(VARIANTS.values())
+# URLs are cached as immutable, so change a width (which changes the URL) rather than QUALITY
+QUALITY = 80
+
+KEY_LENGTH = 24
+# Share of COVER_CACHE_MAX_BYTES an eviction scan brings the cache down to
+LOW_WATER = 0.9
+
+# Originals larger than this are not rendered
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+FETCH_TIMEOUT = 10
+# Redirects followed when fetching a cover_url, each checked against COVER_SOURCE_HOSTS
+MAX_REDIRECTS = 5
+# Seconds before a source that failed is tried again
+FAILURE_TIMEOUT = 600
+# Sources waiting for a worker per process; past this, requests are redirected right away
+MAX_QUEUED = 256
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class CoverError(Exception):
+    pass
+
+
+def source_key(cover_name, cover_url):
+    """cover_key of a book with the given stored cover file name and cover URL, '' without either."""
+    source = f'file:{cover_name}' if cover_name else f'url:{cover_url}' if cover_url else None
+    return hashlib.sha256(source.encode()).hexdigest()[:KEY_LENGTH] if source else ''
+
+
+def variant_urls(key):
+    """{variant: URL} of the covers of a cover_key, or None for books without a cover."""
+    if not key:
+        return None
+    return {name: f'{settings.COVER_URL_PREFIX}{key}/{width}.webp' for name, width in VARIANTS.items()}
+
+
+def file_name(key, width):
+    return f'{key}-{width}.webp'
+
+
+class CoverCache:
+    """Size-bounded LRU of variant files in a directory, shared by the processes using it."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None  # Bytes in the directory at the last scan, plus those written since
+
+    def path(self, name):
+        return self.directory / name[:2] / name
+
+    def open(self, name):
+        """A cached file opened for reading, marked as just used, or None."""
+        path = self.path(name)
+        try:
+            f = open(path, 'rb')
+            os.utime(path)
+        except FileNotFoundError:
+            return None  # An open file stays readable when another process evicts it
+        return f
+
+    def put(self, name, data):
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name and renamed, so no reader ever sees half a file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.size is None:
+                self.evict()
+            else:
+                self.size += len(data)
+                if self.size > self.max_bytes:
+                    self.evict()
+
+    def evict(self):
+        """Measure the directory and delete the least recently used files until it fits in LOW_WATER."""
+        files = []
+        for directory in os.scandir(self.directory):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith('.webp'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue  # Evicted by another process meanwhile
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        self.size = sum(size for _, size, _ in files)
+        if self.size <= self.max_bytes:
+            return
+        for _, size, path in sorted(files):
+            if self.size <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+def read_source(cover_name, cover_url):
+    """Bytes of a cover original, from storage or over HTTP. Raises CoverError."""
+    if cover_name:
+        try:
+            with default_storage.open(cover_name) as f:
+                return f.read(MAX_SOURCE_BYTES + 1)
+        except OSError as e:
+            raise CoverError(f'Cannot read {cover_name}: {e}') from e
+    url = cover_url
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            check_source_url(url)
+            # Redirects are followed here rather than by requests, so every hop is checked
+            with _session.get(url, timeout=FETCH_TIMEOUT, stream=True, allow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers['Location'])
+                    continue
+                response.raise_for_status()
+                return response.raw.read(MAX_SOURCE_BYTES + 1, decode_content=True)
+    except requests.RequestException as e:
+        raise CoverError(f'Cannot fetch {cover_url}: {e}') from e
+    raise CoverError(f'Cannot fetch {cover_url}: more than {MAX_REDIRECTS} redirects')
+
+
+def check_source_url(url):
+    """Raise CoverError unless url is HTTP(S) on one of COVER_SOURCE_HOSTS or their subdomains."""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise CoverError(f'Not an HTTP URL: {url}')
+    host = (parts.hostname or '').rstrip('.')
+    if not any(host == allowed or host.endswith(f'.{allowed}') for allowed in settings.COVER_SOURCE_HOSTS):
+        raise CoverError(f'Not an allowed cover host: {url}')
+
+
+def render(data):
+    """{width: WebP bytes} of an original, widest first so each is scaled from the one before."""
+    if len(data) > MAX_SOURCE_BYTES:
+        raise CoverError('Original is too large')
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info else 'RGB')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise CoverError(f'Cannot decode the original: {e}') from e
+    variants = {}
+    for width in sorted(WIDTHS, reverse=True):
+        if image.width > width:
+            image = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'WEBP', quality=QUALITY, method=4)
+        variants[width] = buffer.getvalue()
+    return variants
+
+
+def is_cached(key):
+    return all(_cache.path(file_name(key, width)).exists() for width in WIDTHS)
+
+
+def generate(key, cover_name, cover_url):
+    """Render every variant of a source into the cache. Raises CoverError."""
+    try:
+        variants = render(read_source(cover_name, cover_url))
+    except CoverError:
+        cache.set(f'covers:failed:{key}', True, FAILURE_TIMEOUT)
+        raise
+    for width, data in variants.items():
+        _cache.put(file_name(key, width), data)
+
+
+_session = requests.Session()
+_cache = CoverCache(settings.COVER_CACHE_DIR, settings.COVER_CACHE_MAX_BYTES)
+_executor = None
+_pending = {}  # cover_key: future of its generate() job
+_lock = threading.Lock()
+
+
+def schedule(key, cover_name, cover_url):
+    """Future of the job rendering a source's variants, started unless one is running; None when the queue is full."""
+    global _executor
+    with _lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        if len(_pending) >= MAX_QUEUED:
+            return None
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.COVER_WORKERS, thread_name_prefix='covers')
+        future = _pending[key] = _executor.submit(generate, key, cover_name, cover_url)
+    future.add_done_callback(lambda _: _pending.pop(key, None))
+    return future
+
+
+def serve(f):
+    response = FileResponse(f, content_type='image/webp')
+    patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
+def original(cover_name, cover_url):
+    # Not cached: the variant may be ready next time
+    response = HttpResponseRedirect(default_storage.url(cover_name) if cover_name else cover_url)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def cover_view(request, key, width):
+    """GET /api/covers/<cover_key>/<width>.webp: a cover variant, rendered on first request."""
+    if width not in WIDTHS:
+        raise Http404('No such cover size.')
+    name = file_name(key, width)
+    f = _cache.open(name)
+    if f is not None:
+        return serve(f)
+
+    # Any book with the key will do: the same key means the same source
+    source = Book.objects.filter(cover_key=key).values_list('cover', 'cover_url').first()
+    if source is None:
+        raise Http404('No cover matches the given key.')
+    if cache.get(f'covers:failed:{key}'):
+        return original(*source)
+    future = schedule(key, *source)
+    if future is None:
+        return original(*source)
+    try:
+        future.result(timeout=settings.COVER_RENDER_TIMEOUT)
+    except (TimeoutError, CoverError):
+        return original(*source)
+    f = _cache.open(name)
+    return original(*source) if f is None else serve(f)
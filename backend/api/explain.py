@@ -0,0 +1,70 @@
+"""
+Query plans of the SQL an endpoint actually runs.
+
+explain_request() makes a request, captures every SELECT it executes (with its real
+parameters, through a query wrapper, so on any thread) and runs EXPLAIN on each one.
+Plans are checked for full table scans and for sorts the database has to do itself
+because no index delivers the rows in order, which is what a missing index looks
+like. SQLite and PostgreSQL plans are understood; other databases get the raw plan
+and no findings.
+"""
+from django.db import connection
+
+from .concurrency import query_wrapper
+
+FULL_SCAN = 'full scan'
+SORT = 'sort'
+
+
+class SelectCollector:
+    """Query wrapper (see api/concurrency.py) keeping the SQL and parameters of each SELECT."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    """The plan of a query, one line per node."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        # SQLite returns (id, parent, notused, detail) rows, PostgreSQL one text column
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def plan_findings(plan):
+    """[(FULL_SCAN, table) or (SORT, what is sorted), ...] in a plan."""
+    findings = []
+    for line in plan:
+        detail = line.strip()
+        if connection.vendor == 'sqlite':
+            # 'SCAN t USING INDEX i' walks an index in order and 'SCAN t VIRTUAL TABLE' is full-text search
+            if detail.startswith('SCAN ') and ' USING ' not in detail and 'VIRTUAL TABLE' not in detail:
+                findings.append((FULL_SCAN, detail.split()[1]))
+            elif detail.startswith('USE TEMP B-TREE FOR'):
+                findings.append((SORT, detail.removeprefix('USE TEMP B-TREE FOR ')))
+        elif connection.vendor == 'postgresql':
+            node = detail.removeprefix('->').strip()
+            if node.startswith('Seq Scan on '):
+                findings.append((FULL_SCAN, node.split()[3]))
+            elif node.startswith('Sort Key: '):
+                findings.append((SORT, node.removeprefix('Sort Key: ')))
+    return findings
+
+
+def explain_request(client, path):
+    """GET path and return (status code, [{'sql', 'plan', 'findings'}, ...] for each SELECT it ran, in order)."""
+    collector = SelectCollector()
+    with query_wrapper(collector):
+        response = client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)  # Streaming views query while the body is consumed
+    results = []
+    for sql, params in collector.queries:
+        plan = explain(sql, params)
+        results.append({'sql': sql, 'plan': plan, 'findings': plan_findings(plan)})
+    return response.status_code, results
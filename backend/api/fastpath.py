@@ -0,0 +1,214 @@
+"""
+Compiled read path for the hottest list endpoints (books and reviews).
+
+The regular path loads model instances and runs each one through DRF's
+ModelSerializer machinery, field by field. Here the queryset is read with values()
+and each row dict becomes the response dict through a Reader compiled once per field
+selection from the serializer itself: columns whose database value already is the
+representation (ints, strings, booleans) are copied as they are, and the rest
+(decimals, dates) go through the serializer field's own to_representation(). Nested
+foreign keys are read through joins in the same query, many-to-many relations with
+one values() query per relation and batch, like prefetch_related().
+
+The serializers in api/serializers.py stay the reference: a Reader is built from
+their fields, so it follows them, and the output is the same dicts in the same key
+order. Fields computed in Python (method fields, string relations) have no column of
+their own; the view names the values() expression that gives the same value.
+
+FastJSONRenderer renders with orjson when it is installed and falls back to DRF's
+JSONRenderer for anything orjson would write differently.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F
+from rest_framework import serializers
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install orjson
+    orjson = None
+
+# Database values that already are their DRF representation
+PASSTHROUGH_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.BooleanField)
+
+# values() key of the owner id in many-to-many reads
+OWNER = '_owner_id'
+
+COLUMN, NESTED, MANY = range(3)
+
+# orjson writes floats in exponent notation differently ('1e16' for '1e+16', '0.00001' for
+# '1e-05'). Text in strings can match too, which only costs a fallback.
+FLOAT_MISMATCH = re.compile(rb'\de|0\.0000')
+
+_readers = {}
+
+
+class Reader:
+    """
+    Turns values() rows into the representation of a serializer instance.
+    columns maps fields computed in Python to the values() expression with the same value.
+    """
+
+    def __init__(self, serializer, columns=None, prefix=''):
+        columns = columns or {}
+        self.model = model = serializer.Meta.model
+        self.pk = prefix + model._meta.pk.name
+        self.columns = [self.pk]
+        self.steps = []
+        self.many = []  # (reader, owner key, related query name) of every list relation, nested ones included
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in columns:
+                self.add_column(name, prefix + columns[name], None)
+            elif isinstance(field, serializers.ListSerializer):
+                relation = model._meta.get_field(field.source)
+                if not relation.many_to_many:
+                    raise ImproperlyConfigured(f'{name}: only many-to-many relations can be read as lists')
+                reader = Reader(field.child)
+                if reader.many:
+                    raise ImproperlyConfigured(f'{name}: list relations cannot have list relations of their own')
+                self.steps.append((name, MANY, self.pk, reader))
+                self.many.append((reader, self.pk, relation.related_query_name()))
+            elif isinstance(field, serializers.BaseSerializer):
+                if not model._meta.get_field(field.source).many_to_one:
+                    raise ImproperlyConfigured(f'{name}: only foreign keys can be read as nested objects')
+                key = prefix + field.source
+                reader = Reader(field, prefix=f'{key}__')
+                self.columns += [key, *reader.columns]
+                self.steps.append((name, NESTED, key, reader))
+                self.many += reader.many
+            else:
+                model_field = model._meta.get_field(field.source)
+                if not model_field.concrete or model_field.is_relation:
+                    raise ImproperlyConfigured(f'{name}: no column for {field.source}; name its values() expression in columns')
+                convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+                self.add_column(name, prefix + field.source, convert)
+        self.columns = list(dict.fromkeys(self.columns))
+
+    def add_column(self, name, key, convert):
+        self.columns.append(key)
+        self.steps.append((name, COLUMN, key, convert))
+
+    def to_dict(self, row, related):
+        data = {}
+        for name, kind, key, step in self.steps:
+            value = row[key]
+            if kind == COLUMN:
+                # Like Serializer.to_representation(), None skips the field's conversion
+                data[name] = value if value is None or step is None else step(value)
+            elif kind == NESTED:
+                data[name] = None if value is None else step.to_dict(row, related)
+            else:
+                data[name] = related[step].get(value, [])
+        return data
+
+    def read(self, rows):
+        """Representations of rows (dicts from queryset.values(*reader.columns)), with their list relations."""
+        rows = list(rows)
+        related = [
+            reader.read_related(query_name, {row[owner_key] for row in rows} - {None})
+            for reader, owner_key, query_name in self.many
+        ]
+        return self.build(rows, related)
+
+    def build(self, rows, related):
+        """Representations of rows given the read_related() results of each of self.many, in order."""
+        grouped = {}
+        for (reader, _, _), items in zip(self.many, related):
+            grouped[reader] = by_owner = {}
+            for owner_id, item in items:
+                by_owner.setdefault(owner_id, []).append(item)
+        return [self.to_dict(row, grouped) for row in rows]
+
+    def read_related(self, query_name, owner_ids):
+        """(owner id, representation) for each row related to one of the owners through query_name."""
+        if not owner_ids:
+            return []
+        rows = self.model.objects.filter(**{f'{query_name}__in': owner_ids}).values(*self.columns, **{OWNER: F(query_name)})
+        related = {}
+        return [(row[OWNER], self.to_dict(row, related)) for row in rows]
+
+
+def get_reader(serializer, columns=None):
+    """The Reader of the serializer's current field selection, compiled on first use."""
+    columns = columns or {}
+    key = (
+        type(serializer),
+        tuple((name, type(field)) for name, field in serializer.fields.items()),
+        tuple(sorted(columns.items())),
+    )
+    reader = _readers.get(key)
+    if reader is None:
+        reader = _readers[key] = Reader(serializer, columns)
+    return reader
+
+
+def read_values(queryset, reader, ordering=()):
+    """
+    queryset as the values() rows reader needs, plus the plain columns it is ordered by
+    (or will be, with ordering) so the cursor paginator can read them from each row.
+    """
+    names = {field.name for field in queryset.model._meta.concrete_fields if not field.is_relation}
+    order_columns = [
+        term.lstrip('-') for term in [*queryset.query.order_by, *ordering]
+        if isinstance(term, str) and term.lstrip('-') in names
+    ]
+    columns = dict.fromkeys([*reader.columns, *order_columns])
+    # Joins come from the columns and list relations from Reader.read(), so these would only load objects
+    return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer with the same output, produced by orjson when it is installed. Anything
+    orjson can't write identically (indented or ASCII-only output, floats in exponent
+    notation, types it doesn't know) goes through JSONRenderer itself. The one difference
+    left is NaN and infinite floats, which orjson writes as null where JSONRenderer fails.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # Dates and dataclasses go to the encoder's default(), as they do with json.dumps
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:  # orjson.JSONEncodeError included: big ints, non-string keys, unknown types
+            return super().render(data, accepted_media_type, renderer_context)
+        if FLOAT_MISMATCH.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer too, for embedding in JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class CompiledListMixin:
+    """
+    list() on the compiled read path, for a viewset whose serializer a Reader can follow.
+    read_columns names the values() expression of each field computed in Python.
+    """
+    read_columns = {}
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_reader(self):
+        return get_reader(self.get_serializer(), self.read_columns)
+
+    def read_values(self, queryset, reader):
+        return read_values(queryset, reader, getattr(self.paginator, 'ordering', ()))
+
+    def list(self, request, *args, **kwargs):
+        reader = self.get_reader()
+        queryset = self.read_values(self.filter_queryset(self.get_queryset()), reader)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.read(page))
+        return Response(reader.read(queryset))
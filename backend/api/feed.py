@@ -0,0 +1,175 @@
+"""
+Home feeds.
+
+Reviews, review likes, additions to public lists and follows are recorded as
+Activity rows. Each activity is fanned out on write: one FeedEntry per follower of
+the actor, so reading a feed page is a single range scan on that user's entries
+however many people they follow.
+
+Activity of users with more than settings.FEED_FANOUT_LIMIT followers is not fanned
+out, since one of their reviews would mean that many inserts. It is saved with
+fanned_out=False and pulled on read instead (fan out on read), then merged into the
+page. A partial index holds only that activity: finding the followed accounts that
+have any takes one probe per follow, and pulling it one range scan per such account.
+The flag is set when the activity is created, so what an account did while over the
+limit is still pulled after it drops back under, and vice versa.
+
+Feeds are ordered newest first by (created_at, activity id). `manage.py rebuild_feeds`
+recreates activities from the source tables and refills every feed.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Activity, FeedEntry, Follow, Profile, Review, ReviewLike
+
+REVIEWED = 'reviewed'
+LIKED_REVIEW = 'liked_review'
+ADDED_TO_LIST = 'added_to_list'
+FOLLOWED = 'followed'
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def is_fanned_out(user_id):
+    return not Profile.objects.filter(user_id=user_id, followers_count__gt=settings.FEED_FANOUT_LIMIT).exists()
+
+
+def record_activity(user_id, action, book_id=None, target_user_id=None, review_id=None):
+    """Create an activity and copy it into the feeds of the actor's followers."""
+    activity = Activity.objects.create(
+        user_id=user_id, action=action, book_id=book_id, target_user_id=target_user_id, review_id=review_id,
+        fanned_out=is_fanned_out(user_id),
+    )
+    if activity.fanned_out:
+        follower_ids = Follow.objects.filter(followed_id=user_id).values_list('follower_id', flat=True)
+        add_to_feeds(activity, follower_ids.iterator(chunk_size=FANOUT_BATCH_SIZE))
+    return activity
+
+
+def record_activities(user_id, activities):
+    """record_activity() for unsaved activities of one user, inserted and fanned out in bulk."""
+    fanned_out = is_fanned_out(user_id)
+    for activity in activities:
+        activity.fanned_out = fanned_out
+    activities = Activity.objects.bulk_create(activities, batch_size=FANOUT_BATCH_SIZE)
+    if not activities or not fanned_out:
+        return activities
+    follower_ids = list(Follow.objects.filter(followed_id=user_id).values_list('follower_id', flat=True))
+    entries = (
+        FeedEntry(user_id=follower_id, activity=activity, created_at=activity.created_at)
+        for activity in activities for follower_id in follower_ids
+    )
+    while batch := list(islice(entries, FANOUT_BATCH_SIZE)):
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    return activities
+
+
+def add_to_feeds(activity, user_ids):
+    user_ids = iter(user_ids)
+    while batch := list(islice(user_ids, FANOUT_BATCH_SIZE)):
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, activity=activity, created_at=activity.created_at) for user_id in batch],
+            ignore_conflicts=True,
+        )
+
+
+def backfill_feed(user_id, followed_id, limit=None):
+    """Copy the recent activity of a newly followed user into the follower's feed."""
+    # Activity that wasn't fanned out is read on demand anyway
+    activities = Activity.objects.filter(user_id=followed_id, fanned_out=True).order_by('-created_at', '-id')
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, activity_id=pk, created_at=created_at)
+            for pk, created_at in activities.values_list('pk', 'created_at')[:limit or settings.FEED_BACKFILL_SIZE]
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def forget_feed(user_id, followed_id):
+    """Drop an unfollowed user's activity from the follower's feed."""
+    FeedEntry.objects.filter(user_id=user_id, activity__user_id=followed_id).delete()
+
+
+def rebuild_feeds(user_ids, size=None):
+    """Refill the given users' feeds with the latest fanned out activity of everyone they follow."""
+    size = size or settings.FEED_BACKFILL_SIZE
+    entries = []
+    for user_id in user_ids:
+        followed = Follow.objects.filter(follower_id=user_id).values('followed_id')
+        activities = Activity.objects.filter(user_id__in=followed, fanned_out=True).order_by('-created_at', '-id')
+        entries += [
+            FeedEntry(user_id=user_id, activity_id=pk, created_at=created_at)
+            for pk, created_at in activities.values_list('pk', 'created_at')[:size]
+        ]
+    with transaction.atomic():
+        FeedEntry.objects.filter(user_id__in=user_ids).delete()
+        FeedEntry.objects.bulk_create(entries, batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True)
+    return len(entries)
+
+
+def rebuild_activities():
+    """
+    Recreate the activities derived from reviews, likes and follows, e.g. after a bulk load
+    that skipped the signals. List additions have no source table to rebuild them from.
+    """
+    FeedEntry.objects.all().delete()
+    Activity.objects.filter(action__in=[REVIEWED, LIKED_REVIEW, FOLLOWED]).delete()
+    activity, review, like, follow = (
+        model._meta.db_table for model in (Activity, Review, ReviewLike, Follow)
+    )
+    columns = f'INSERT INTO {activity} (user_id, action, book_id, target_user_id, review_id, created_at, fanned_out) '
+    with connection.cursor() as cursor:
+        cursor.execute(
+            columns + f'SELECT user_id, %s, book_id, NULL, id, created_at, %s FROM {review}', [REVIEWED, True],
+        )
+        cursor.execute(
+            columns + f'SELECT l.user_id, %s, r.book_id, r.user_id, r.id, l.created_at, %s '
+            f'FROM {like} l JOIN {review} r ON r.id = l.review_id',
+            [LIKED_REVIEW, True],
+        )
+        cursor.execute(
+            columns + f'SELECT follower_id, %s, NULL, followed_id, NULL, created_at, %s FROM {follow}',
+            [FOLLOWED, True],
+        )
+    Activity.objects.filter(
+        action__in=[REVIEWED, LIKED_REVIEW, FOLLOWED], user__profile__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).update(fanned_out=False)
+
+
+def before(position, created_at_field, id_field):
+    """Rows strictly older than position = (created_at, id) in the feed order."""
+    if position is None:
+        return Q()
+    created_at, pk = position
+    return Q(**{f'{created_at_field}__lt': created_at}) | Q(**{created_at_field: created_at, f'{id_field}__lt': pk})
+
+
+def read_feed(user, position=None, limit=20):
+    """The next `limit` activities of a user's feed after position (created_at, id), newest first."""
+    rows = list(
+        FeedEntry.objects.filter(before(position, 'created_at', 'activity_id'), user=user)
+        .order_by('-created_at', '-activity_id').values_list('created_at', 'activity_id')[:limit]
+    )
+
+    pulled = list(
+        Follow.objects.filter(
+            Exists(Activity.objects.filter(user=OuterRef('followed'), fanned_out=False)), follower=user,
+        ).values_list('followed_id', flat=True)
+    )
+    if pulled:
+        rows += (
+            Activity.objects.filter(before(position, 'created_at', 'id'), user_id__in=pulled, fanned_out=False)
+            .order_by('-created_at', '-id').values_list('created_at', 'id')[:limit]
+        )
+        # Migration 0023 flagged all activity of the accounts then over the limit, including what was
+        # fanned out before they crossed it, so a pulled activity can also have an entry; keep one of each
+        rows = sorted(set(rows), reverse=True)[:limit]
+
+    activities = Activity.objects.filter(pk__in=[pk for _, pk in rows]).select_related(
+        'user', 'target_user', 'book__publisher',
+    ).prefetch_related('book__authors', 'book__genres').in_bulk()
+    return [activities[pk] for _, pk in rows if pk in activities]
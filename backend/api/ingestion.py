@@ -0,0 +1,163 @@
+"""
+Bulk catalog ingestion.
+
+CatalogIngestor turns batches of plain book records into a handful of set-based
+queries: authors, publishers and genres are resolved with one lookup per batch and
+the missing ones created with bulk_create(ignore_conflicts=True), books are
+upserted (on ISBN, or on title for books without one) and the author/genre
+through-table rows are rewritten in bulk, all inside one transaction per batch.
+Re-running an import updates books in place instead of duplicating them.
+
+A record is a dict with a required 'title' and optional 'isbn', 'authors' (list of
+names), 'publisher' (name), 'genres' (list of names), 'publication_date',
+'description', 'page_count', 'cover_url' and 'average_rating'.
+
+Bulk writes skip model signals, so each batch refreshes the search index, the facet
+bitmaps and the book response cache itself.
+"""
+from django.db import transaction
+
+from .caching import bump_versions
+from .covers import source_key
+from .facets import record_changes
+from .models import Author, Book, Genre, Publisher
+from .search import reindex_books
+
+# Fields an import refreshes on books that already exist. average_rating is only set on
+# creation: once a book has reviews it is owned by the rating aggregates.
+UPDATE_FIELDS = ['title', 'publisher', 'publication_date', 'description', 'page_count', 'cover_url', 'cover_key']
+
+
+class CatalogIngestor:
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+
+    def ingest(self, records):
+        """Ingest an iterable of records in batches. Returns (created, updated, skipped) so far."""
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.ingest_batch(batch)
+                batch = []
+        if batch:
+            self.ingest_batch(batch)
+        return self.created, self.updated, self.skipped
+
+    def ingest_batch(self, records):
+        records = self.clean(records)
+        if not records:
+            return []
+
+        with transaction.atomic():
+            authors = self.resolve(Author, 'name', {name for r in records for name in r['authors']}, {'bio': ''})
+            genres = self.resolve(Genre, 'name', {name for r in records for name in r['genres']})
+            publishers = self.resolve(Publisher, 'name', {r['publisher'] for r in records if r['publisher']}, {'website': ''})
+
+            books = self.upsert_books(records, publishers)
+            saved = [(book, record) for book, record in zip(books, records) if book.pk is not None]
+            book_ids = [book.pk for book, _ in saved]
+            self.replace_links(Book.authors.through, 'author_id', saved, authors, 'authors')
+            self.replace_links(Book.genres.through, 'genre_id', saved, genres, 'genres')
+
+            reindex_books(book_ids)
+            record_changes(book_ids)
+            bump_versions(book_ids)
+        return book_ids
+
+    def clean(self, records):
+        """Normalize records and drop duplicates within the batch (same ISBN, or same title without one)."""
+        cleaned = []
+        seen = set()
+        for record in records:
+            title = (record.get('title') or '').strip()[:255]
+            isbn = (record.get('isbn') or '').strip()[:13] or None
+            key = ('isbn', isbn) if isbn else ('title', title)
+            if not title or key in seen:
+                self.skipped += 1
+                continue
+            seen.add(key)
+            cleaned.append({
+                'title': title,
+                'isbn': isbn,
+                'authors': list(dict.fromkeys(name.strip()[:255] for name in record.get('authors') or [] if name.strip())),
+                'genres': list(dict.fromkeys(name.strip()[:100] for name in record.get('genres') or [] if name.strip())),
+                'publisher': (record.get('publisher') or '').strip()[:255] or None,
+                'publication_date': record.get('publication_date'),
+                'description': record.get('description') or '',
+                'page_count': record.get('page_count'),
+                'cover_url': record.get('cover_url'),
+                'average_rating': record.get('average_rating'),
+            })
+        return cleaned
+
+    def resolve(self, model, field, names, defaults=None):
+        """Map each name to its row, creating the missing ones in bulk."""
+        if not names:
+            return {}
+        found = model.objects.in_bulk(names, field_name=field)
+        missing = names - found.keys()
+        if missing:
+            model.objects.bulk_create(
+                [model(**{field: name}, **(defaults or {})) for name in missing],
+                ignore_conflicts=True,
+            )
+            # ignore_conflicts leaves primary keys unset, so read the new rows back
+            found.update(model.objects.in_bulk(missing, field_name=field))
+        return found
+
+    def upsert_books(self, records, publishers):
+        isbns = [r['isbn'] for r in records if r['isbn']]
+        titles = [r['title'] for r in records if not r['isbn']]
+        by_isbn = Book.objects.in_bulk(isbns, field_name='isbn') if isbns else {}
+        by_title = {}
+        if titles:
+            for book in Book.objects.filter(isbn__isnull=True, title__in=titles).order_by('pk'):
+                by_title.setdefault(book.title, book)
+
+        books, to_update, to_create = [], [], []
+        for record in records:
+            book = by_isbn.get(record['isbn']) if record['isbn'] else by_title.get(record['title'])
+            if book is None:
+                book = Book(isbn=record['isbn'], average_rating=record['average_rating'])
+                to_create.append(book)
+            else:
+                to_update.append(book)
+            book.title = record['title']
+            book.publisher = publishers.get(record['publisher'])
+            book.publication_date = record['publication_date']
+            book.description = record['description']
+            book.page_count = record['page_count']
+            book.cover_url = record['cover_url']
+            book.cover_key = source_key(book.cover.name, book.cover_url)
+            books.append(book)
+
+        if to_update:
+            Book.objects.bulk_update(to_update, UPDATE_FIELDS)
+        if to_create:
+            # A concurrent import may have inserted the same ISBN since the lookup; update it instead of failing
+            Book.objects.bulk_create(
+                to_create, update_conflicts=True, unique_fields=['isbn'], update_fields=UPDATE_FIELDS,
+            )
+            unsaved = [book.isbn for book in to_create if book.pk is None and book.isbn]
+            if unsaved:
+                ids = dict(Book.objects.filter(isbn__in=unsaved).values_list('isbn', 'pk'))
+                for book in to_create:
+                    if book.pk is None:
+                        book.pk = ids.get(book.isbn)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        return books
+
+    def replace_links(self, through, target_field, saved, targets, key):
+        """Make each book's M2M rows exactly match its record: one DELETE and one bulk INSERT."""
+        through.objects.filter(book_id__in=[book.pk for book, _ in saved]).delete()
+        rows = [
+            through(book_id=book.pk, **{target_field: targets[name].pk})
+            for book, record in saved
+            for name in record[key] if name in targets
+        ]
+        through.objects.bulk_create(rows, ignore_conflicts=True)
@@ -0,0 +1,277 @@
+import gc
+import json
+import logging
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+from io import StringIO
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.concurrency import query_wrapper
+from api.explain import FULL_SCAN, SORT, explain_request
+from api.metrics import QueryTimer
+from api.models import Book, Profile
+
+BUDGETS_FILE = settings.BASE_DIR / 'benchmark_budgets.json'
+
+# Hot endpoints, as the frontend calls them. {book} is the most reviewed book and the
+# requests are made as the most active reviewer, who is also made an admin for /api/analytics/.
+ENDPOINTS = [
+    ('books_list', '/api/books/'),
+    ('books_top_rated', '/api/books/?ordering=-average_rating&limit=10'),
+    ('book_detail', '/api/books/{book}/'),
+    ('books_trending', '/api/books/trending/?window=week'),
+    ('books_facets', '/api/books/?facets=true&year_min=1950&page_size=20'),
+    ('book_reviews', '/api/reviews/?book={book}'),
+    ('my_reviews', '/api/reviews/?user=me'),
+    ('user_stats', '/api/user/stats/'),
+    ('user_activity', '/api/user/activity/'),
+    ('feed', '/api/feed/'),
+    ('analytics', '/api/analytics/'),
+]
+
+# Dataset at --scale 1; every count is multiplied by the scale
+DATASET = {
+    'books': 500,
+    'users': 1000,
+    'reviews': 20000,
+    'likes': 40000,
+    'follows': 3000,
+    'diary_entries': 5000,
+}
+
+# Margin added on top of measured values by --update-budgets. Query, scan and sort counts are exact.
+BUDGET_HEADROOM = {'p95_ms': 2.0, 'peak_memory_kb': 1.5}
+
+
+def pick_subjects():
+    """(most active reviewer, most reviewed book), the user and book the endpoints are requested for."""
+    user = User.objects.annotate(n=Count('reviews')).order_by('-n', 'pk').first()
+    book = Book.objects.order_by('-rating_count', 'pk').first()
+    return user, book
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the hot API endpoints against a seeded dataset in a throwaway test database. '
+        'Records p50/p95 latency, SQL query count, peak memory and the full scans and sorts in the query '
+        'plans per endpoint, compares them with benchmark_budgets.json and fails on regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per endpoint (default 30)')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per endpoint first (default 3)')
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the size of the seeded dataset (default 1.0)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed of the dataset (default 42)')
+        parser.add_argument('--endpoint', action='append', help='Only run the named endpoint; may be repeated')
+        parser.add_argument('--output', metavar='FILE', help='Write the results as JSON to FILE')
+        parser.add_argument('--budgets', metavar='FILE', default=str(BUDGETS_FILE), help='Budget file to compare with')
+        parser.add_argument(
+            '--update-budgets',
+            action='store_true',
+            help='Write the budget file from this run (with headroom on latency and memory) instead of comparing'
+        )
+        parser.add_argument(
+            '--warm-cache',
+            action='store_true',
+            help='Keep the response cache between requests; by default it is cleared so every request does the full work'
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        endpoints = [(name, path) for name, path in ENDPOINTS if not options['endpoint'] or name in options['endpoint']]
+        if not endpoints:
+            raise CommandError(f'Unknown endpoint; choose from {", ".join(name for name, _ in ENDPOINTS)}')
+
+        dataset = {key: max(int(count * options['scale']), 1) for key, count in DATASET.items()}
+        request_logger = logging.getLogger('api.requests')
+        log_level = request_logger.level
+        request_logger.setLevel(logging.WARNING)
+
+        # Never touch the real database: seed and measure in a test database that is dropped afterwards
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {", ".join(f"{count} {key}" for key, count in dataset.items())}...')
+            client, subjects = self.seed(dataset, options['seed'])
+            endpoint_results = {}
+            for name, path in endpoints:
+                path = path.format(**subjects)
+                endpoint_results[name] = self.measure(client, path, options)
+                self.stdout.write(self.format_result(name, endpoint_results[name]))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            request_logger.setLevel(log_level)
+
+        results = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'seed': options['seed'],
+                'scale': options['scale'],
+                'iterations': options['iterations'],
+                'warm_cache': options['warm_cache'],
+                'dataset': dataset,
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'endpoints': endpoint_results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['update_budgets']:
+            self.write_budgets(options['budgets'], results)
+        else:
+            self.check_budgets(options['budgets'], results)
+
+    def seed(self, dataset, seed):
+        call_command(
+            'populate_users_reviews',
+            books=dataset['books'],
+            users=dataset['users'],
+            reviews=dataset['reviews'],
+            likes=dataset['likes'],
+            follows=dataset['follows'],
+            diary_entries=dataset['diary_entries'],
+            seed=seed,
+            stdout=StringIO(),
+        )
+        user, book = pick_subjects()
+        Profile.objects.update_or_create(user=user, defaults={'role': 'admin'})
+
+        client = APIClient()
+        client.force_authenticate(user)
+        return client, {'book': book.pk, 'user': user.pk}
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} returned {response.status_code}')
+        # Streaming responses only do their work while being consumed
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return len(content)
+
+    def measure(self, client, path, options):
+        def run():
+            if not options['warm_cache']:
+                cache.clear()
+            return self.request(client, path)
+
+        for _ in range(options['warmup']):
+            run()
+
+        timings = []
+        for _ in range(options['iterations']):
+            start = time.perf_counter()
+            size = run()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        # Query count and memory come from separate runs so neither instrument skews the timings
+        # Counted with a query wrapper, which also sees the queries async views run on other threads
+        queries = QueryTimer()
+        with query_wrapper(queries):
+            run()
+        query_count = queries.count
+        # Garbage left by the runs above would otherwise set off a collection at a different point of this one
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # Index coverage: full table scans and unindexed sorts in the plans of the queries run
+        if not options['warm_cache']:
+            cache.clear()
+        _, explained = explain_request(client, path)
+        findings = [kind for query in explained for kind, _ in query['findings']]
+
+        return {
+            'path': path,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'queries': query_count,
+            'peak_memory_kb': round(peak / 1024, 1),
+            'full_scans': findings.count(FULL_SCAN),
+            'sorts': findings.count(SORT),
+            'response_bytes': size,
+        }
+
+    def format_result(self, name, result):
+        return (
+            f'{name:<18} p50 {result["p50_ms"]:>8.2f} ms  p95 {result["p95_ms"]:>8.2f} ms  '
+            f'{result["queries"]:>3} queries  {result["peak_memory_kb"]:>9.1f} KB peak  '
+            f'{result["full_scans"]} scans  {result["sorts"]} sorts'
+        )
+
+    def load_budgets(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_budgets(self, path, results):
+        budgets = self.load_budgets(path) or {}
+        budgets['dataset'] = {'seed': results['meta']['seed'], 'scale': results['meta']['scale']}
+        endpoints = budgets.setdefault('endpoints', {})
+        for name, result in results['endpoints'].items():
+            endpoints[name] = {
+                'p95_ms': math.ceil(result['p95_ms'] * BUDGET_HEADROOM['p95_ms']),
+                'queries': result['queries'],
+                'full_scans': result['full_scans'],
+                'sorts': result['sorts'],
+                'peak_memory_kb': math.ceil(result['peak_memory_kb'] * BUDGET_HEADROOM['peak_memory_kb']),
+            }
+        with open(path, 'w') as f:
+            json.dump(budgets, f, indent=2)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f'Budgets written to {path}'))
+
+    def check_budgets(self, path, results):
+        budgets = self.load_budgets(path)
+        if budgets is None:
+            self.stdout.write(self.style.WARNING(f'No budget file at {path}; run with --update-budgets to create one.'))
+            return
+        expected = {'seed': results['meta']['seed'], 'scale': results['meta']['scale']}
+        if budgets.get('dataset') != expected:
+            self.stdout.write(self.style.WARNING(
+                f'Budgets are for dataset {budgets.get("dataset")}, not {expected}; skipping the comparison.'
+            ))
+            return
+
+        failures = []
+        for name, result in results['endpoints'].items():
+            budget = budgets.get('endpoints', {}).get(name)
+            if budget is None:
+                self.stdout.write(self.style.WARNING(f'No budget for {name}'))
+                continue
+            for metric, limit in budget.items():
+                if result[metric] > limit:
+                    failures.append(f'{name}: {metric} {result[metric]} exceeds budget {limit}')
+
+        if failures:
+            raise CommandError('Benchmark budgets exceeded:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS(f'All {len(results["endpoints"])} endpoints within budget.'))
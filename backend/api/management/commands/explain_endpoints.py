@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from api.explain import explain_request
+from .benchmark import ENDPOINTS, pick_subjects
+
+class Command(BaseCommand):
+    help = (
+        'Run the hot API endpoints against the current database, EXPLAIN every SELECT they execute '
+        'and flag full table scans and sorts that no index covers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', help='Only explain the named endpoint; may be repeated')
+        parser.add_argument('--plans', action='store_true', help='Print the SQL and full plan of every query')
+        parser.add_argument('--fail-on-findings', action='store_true', help='Exit with an error if anything is flagged')
+
+    def handle(self, *args, **options):
+        endpoints = [(name, path) for name, path in ENDPOINTS if not options['endpoint'] or name in options['endpoint']]
+        if not endpoints:
+            raise CommandError(f'Unknown endpoint; choose from {", ".join(name for name, _ in ENDPOINTS)}')
+        user, book = pick_subjects()
+        if user is None or book is None:
+            raise CommandError('Explaining needs at least one user with reviews and one book; populate the database first.')
+
+        client = APIClient()
+        client.force_authenticate(user)
+        flagged = 0
+        for name, path in endpoints:
+            path = path.format(book=book.pk, user=user.pk)
+            # The test client's requests come from 'testserver'
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                status_code, queries = explain_request(client, path)
+            if status_code != 200:
+                self.stdout.write(self.style.WARNING(f'{name}: GET {path} returned {status_code}, skipped'))
+                continue
+            findings = [(i, finding) for i, query in enumerate(queries, 1) for finding in query['findings']]
+            flagged += bool(findings)
+            style = self.style.WARNING if findings else self.style.SUCCESS
+            self.stdout.write(style(f'{name}: {len(queries)} queries, {len(findings)} findings'))
+            for i, (kind, detail) in findings:
+                self.stdout.write(f'  query {i}: {kind} {detail}')
+            if options['plans']:
+                for i, query in enumerate(queries, 1):
+                    self.stdout.write(f'  query {i}: {query["sql"]}')
+                    for line in query['plan']:
+                        self.stdout.write(f'    {line}')
+
+        if flagged and options['fail_on_findings']:
+            raise CommandError(f'{flagged} endpoints run queries without a supporting index')
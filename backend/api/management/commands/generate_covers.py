@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from api.covers import CoverError, generate, is_cached
+from api.models import Book
+
+class Command(BaseCommand):
+    help = 'Render the resized WebP covers of every book with a cover into COVER_CACHE_DIR before anyone requests them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Covers fetched and rendered at once (default 4)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Render covers that are already cached again'
+        )
+
+    def handle(self, *args, **options):
+        # Books sharing a source share its variants, so each key is rendered once
+        sources = {}
+        for key, cover_name, cover_url in (
+            Book.objects.exclude(cover_key='').values_list('cover_key', 'cover', 'cover_url').iterator(chunk_size=10_000)
+        ):
+            sources.setdefault(key, (cover_name, cover_url))
+        if not options['force']:
+            sources = {key: source for key, source in sources.items() if not is_cached(key)}
+        self.stdout.write(f'Rendering {len(sources)} covers...')
+
+        def run(item):
+            key, (cover_name, cover_url) = item
+            try:
+                generate(key, cover_name, cover_url)
+            except CoverError as e:
+                return e
+            return None
+
+        failed = 0
+        workers = max(options['workers'], 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # A bounded window of jobs in flight rather than one future per cover up front
+            items = iter(sources.items())
+            pending = []
+            done = 0
+            while True:
+                while len(pending) < workers * 4:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.append(executor.submit(run, item))
+                if not pending:
+                    break
+                error = pending.pop(0).result()
+                done += 1
+                if error is not None:
+                    failed += 1
+                    self.stdout.write(f'Skipped a cover: {error}')
+                if done % 500 == 0:
+                    self.stdout.write(f'Rendered {done}/{len(sources)} covers...')
+        self.stdout.write(self.style.SUCCESS(f'Rendered {len(sources) - failed} covers ({failed} failed).'))
@@ -1,146 +1,168 @@
 import os
-import requests
+import re
 from django.core.management.base import BaseCommand
 from django.core.files.base import ContentFile
+from api.caching import bump_versions
+from api.covers import source_key
+from api.fetching import Checkpoint, FetchError, add_fetch_arguments, fetcher_from_options
+from api.ingestion import CatalogIngestor
 from api.models import Author, Publisher, Book
 
 class Command(BaseCommand):
-    help = 'Populate the database with popular fantasy books from Google Books API'
+    help = 'Populate the database with popular fantasy books from Google Books API (safe to re-run: books are upserted on ISBN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-books',
+            type=int,
+            default=100,
+            help='Stop after this many books have been ingested (default 100)'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete all existing books, authors and publishers before importing'
+        )
+        parser.add_argument(
+            '--skip-covers',
+            action='store_true',
+            help='Do not download cover images'
+        )
+        add_fetch_arguments(parser)
 
     def handle(self, *args, **options):
-        self.stdout.write('Clearing existing book data...')
-        Book.objects.all().delete()
-        Author.objects.all().delete()
-        Publisher.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
+        if options['clear']:
+            self.stdout.write('Clearing existing book data...')
+            Book.objects.all().delete()
+            Author.objects.all().delete()
+            Publisher.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
 
         api_key = os.getenv('GOOGLE_API_KEY')
-        base_url = 'https://www.googleapis.com/books/v1/volumes'
-        
+        base_url = options['base_url'] or 'https://www.googleapis.com/books/v1/volumes'
+        max_books = options['max_books']
+        fetcher = fetcher_from_options(options)
+        checkpoint = Checkpoint(options['checkpoint'])
+
         # Search queries to get popular fantasy books
         queries = ['fantasy novel', 'fantasy bestseller', 'popular fantasy novel', 'epic fantasy novel']
-        books_created = 0
-        max_books = 100
-        
-        for query in queries:
-            if books_created >= max_books:
+        ingestor = CatalogIngestor()
+        books_ingested = checkpoint.counter('books_ingested')
+        failed = 0
+
+        pages = [
+            (base_url, {'q': query, 'maxResults': 40, 'key': api_key})  # API max is 40 per request
+            for query in queries if not checkpoint.is_done(query)
+        ]
+        try:
+            for (url, params), result in fetcher.fetch_many(pages):
+                if books_ingested >= max_books:
+                    break
+                query = params['q']
+                if isinstance(result, FetchError):
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f'Error fetching data for query "{query}": {result}'))
+                    continue
+
+                records = []
+                cover_urls = {}
+                for item in result.get('items', []):
+                    record, cover_url = self.item_to_record(item.get('volumeInfo', {}))
+                    if record:
+                        records.append(record)
+                        if cover_url:
+                            cover_urls[record['isbn'] or record['title']] = cover_url
+                records = records[:max_books - books_ingested]
+
+                book_ids = ingestor.ingest_batch(records)
+                books_ingested += len(book_ids)
+                if not options['skip_covers']:
+                    self.save_covers(fetcher, book_ids, cover_urls)
+                checkpoint.mark(query, books_ingested=books_ingested)
+                self.stdout.write(f'Ingested {books_ingested} books (query "{query}")')
+        finally:
+            fetcher.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully ingested {books_ingested} popular fantasy books from Google Books API '
+            f'({ingestor.created} created, {ingestor.updated} updated, {ingestor.skipped} skipped as duplicates)'
+        ))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} pages failed; re-run with the same --checkpoint to retry them'))
+        else:
+            checkpoint.clear()
+
+    def item_to_record(self, volume_info):
+        """Turn a Google Books volumeInfo into (ingestion record, cover URL), or (None, None) to skip it."""
+        title = volume_info.get('title', '')
+
+        # Get rating; skip if not popular enough (require at least 3.0 rating and 5+ ratings, or no rating)
+        average_rating = volume_info.get('averageRating')
+        ratings_count = volume_info.get('ratingsCount', 0)
+        if not title or (average_rating and (average_rating < 3.0 or ratings_count < 5)):
+            return None, None
+
+        # Normalize published_date to YYYY-MM-DD format
+        published_date = volume_info.get('publishedDate', '')
+        if published_date:
+            if len(published_date) == 4:  # Year only
+                published_date = f"{published_date}-01-01"
+            elif len(published_date) == 7:  # Year-Month
+                published_date = f"{published_date}-01"
+            elif len(published_date) == 10:  # Already YYYY-MM-DD
+                pass
+            else:
+                published_date = None  # Invalid format
+        else:
+            published_date = None
+        description = volume_info.get('description', '')
+        categories = volume_info.get('categories', [])
+
+        # Get ISBN
+        isbn = None
+        for identifier in volume_info.get('industryIdentifiers', []):
+            if identifier.get('type') == 'ISBN_13':
+                isbn = identifier.get('identifier')
+                break
+            elif identifier.get('type') == 'ISBN_10' and not isbn:
+                isbn = identifier.get('identifier')
+
+        # Prefer larger image sizes
+        image_links = volume_info.get('imageLinks', {})
+        cover_url = None
+        for size in ['extraLarge', 'large', 'medium', 'thumbnail']:
+            if image_links.get(size):
+                cover_url = image_links[size]
                 break
-                
-            params = {
-                'q': query,
-                'maxResults': 40,  # API max is 40 per request
-                'key': api_key
-            }
-            
-            try:
-                response = requests.get(base_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                items = data.get('items', [])
-                
-                for item in items:
-                    if books_created >= max_books:
-                        break
-                        
-                    volume_info = item.get('volumeInfo', {})
-                    
-                    # Extract book data
-                    title = volume_info.get('title', '')
-                    authors = volume_info.get('authors', [])
-                    publisher_name = volume_info.get('publisher', 'Unknown Publisher')
-                    published_date = volume_info.get('publishedDate', '')
-                    
-                    # Normalize published_date to YYYY-MM-DD format
-                    if published_date:
-                        if len(published_date) == 4:  # Year only
-                            published_date = f"{published_date}-01-01"
-                        elif len(published_date) == 7:  # Year-Month
-                            published_date = f"{published_date}-01"
-                        elif len(published_date) == 10:  # Already YYYY-MM-DD
-                            pass
-                        else:
-                            published_date = None  # Invalid format
-                    else:
-                        published_date = None
-                    description = volume_info.get('description', '')
-                    page_count = volume_info.get('pageCount', 0)
-                    categories = volume_info.get('categories', [])
-                    genre = categories[0] if categories else 'Unknown'
-                    
-                    # Get ISBN
-                    isbn = None
-                    for identifier in volume_info.get('industryIdentifiers', []):
-                        if identifier.get('type') == 'ISBN_13':
-                            isbn = identifier.get('identifier')
-                            break
-                        elif identifier.get('type') == 'ISBN_10' and not isbn:
-                            isbn = identifier.get('identifier')
-                    
-                    # Get rating
-                    average_rating = volume_info.get('averageRating')
-                    ratings_count = volume_info.get('ratingsCount', 0)
-                    
-                    # Skip if not popular enough (require at least 3.0 rating and 5+ ratings, or no rating but skip if very low)
-                    if average_rating and (average_rating < 3.0 or ratings_count < 5):
-                        continue
-                    
-                    # Skip if no title or already exists
-                    if not title or Book.objects.filter(title=title).exists():
-                        continue
-                    
-                    # Create or get publisher
-                    publisher, _ = Publisher.objects.get_or_create(
-                        name=publisher_name,
-                        defaults={'website': ''}
-                    )
-                    
-                    # Create book
-                    book = Book.objects.create(
-                        title=title,
-                        description=description[:500] if description else '',  # Truncate if too long
-                        isbn=isbn,
-                        genre=genre,
-                        page_count=page_count,
-                        publication_date=published_date,
-                        publisher=publisher,
-                        average_rating=average_rating if average_rating else None
-                    )
-                    
-                    # Download cover image
-                    image_links = volume_info.get('imageLinks', {})
-                    cover_url = None
-                    # Prefer larger image sizes
-                    for size in ['extraLarge', 'large', 'medium', 'thumbnail']:
-                        if image_links.get(size):
-                            cover_url = image_links[size]
-                            break
-                    if cover_url:
-                        try:
-                            img_response = requests.get(cover_url)
-                            img_response.raise_for_status()
-                            # Create a safe filename from title
-                            import re
-                            safe_title = re.sub(r'[^\w\-_\. ]', '', title)[:50].strip().replace(' ', '_')
-                            filename = f"{safe_title}.jpg"
-                            book.cover.save(filename, ContentFile(img_response.content), save=True)
-                            self.stdout.write(f'Saved cover for: {title}')
-                        except requests.RequestException as e:
-                            self.stdout.write(f'Failed to download cover for: {title} - {e}')
-                    
-                    # Create authors
-                    for author_name in authors:
-                        author, _ = Author.objects.get_or_create(
-                            name=author_name,
-                            defaults={'bio': '', 'birth_date': None, 'death_date': None}
-                        )
-                        book.authors.add(author)
-                    
-                    books_created += 1
-                    self.stdout.write(f'Created book: {title}')
-                    
-            except requests.RequestException as e:
-                self.stdout.write(self.style.ERROR(f'Error fetching data for query "{query}": {e}'))
+
+        record = {
+            'title': title,
+            'isbn': isbn,
+            'authors': volume_info.get('authors', []),
+            'publisher': volume_info.get('publisher', 'Unknown Publisher'),
+            'genres': [categories[0] if categories else 'Unknown'],
+            'publication_date': published_date,
+            'description': description[:500] if description else '',  # Truncate if too long
+            'page_count': volume_info.get('pageCount', 0),
+            'average_rating': average_rating if average_rating else None,
+        }
+        return record, cover_url
+
+    def save_covers(self, fetcher, book_ids, cover_urls):
+        """Download the covers of one batch concurrently, then store them on the books."""
+        books = {book.isbn or book.title: book for book in Book.objects.filter(pk__in=book_ids)}
+        downloads = [(cover_urls[key], None) for key in books if key in cover_urls]
+        keys_by_url = {cover_urls[key]: key for key in books if key in cover_urls}
+
+        for (url, _), content in fetcher.fetch_many(downloads, fetch=fetcher.get):
+            book = books[keys_by_url[url]]
+            if isinstance(content, FetchError):
+                self.stdout.write(f'Failed to download cover for: {book.title} - {content}')
                 continue
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully created {books_created} popular fantasy books from Google Books API'))
\ No newline at end of file
+            # Create a safe filename from title
+            safe_title = re.sub(r'[^\w\-_\. ]', '', book.title)[:50].strip().replace(' ', '_')
+            book.cover.save(f"{safe_title}.jpg", ContentFile(content), save=False)
+            # A stored cover replaces cover_url as the source of the book's resized covers
+            Book.objects.filter(pk=book.pk).update(cover=book.cover.name, cover_key=source_key(book.cover.name, book.cover_url))
+            bump_versions([book.pk])
+            self.stdout.write(f'Saved cover for: {book.title}')
@@ -1,123 +1,141 @@
-import os
-import requests
+import math
 import random
 from django.core.management.base import BaseCommand
-from django.core.files.base import ContentFile
-from api.models import Author, Publisher, Book, Genre
+from api.fetching import Checkpoint, FetchError, add_fetch_arguments, fetcher_from_options
+from api.ingestion import CatalogIngestor
+from api.models import Author, Publisher, Book
 
 class Command(BaseCommand):
-    help = 'Populate the database with popular fantasy books from Open Library API'
+    help = 'Populate the database with popular fantasy books from Open Library API (safe to re-run: books are upserted on ISBN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-books',
+            type=int,
+            default=100,
+            help='Stop after this many books have been ingested (default 100)'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Number of results requested per Open Library search page (default 100)'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete all existing books, authors and publishers before importing'
+        )
+        add_fetch_arguments(parser)
 
     def handle(self, *args, **options):
-        self.stdout.write('Clearing existing book data...')
-        Book.objects.all().delete()
-        Author.objects.all().delete()
-        Publisher.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
-
-        base_url = 'https://openlibrary.org/search.json'
-        
+        if options['clear']:
+            self.stdout.write('Clearing existing book data...')
+            Book.objects.all().delete()
+            Author.objects.all().delete()
+            Publisher.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
+
+        base_url = options['base_url'] or 'https://openlibrary.org/search.json'
+        max_books = options['max_books']
+        page_size = options['page_size']
+        fetcher = fetcher_from_options(options)
+        checkpoint = Checkpoint(options['checkpoint'])
+
         # Search queries to get popular fantasy books
         queries = ['fantasy novel', 'fantasy bestseller', 'popular fantasy novel', 'epic fantasy novel']
-        books_created = 0
-        max_books = 100
-        
-        for query in queries:
-            if books_created >= max_books:
-                break
-                
-            params = {
-                'q': query,
-                'limit': 50,  # Max per request
-                'offset': 0
-            }
-            
-            try:
-                response = requests.get(base_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                docs = data.get('docs', [])
-                
-                for doc in docs:
-                    if books_created >= max_books:
-                        break
-                    
-                    # Extract book data
-                    title = doc.get('title', '')
-                    authors = doc.get('author_name', [])
-                    publisher_name = doc.get('publisher', ['Unknown Publisher'])[0] if doc.get('publisher') else 'Unknown Publisher'
-                    published_date = doc.get('first_publish_year')
-                    if published_date and isinstance(published_date, int) and 1000 <= published_date <= 2100:
-                        published_date = f"{published_date}-01-01"  # Normalize to YYYY-MM-DD
-                    else:
-                        published_date = None
-                    description = doc.get('description', {}).get('value', '') if isinstance(doc.get('description'), dict) else doc.get('description', '')
-                    page_count = doc.get('number_of_pages_median', 0)
-                    # Random genres for variety
-                    possible_genres = ['Fantasy', 'Science Fiction', 'Adventure', 'Mystery', 'Romance', 'Horror', 'Thriller', 'Historical Fiction', 'Young Adult', 'Children\'s Literature']
-                    num_genres = random.randint(1, 3)
-                    genres = random.sample(possible_genres, num_genres)
-                    
-                    # Get ISBN
-                    isbn = doc.get('isbn', [None])[0] if doc.get('isbn') else None
-                    
-                    # Get rating (Open Library uses user ratings)
-                    average_rating = doc.get('ratings_average')
-                    ratings_count = doc.get('ratings_count', 0)
-                    
-                    # Skip if not popular enough
-                    if average_rating and (average_rating < 3.0 or ratings_count < 5):
-                        continue
-                    
-                    # Skip if no title or already exists
-                    if not title or Book.objects.filter(title=title).exists():
-                        continue
-                    
-                    # Create or get publisher
-                    publisher, _ = Publisher.objects.get_or_create(
-                        name=publisher_name,
-                        defaults={'website': ''}
-                    )
-                    
-                    # Create book
-                    book = Book.objects.create(
-                        title=title,
-                        description=description[:500] if description else '',
-                        isbn=isbn,
-                        page_count=page_count,
-                        publication_date=published_date,
-                        publisher=publisher,
-                        average_rating=average_rating if average_rating else None
-                    )
-                    
-                    # Add genres
-                    for genre_name in genres:
-                        if genre_name:  # Skip empty
-                            genre, _ = Genre.objects.get_or_create(name=genre_name)
-                            book.genres.add(genre)
-                    
-                    # Store cover URL from Open Library (no download needed)
-                    cover_id = doc.get('cover_i')
-                    if cover_id:
-                        # Use Open Library's CDN for cover images - no storage needed
-                        book.cover_url = f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg"
-                        book.save()
-                        self.stdout.write(f'Set cover URL for: {title}')
-                    
-                    # Create authors
-                    for author_name in authors:
-                        author, _ = Author.objects.get_or_create(
-                            name=author_name,
-                            defaults={'bio': '', 'birth_date': None, 'death_date': None}
-                        )
-                        book.authors.add(author)
-                    
-                    books_created += 1
-                    self.stdout.write(f'Created book: {title}')
-                    
-            except requests.RequestException as e:
-                self.stdout.write(self.style.ERROR(f'Error fetching data for query "{query}": {e}'))
-                continue
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully created {books_created} popular fantasy books from Open Library API'))
\ No newline at end of file
+        ingestor = CatalogIngestor(batch_size=page_size)
+        books_ingested = checkpoint.counter('books_ingested')
+        if books_ingested:
+            self.stdout.write(f'Resuming from checkpoint with {books_ingested} books already ingested')
+
+        # Enough pages for any single query to reach max_books; fetched a few at a time and
+        # abandoned as soon as the target is met or a query runs out of results
+        pages_per_query = math.ceil(max_books / page_size)
+        exhausted = set()
+        failed = 0
+
+        def pages():
+            for query in queries:
+                for page in range(pages_per_query):
+                    key = f'{query}:{page * page_size}'
+                    if query not in exhausted and not checkpoint.is_done(key):
+                        yield base_url, {'q': query, 'limit': page_size, 'offset': page * page_size}
+
+        try:
+            for (url, params), result in fetcher.fetch_many(pages()):
+                if books_ingested >= max_books:
+                    break
+                query, offset = params['q'], params['offset']
+                if query in exhausted:
+                    continue
+                if isinstance(result, FetchError):
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f'Error fetching data for query "{query}" at offset {offset}: {result}'))
+                    continue
+
+                docs = result.get('docs', [])
+                if not docs:
+                    exhausted.add(query)
+                    continue
+
+                # Each page of docs is written as one batch
+                records = [record for record in map(self.doc_to_record, docs) if record][:max_books - books_ingested]
+                book_ids = ingestor.ingest_batch(records)
+                books_ingested += len(book_ids)
+                checkpoint.mark(f'{query}:{offset}', books_ingested=books_ingested)
+                self.stdout.write(f'Ingested {books_ingested} books (query "{query}", offset {offset})')
+        finally:
+            fetcher.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully ingested {books_ingested} popular fantasy books from Open Library API '
+            f'({ingestor.created} created, {ingestor.updated} updated, {ingestor.skipped} skipped as duplicates)'
+        ))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} pages failed; re-run with the same --checkpoint to retry them'))
+        else:
+            checkpoint.clear()
+
+    def doc_to_record(self, doc):
+        """Turn an Open Library search doc into an ingestion record, or None to skip it."""
+        title = doc.get('title', '')
+
+        # Get rating (Open Library uses user ratings) and skip if not popular enough
+        average_rating = doc.get('ratings_average')
+        ratings_count = doc.get('ratings_count', 0)
+        if not title or (average_rating and (average_rating < 3.0 or ratings_count < 5)):
+            return None
+
+        published_date = doc.get('first_publish_year')
+        if published_date and isinstance(published_date, int) and 1000 <= published_date <= 2100:
+            published_date = f"{published_date}-01-01"  # Normalize to YYYY-MM-DD
+        else:
+            published_date = None
+        description = doc.get('description', {}).get('value', '') if isinstance(doc.get('description'), dict) else doc.get('description', '')
+
+        # Prefer an ISBN-13, which is what the upsert keys on
+        isbns = doc.get('isbn') or []
+        isbn = next((value for value in isbns if len(value) == 13), isbns[0] if isbns else None)
+
+        # Random genres for variety, seeded by title so re-running an import keeps them stable
+        possible_genres = ['Fantasy', 'Science Fiction', 'Adventure', 'Mystery', 'Romance', 'Horror', 'Thriller', 'Historical Fiction', 'Young Adult', 'Children\'s Literature']
+        rng = random.Random(title)
+        genres = rng.sample(possible_genres, rng.randint(1, 3))
+
+        # Use Open Library's CDN for cover images - no storage needed
+        cover_id = doc.get('cover_i')
+        cover_url = f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg" if cover_id else None
+
+        return {
+            'title': title,
+            'isbn': isbn,
+            'authors': doc.get('author_name', []),
+            'publisher': doc['publisher'][0] if doc.get('publisher') else 'Unknown Publisher',
+            'genres': genres,
+            'publication_date': published_date,
+            'description': description[:500] if description else '',
+            'page_count': doc.get('number_of_pages_median', 0),
+            'cover_url': cover_url,
+            'average_rating': average_rating if average_rating else None,
+        }
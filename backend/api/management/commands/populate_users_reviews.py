@@ -1,131 +1,247 @@
-import os
 import random
-import string
+from itertools import accumulate, islice
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.db.models import Avg
-from api.models import Book, Review, ReviewLike
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from api.caching import bump_versions
+from api.ingestion import CatalogIngestor
+from api.models import Book, DiaryEntry, Follow, Profile, Review, ReviewLike
+from api.ratings import recount_book_ratings
+
+ADJECTIVES = ['amazing', 'great', 'terrible', 'boring', 'exciting', 'wonderful', 'disappointing', 'brilliant', 'awful', 'fantastic']
+NOUNS = ['story', 'plot', 'characters', 'writing', 'ending', 'beginning', 'middle', 'world-building', 'themes', 'pace']
+VERBS = ['loved', 'hated', 'enjoyed', 'disliked', 'appreciated', 'found', 'thought', 'felt', 'considered', 'believed']
+GENRES = ['Fantasy', 'Science Fiction', 'Adventure', 'Mystery', 'Romance', 'Horror', 'Thriller', 'Historical Fiction', 'Young Adult', 'Children\'s Literature']
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def zipf_weights(n, exponent):
+    """Cumulative Zipf weights for ranks 1..n, for random.choices(cum_weights=...)."""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
 
 class Command(BaseCommand):
-    help = 'Create users and reviews for existing books (run after populating books)'
+    help = (
+        'Generate synthetic users, reviews, likes, follows and diary entries (run after populating books). '
+        'Scales to millions of rows, e.g. --users 1000000 --books 100000 --reviews 10000000 for a benchmark dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of users to create (default 100)')
+        parser.add_argument('--books', type=int, default=0, help='Number of synthetic books to add to the catalog first (default 0)')
+        parser.add_argument('--reviews', type=int, default=2000, help='Total reviews to spread over the books (default 2000)')
+        parser.add_argument('--likes', type=int, default=10000, help='Total review likes (default 10000)')
+        parser.add_argument('--follows', type=int, default=500, help='Total follow relationships (default 500)')
+        parser.add_argument('--diary-entries', type=int, default=1000, help='Total diary entries (default 1000)')
+        parser.add_argument(
+            '--zipf',
+            type=float,
+            default=1.0,
+            help='Exponent of the Zipf popularity of books and users; 0 spreads activity evenly (default 1.0)'
+        )
+        parser.add_argument('--seed', type=int, help='Random seed, for a reproducible dataset')
+        parser.add_argument('--password', default='password123', help='Password of every generated user (default password123)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk INSERT (default 5000)')
 
     def handle(self, *args, **options):
-        self.stdout.write('Creating random users...')
-        
-        # Create 100 random users
-        users_created = 0
-        for i in range(100):
-            username = f'user_{i+1}'
-            email = f'user{i+1}@example.com'
-            password = 'password123'
-            
-            if not User.objects.filter(username=username).exists():
-                User.objects.create_user(
-                    username=username,
-                    email=email,
-                    password=password,
-                    first_name=f'First{i+1}',
-                    last_name=f'Last{i+1}'
-                )
-                users_created += 1
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {users_created} users.'))
-
-        # Get all books and users
-        books = list(Book.objects.all())
-        users = list(User.objects.all())
-        
-        if not books:
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        exponent = options['zipf']
+
+        if options['books']:
+            self.create_books(options['books'])
+        self.create_users(options['users'], options['password'])
+
+        # Ids only: a few million integers fit comfortably in memory where model instances would not
+        book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+        user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        if not book_ids:
             self.stdout.write(self.style.WARNING('No books found. Please populate books first.'))
             return
-        
-        if not users:
+        if not user_ids:
             self.stdout.write(self.style.WARNING('No users found.'))
             return
 
-        self.stdout.write('Creating random reviews...')
-        
-        reviews_created = 0
-        # For each book, create 0-5 random reviews
-        for book in books:
-            num_reviews = random.randint(0, 20)
-            selected_users = random.sample(users, min(num_reviews, len(users)))
-            
-            for user in selected_users:
-                # Skip if review already exists
-                if Review.objects.filter(user=user, book=book).exists():
-                    continue
-                
-                # Random rating 1.0 to 5.0 in 0.5 increments
-                rating = round(random.uniform(1.0, 5.0) * 2) / 2
-                
-                # 70% chance of having review text, 30% blank
-                has_text = random.random() < 0.7
-                text = ''
-                if has_text:
-                    # Generate random review text
-                    adjectives = ['amazing', 'great', 'terrible', 'boring', 'exciting', 'wonderful', 'disappointing', 'brilliant', 'awful', 'fantastic']
-                    nouns = ['story', 'plot', 'characters', 'writing', 'ending', 'beginning', 'middle', 'world-building', 'themes', 'pace']
-                    verbs = ['loved', 'hated', 'enjoyed', 'disliked', 'appreciated', 'found', 'thought', 'felt', 'considered', 'believed']
-                    
-                    adj = random.choice(adjectives)
-                    noun = random.choice(nouns)
-                    verb = random.choice(verbs)
-                    
-                    text = f"I {verb} this book. The {noun} was {adj}."
-                    
-                    # Sometimes add more sentences
-                    if random.random() < 0.5:
-                        text += f" The {random.choice(nouns)} really stood out to me."
-                    
-                    # Sometimes make it longer
-                    if random.random() < 0.3:
-                        text += f" Overall, I would {random.choice(['recommend', 'not recommend', 'suggest', 'avoid'])} this book."
-                
-                # 10% chance of being marked as spoiler
-                is_spoiler = random.random() < 0.1
-                
-                Review.objects.create(
-                    user=user,
-                    book=book,
-                    rating=rating,
-                    text=text,
-                    is_spoiler=is_spoiler
-                )
-                reviews_created += 1
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {reviews_created} reviews.'))
-        
-        # Create random likes on reviews
-        self.stdout.write('Creating random likes on reviews...')
-        
-        reviews = list(Review.objects.all())
-        likes_created = 0
-        
-        for review in reviews:
-            # Each review gets 0-10 random likes
-            num_likes = random.randint(0, 10)
-            # Get users who haven't already liked this review and aren't the review author
-            available_users = [user for user in users if user != review.user and not ReviewLike.objects.filter(user=user, review=review).exists()]
-            
-            if available_users:
-                selected_users = random.sample(available_users, min(num_likes, len(available_users)))
-                
-                for user in selected_users:
-                    ReviewLike.objects.create(
-                        user=user,
-                        review=review
+        # Popularity ranks are a seeded shuffle, so the most reviewed books aren't simply the oldest ones
+        self.rng.shuffle(book_ids)
+        self.rng.shuffle(user_ids)
+        book_weights = zipf_weights(len(book_ids), exponent)
+        user_weights = zipf_weights(len(user_ids), exponent)
+
+        last_review_pk = Review.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        self.create_reviews(options['reviews'], book_ids, book_weights, user_ids)
+        self.create_likes(options['likes'], last_review_pk, user_ids)
+        self.create_follows(options['follows'], user_ids, user_weights)
+        self.create_diary_entries(options['diary_entries'], user_ids, book_ids, book_weights)
+
+        # bulk_create skips the counter signals, so settle likes_count, followers_count and the book
+        # rating aggregates with one set-based pass at the end instead of one update per row
+        self.stdout.write('Recomputing counters and rating aggregates...')
+        likes = (
+            ReviewLike.objects.filter(review=OuterRef('pk'))
+            .order_by().values('review').annotate(n=Count('id')).values('n')
+        )
+        Review.objects.filter(pk__gt=last_review_pk).update(
+            likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0))
+        )
+        followers = (
+            Follow.objects.filter(followed=OuterRef('user'))
+            .order_by().values('followed').annotate(n=Count('id')).values('n')
+        )
+        Profile.objects.update(followers_count=Coalesce(Subquery(followers, output_field=IntegerField()), Value(0)))
+        recount_book_ratings(Book.objects.filter(reviews__pk__gt=last_review_pk).distinct())
+        bump_versions()
+
+        # The activity log, the home feeds, the user stats rollup, the analytics buckets and the
+        # trending scores are derived from the rows above
+        call_command('rebuild_feeds', activities=True, stdout=self.stdout)
+        call_command('rebuild_user_stats', stdout=self.stdout)
+        call_command('rebuild_analytics', stdout=self.stdout)
+        call_command('rebuild_trending', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def bulk_insert(self, model, rows, label):
+        before = model.objects.count()
+        for batch in chunked(rows, self.batch_size):
+            # Conflicts with existing rows (unique pairs, re-runs) are skipped rather than checked one by one
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+        created = model.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(f'Created {created} {label}.'))
+        return created
+
+    def create_books(self, count):
+        self.stdout.write(f'Creating {count} synthetic books...')
+        offset = Book.objects.count()
+        rng = self.rng
+
+        def records():
+            for i in range(offset, offset + count):
+                yield {
+                    'title': f'The {rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {i}',
+                    'isbn': f'979{i:010d}',
+                    'authors': [f'Author {rng.randrange(max(count // 5, 1))}'],
+                    'publisher': f'Publisher {rng.randrange(max(count // 50, 1))}',
+                    'genres': rng.sample(GENRES, rng.randint(1, 3)),
+                    'page_count': rng.randint(80, 900),
+                    # Spread over 1900-2024 without drawing from rng, which would change the rest of the dataset
+                    'publication_date': f'{1900 + i * 37 % 125}-{1 + i % 12:02d}-01',
+                }
+
+        ingestor = CatalogIngestor(batch_size=self.batch_size)
+        created, updated, _ = ingestor.ingest(records())
+        self.stdout.write(self.style.SUCCESS(f'Created {created} books ({updated} already existed).'))
+
+    def create_users(self, count, password):
+        self.stdout.write(f'Creating {count} users...')
+        # One PBKDF2 hash shared by every user instead of one per create_user() call
+        password_hash = make_password(password)
+        last_pk = User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        offset = User.objects.count()
+        users = (
+            User(
+                username=f'user_{i}',
+                email=f'user{i}@example.com',
+                password=password_hash,
+                first_name=f'First{i}',
+                last_name=f'Last{i}',
+            )
+            for i in range(offset + 1, offset + count + 1)
+        )
+        self.bulk_insert(User, users, 'users')
+        profiles = (Profile(user_id=pk) for pk in User.objects.filter(pk__gt=last_pk).values_list('pk', flat=True).iterator())
+        self.bulk_insert(Profile, profiles, 'profiles')
+
+    def create_reviews(self, total, book_ids, book_weights, user_ids):
+        self.stdout.write(f'Creating {total} reviews...')
+        rng = self.rng
+        scale = total / book_weights[-1]
+
+        def reviews():
+            previous_weight = 0
+            for book_id, cumulative in zip(book_ids, book_weights):
+                # Expected share of the total for this popularity rank, rounded randomly so the sum is right on average
+                expected = (cumulative - previous_weight) * scale
+                previous_weight = cumulative
+                count = min(int(expected) + (rng.random() < expected % 1), len(user_ids))
+                # Sampling without replacement makes every (user, book) pair unique without a lookup
+                for user_id in rng.sample(user_ids, count):
+                    yield Review(
+                        user_id=user_id,
+                        book_id=book_id,
+                        rating=rng.randint(2, 10) / 2,  # 1.0 to 5.0 in 0.5 increments
+                        text=self.review_text() if rng.random() < 0.7 else '',
+                        is_spoiler=rng.random() < 0.1,
                     )
-                    likes_created += 1
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {likes_created} review likes.'))
-        
-        # Update average ratings for books
-        self.stdout.write('Updating average ratings...')
-        for book in books:
-            avg_rating = book.reviews.aggregate(Avg('rating'))['rating__avg']
-            if avg_rating is not None:
-                book.average_rating = round(avg_rating, 1)
-                book.save()
-        
-        self.stdout.write(self.style.SUCCESS('Average ratings updated.'))
\ No newline at end of file
+
+        self.bulk_insert(Review, reviews(), 'reviews')
+
+    def review_text(self):
+        rng = self.rng
+        text = f"I {rng.choice(VERBS)} this book. The {rng.choice(NOUNS)} was {rng.choice(ADJECTIVES)}."
+        if rng.random() < 0.5:
+            text += f" The {rng.choice(NOUNS)} really stood out to me."
+        if rng.random() < 0.3:
+            text += f" Overall, I would {rng.choice(['recommend', 'not recommend', 'suggest', 'avoid'])} this book."
+        return text
+
+    def create_likes(self, total, last_review_pk, user_ids):
+        new_reviews = Review.objects.filter(pk__gt=last_review_pk)
+        review_count = new_reviews.count()
+        if not review_count:
+            return
+        self.stdout.write(f'Creating {total} likes on {review_count} reviews...')
+        rng = self.rng
+        mean = total / review_count
+
+        def likes():
+            rows = new_reviews.order_by('pk').values_list('pk', 'user_id').iterator(chunk_size=self.batch_size)
+            for review_id, author_id in rows:
+                # Exponentially distributed: most reviews get a few likes, a handful get many
+                count = min(round(rng.expovariate(1 / mean)) if mean else 0, len(user_ids))
+                for user_id in rng.sample(user_ids, count):
+                    if user_id != author_id:
+                        yield ReviewLike(user_id=user_id, review_id=review_id)
+
+        self.bulk_insert(ReviewLike, likes(), 'review likes')
+
+    def create_follows(self, total, user_ids, user_weights):
+        self.stdout.write(f'Creating {total} follows...')
+        rng = self.rng
+        mean = total / len(user_ids)
+
+        def follows():
+            for follower_id in user_ids:
+                count = round(rng.expovariate(1 / mean)) if mean else 0
+                # Popular users collect most of the followers
+                followed = set(rng.choices(user_ids, cum_weights=user_weights, k=count))
+                followed.discard(follower_id)
+                for followed_id in followed:
+                    yield Follow(follower_id=follower_id, followed_id=followed_id)
+
+        self.bulk_insert(Follow, follows(), 'follows')
+
+    def create_diary_entries(self, total, user_ids, book_ids, book_weights):
+        self.stdout.write(f'Creating {total} diary entries...')
+        rng = self.rng
+        mean = total / len(user_ids)
+        statuses = [choice for choice, _ in DiaryEntry.STATUS_CHOICES]
+
+        def entries():
+            for user_id in user_ids:
+                count = round(rng.expovariate(1 / mean)) if mean else 0
+                for book_id in set(rng.choices(book_ids, cum_weights=book_weights, k=count)):
+                    status = rng.choice(statuses)
+                    read_date = None
+                    if status == 'read':
+                        read_date = f'{rng.randint(2015, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+                    yield DiaryEntry(user_id=user_id, book_id=book_id, status=status, read_date=read_date)
+
+        self.bulk_insert(DiaryEntry, entries(), 'diary entries')
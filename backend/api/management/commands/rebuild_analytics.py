@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.analytics import SOURCES, rebuild_buckets
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the hourly and daily analytics buckets of reviews, likes and signups from the base tables. '
+        'Diary transitions are only recorded as they happen and are left as they are.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metric',
+            action='append',
+            help=f'Only rebuild this metric ({", ".join(SOURCES)}); may be repeated'
+        )
+
+    def handle(self, *args, **options):
+        metrics = options['metric'] or list(SOURCES)
+        unknown = set(metrics) - set(SOURCES)
+        if unknown:
+            raise CommandError(f'Unknown metric {", ".join(sorted(unknown))}; choose from {", ".join(SOURCES)}')
+
+        created = rebuild_buckets(metrics)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} analytics buckets for {", ".join(metrics)}.'))
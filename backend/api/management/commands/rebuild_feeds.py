@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from api.feed import rebuild_activities, rebuild_feeds
+
+class Command(BaseCommand):
+    help = 'Refill every home feed with the latest activity of followed users (run once after migrating, or to repair feeds)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--activities',
+            action='store_true',
+            help='First recreate the review, like and follow activities from their tables (e.g. after a bulk load)'
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            help='Entries per feed (default settings.FEED_BACKFILL_SIZE)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of users whose feeds are rebuilt per batch (default 500)'
+        )
+
+    def handle(self, *args, **options):
+        if options['activities']:
+            self.stdout.write('Recreating activities...')
+            rebuild_activities()
+
+        batch_size = options['batch_size']
+        users = 0
+        entries = 0
+        last_pk = 0
+        while True:
+            user_ids = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            entries += rebuild_feeds(user_ids, options['size'])
+            users += len(user_ids)
+            self.stdout.write(f'Rebuilt {users} feeds...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {users} feeds with {entries} entries.'))
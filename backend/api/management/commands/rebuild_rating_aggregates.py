@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Book
+from api.ratings import RATING_FIELDS, diff_book_ratings, rebuild_book_ratings
+
+class Command(BaseCommand):
+    help = 'Recompute the running rating aggregates on Book from the reviews table, or verify them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report books whose aggregates have drifted; exit with an error if any did'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of books checked per query batch (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+        batch_size = options['batch_size']
+
+        checked = 0
+        drifted = 0
+        last_pk = 0
+        while True:
+            # Walk books in primary key order so each batch is an index range scan
+            books = list(
+                Book.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'title', *RATING_FIELDS)[:batch_size]
+            )
+            if not books:
+                break
+            last_pk = books[-1].pk
+            checked += len(books)
+
+            if verify:
+                for book, values in diff_book_ratings(books):
+                    drifted += 1
+                    self.stdout.write(
+                        f'Drift on book {book.pk} ({book.title}): '
+                        f'stored count={book.rating_count} sum={book.rating_sum}, '
+                        f'expected count={values["rating_count"]} sum={values["rating_sum"]}'
+                    )
+            else:
+                drifted += rebuild_book_ratings([book.pk for book in books])
+
+        if verify:
+            if drifted:
+                raise CommandError(f'{drifted} of {checked} books have drifted rating aggregates')
+            self.stdout.write(self.style.SUCCESS(f'Rating aggregates verified for {checked} books.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Checked {checked} books, fixed {drifted}.'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from api.models import Book
+from api.search import get_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text book search index (FTS5 on SQLite, tsvector on PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of books indexed per batch (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        index = get_index()
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            book_ids = list(Book.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not book_ids:
+                break
+            last_pk = book_ids[-1]
+            index.index(book_ids)
+            indexed += len(book_ids)
+            self.stdout.write(f'Indexed {indexed} books...')
+
+        index.prune()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {indexed} books.'))
@@ -0,0 +1,57 @@
+import os
+
+from django.core.management.base import BaseCommand
+from api.similarity import rebuild_similarities, update_similarities
+
+class Command(BaseCommand):
+    help = 'Recompute every book\'s "readers also liked" neighbours from reviews and diary entries (needs numpy and scipy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only apply the reviews saved since the last run to its checkpoint and recompute their books '
+                 '(a full rebuild when there is no checkpoint yet)'
+        )
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=50,
+            help='Neighbours kept per book (default 50)'
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=256,
+            help='Books whose similarities are computed at once per worker; memory grows with it (default 256)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes computing blocks (default the number of CPUs)'
+        )
+        parser.add_argument(
+            '--min-readers',
+            type=int,
+            default=2,
+            help='Readers a book needs to get or be a neighbour (default 2)'
+        )
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f'Computed neighbours of {done}/{total} books...')
+
+        settings = {name: options[name] for name in ('top_k', 'block_size', 'workers', 'min_readers')}
+        if options['incremental']:
+            self.stdout.write('Applying new reviews to the checkpoint...')
+            result = update_similarities(**settings, progress=progress)
+            if result is not None:
+                books, rows = result
+                self.stdout.write(self.style.SUCCESS(f'Stored {rows} neighbours of {books} reviewed books.'))
+                return
+            self.stdout.write('No checkpoint yet, rebuilding everything.')
+
+        self.stdout.write('Loading reviews and diary entries...')
+        books, rows = rebuild_similarities(**settings, progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Stored {rows} neighbours of {books} books.'))
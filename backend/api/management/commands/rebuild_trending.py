@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from api.trending import rebuild_scores
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the trending scores of every book from its reviews and likes (run once after migrating, '
+        'or after bulk loads). Diary status changes are only counted as they happen and are dropped.'
+    )
+
+    def handle(self, *args, **options):
+        books = rebuild_scores()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the trending scores of {books} books.'))
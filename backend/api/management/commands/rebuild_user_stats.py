@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from api.stats import rebuild_user_stats
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user statistics rollup behind /api/user/stats/ from reviews, likes and diary entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of users rebuilt per batch (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            user_ids = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            rebuilt += rebuild_user_stats(user_ids)
+            self.stdout.write(f'Rebuilt stats for {rebuilt} users...')
+
+        self.stdout.write(self.style.SUCCESS(f'User stats rebuilt for {rebuilt} users.'))
@@ -0,0 +1,136 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from api.models import Book, Follow, Profile, Review, ReviewLike
+from api.ratings import RATING_FIELDS, diff_book_ratings, drifted_fields, rebuild_book_ratings
+
+class Command(BaseCommand):
+    help = (
+        'Find and fix drift in the denormalized counters (Review.likes_count, Profile.followers_count and the rating aggregates Book derives from its reviews). '
+        'Safe to run periodically, e.g. from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows checked per batch (default 1000)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without writing any fixes'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        likes_fixed = self.reconcile_likes(batch_size, dry_run)
+        followers_fixed = self.reconcile_followers(batch_size, dry_run)
+        books_fixed = self.reconcile_books(batch_size, dry_run)
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f'{likes_fixed} reviews have a drifted likes_count, {followers_fixed} profiles a drifted '
+                f'followers_count and {books_fixed} books drifted rating counters (dry run, nothing written).'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Fixed likes_count on {likes_fixed} reviews, followers_count on {followers_fixed} profiles '
+                f'and counters on {books_fixed} books.'
+            ))
+
+    def reconcile_likes(self, batch_size, dry_run):
+        fixed = 0
+        last_pk = 0
+        while True:
+            stored = dict(
+                Review.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'likes_count')[:batch_size]
+            )
+            if not stored:
+                break
+            last_pk = max(stored)
+
+            actual = dict(
+                ReviewLike.objects.filter(review_id__in=stored.keys())
+                .order_by().values('review_id').annotate(n=Count('id')).values_list('review_id', 'n')
+            )
+            drifted = [pk for pk, count in stored.items() if count != actual.get(pk, 0)]
+            if not drifted:
+                continue
+            fixed += len(drifted)
+            if dry_run:
+                for pk in drifted:
+                    self.stdout.write(f'Review {pk}: stored likes_count={stored[pk]}, actual={actual.get(pk, 0)}')
+                continue
+
+            # Recount inside the UPDATE so likes written since the check above are included
+            likes = (
+                ReviewLike.objects.filter(review=OuterRef('pk'))
+                .order_by().values('review').annotate(n=Count('id')).values('n')
+            )
+            Review.objects.filter(pk__in=drifted).update(
+                likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0))
+            )
+        return fixed
+
+    def reconcile_followers(self, batch_size, dry_run):
+        fixed = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                Profile.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'user_id', 'followers_count')[:batch_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            stored = {user_id: count for _, user_id, count in rows}
+
+            actual = dict(
+                Follow.objects.filter(followed_id__in=stored.keys())
+                .order_by().values('followed_id').annotate(n=Count('id')).values_list('followed_id', 'n')
+            )
+            drifted = [user_id for user_id, count in stored.items() if count != actual.get(user_id, 0)]
+            if not drifted:
+                continue
+            fixed += len(drifted)
+            if dry_run:
+                for user_id in drifted:
+                    self.stdout.write(f'User {user_id}: stored followers_count={stored[user_id]}, actual={actual.get(user_id, 0)}')
+                continue
+
+            followers = (
+                Follow.objects.filter(followed=OuterRef('user'))
+                .order_by().values('followed').annotate(n=Count('id')).values('n')
+            )
+            Profile.objects.filter(user_id__in=drifted).update(
+                followers_count=Coalesce(Subquery(followers, output_field=IntegerField()), Value(0))
+            )
+        return fixed
+
+    def reconcile_books(self, batch_size, dry_run):
+        fixed = 0
+        last_pk = 0
+        while True:
+            if dry_run:
+                books = list(Book.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *RATING_FIELDS)[:batch_size])
+                if not books:
+                    break
+                last_pk = books[-1].pk
+                for book, values in diff_book_ratings(books):
+                    fixed += 1
+                    # Only the fields derived from reviews: an unreviewed book keeps its imported average_rating
+                    drift = ', '.join(
+                        f'{field}={getattr(book, field)} (actual {values[field]})' for field in drifted_fields(book, values)
+                    )
+                    self.stdout.write(f'Book {book.pk}: stored {drift}')
+                continue
+
+            book_ids = list(Book.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not book_ids:
+                break
+            last_pk = book_ids[-1]
+            fixed += rebuild_book_ratings(book_ids)
+        return fixed
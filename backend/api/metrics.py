@@ -0,0 +1,199 @@
+"""
+Per-endpoint request metrics, exposed in the Prometheus text format at /metrics.
+
+RequestLoggingMiddleware counts every request by route (the resolved URL name, so
+/api/books/1/ and /api/books/2/ are one series), method and status. A sample of
+requests (settings.METRICS_SAMPLE_RATE) also records latency, response size and the
+number and time of their SQL queries, timed with a query wrapper. For
+streamed responses these cover sending the body, which is when their queries run.
+
+Each thread writes to its own buffer, so recording a request takes no lock; /metrics
+merges the buffers when scraped. Buffers are per process: with several workers each
+one reports its own counts, which Prometheus adds up across scrape targets.
+"""
+import hmac
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Upper bounds of the histogram buckets; the last, implicit bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+UNMATCHED_ROUTE = 'unmatched'
+
+_local = threading.local()
+_buffers = []
+_buffers_lock = threading.Lock()  # Only taken once per thread, when its buffer is created
+
+
+class Buffer:
+    def __init__(self):
+        self.requests = {}  # (route, method, status) -> count
+        self.sampled = {}  # (route, method) -> RouteSample
+
+
+class RouteSample:
+    """Sums over the sampled requests of one route and method."""
+    __slots__ = ('count', 'duration', 'latency', 'queries', 'query_seconds', 'query_histogram', 'response_bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.query_histogram = [0] * (len(QUERY_BUCKETS) + 1)
+        self.response_bytes = 0
+
+    def add(self, duration, queries, response_bytes):
+        self.count += 1
+        self.duration += duration
+        self.latency[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.queries += queries.count
+        self.query_seconds += queries.seconds
+        self.query_histogram[bisect_left(QUERY_BUCKETS, queries.count)] += 1
+        self.response_bytes += response_bytes
+
+    def merge(self, other):
+        for field in self.__slots__:
+            mine, theirs = getattr(self, field), getattr(other, field)
+            if isinstance(mine, list):
+                setattr(self, field, [a + b for a, b in zip(mine, theirs)])
+            else:
+                setattr(self, field, mine + theirs)
+
+
+class QueryTimer:
+    """Query wrapper (see api/concurrency.py) counting and timing the queries it wraps."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()  # Async views run queries on several threads at once
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.count += 1
+                self.seconds += duration
+
+
+def get_buffer():
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = Buffer()
+        with _buffers_lock:
+            _buffers.append(buffer)
+    return buffer
+
+
+def should_sample():
+    rate = settings.METRICS_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNMATCHED_ROUTE
+
+
+def record_request(route, method, status):
+    requests = get_buffer().requests
+    key = (route, method, status)
+    requests[key] = requests.get(key, 0) + 1
+
+
+def record_sample(route, method, duration, queries, response_bytes):
+    sampled = get_buffer().sampled
+    sample = sampled.get((route, method))
+    if sample is None:
+        sample = sampled[(route, method)] = RouteSample()
+    sample.add(duration, queries, response_bytes)
+
+
+def snapshot():
+    """Merge every thread's buffer into one (requests, sampled) pair of the same shape."""
+    requests, sampled = {}, {}
+    with _buffers_lock:
+        buffers = list(_buffers)
+    for buffer in buffers:
+        # dict.copy() is atomic under the GIL, so the owning thread can keep writing meanwhile
+        for key, count in buffer.requests.copy().items():
+            requests[key] = requests.get(key, 0) + count
+        for key, sample in buffer.sampled.copy().items():
+            sampled.setdefault(key, RouteSample()).merge(sample)
+    return requests, sampled
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in values.items()) + '}'
+
+
+def histogram(lines, name, bounds, counts, total, **label_values):
+    cumulative = 0
+    for bound, count in zip(bounds + ('+Inf',), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{labels(**label_values, le=bound)} {cumulative}')
+    lines.append(f'{name}_sum{labels(**label_values)} {total}')
+    lines.append(f'{name}_count{labels(**label_values)} {cumulative}')
+
+
+def render():
+    requests, sampled = snapshot()
+    lines = [
+        '# HELP api_requests_total Requests by route, method and status.',
+        '# TYPE api_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f'api_requests_total{labels(route=route, method=method, status=status)} {count}')
+
+    lines += [
+        '# HELP api_request_duration_seconds Latency of sampled requests.',
+        '# TYPE api_request_duration_seconds histogram',
+    ]
+    for (route, method), sample in sorted(sampled.items()):
+        histogram(lines, 'api_request_duration_seconds', LATENCY_BUCKETS, sample.latency, sample.duration, route=route, method=method)
+
+    lines += [
+        '# HELP api_db_queries SQL queries per sampled request.',
+        '# TYPE api_db_queries histogram',
+    ]
+    for (route, method), sample in sorted(sampled.items()):
+        histogram(lines, 'api_db_queries', QUERY_BUCKETS, sample.query_histogram, sample.queries, route=route, method=method)
+
+    for name, field, help_text in [
+        ('api_db_query_seconds_total', 'query_seconds', 'Time spent in SQL queries by sampled requests.'),
+        ('api_response_bytes_total', 'response_bytes', 'Body size of sampled responses.'),
+    ]:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (route, method), sample in sorted(sampled.items()):
+            lines.append(f'{name}{labels(route=route, method=method)} {getattr(sample, field)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Requires 'Authorization: Bearer <METRICS_TOKEN>', and is
+    only open without a token when METRICS_TOKEN is unset and DEBUG is on.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,35 +1,105 @@
 import logging
 import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import metrics, profiling
+from .concurrency import query_wrapper
+from .streaming import watch_streaming
 
 logger = logging.getLogger('api.requests')
 
 
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that can also run async. WhiteNoise's own is sync only, which under
+    ASGI makes every request hold a thread for as long as the rest of the stack takes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = self.find_file(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
 class RequestLoggingMiddleware(MiddlewareMixin):
     """
-    Middleware to log API requests for monitoring and debugging.
+    Middleware to log API requests for monitoring and debugging, and to collect the
+    per-route metrics served at /metrics (see api/metrics.py).
     Logs request method, path, user, response time, and status code.
+    Runs sync or async, whichever the rest of the stack is.
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         # Start timing
-        start_time = time.time()
+        start_time = time.perf_counter()
+
+        # Log incoming request; skip building the line entirely when INFO is off
+        log = logger.isEnabledFor(logging.INFO)
+        if log:
+            self.log_request(request, request.user)
 
-        # Log incoming request
-        user_info = request.user.username if request.user.is_authenticated else 'Anonymous'
-        logger.info(f"→ {request.method} {request.path} | User: {user_info} | IP: {self.get_client_ip(request)}")
+        # Process the request, timing its SQL queries if it is sampled
+        queries = metrics.QueryTimer() if metrics.should_sample() else None
+        if queries:
+            with query_wrapper(queries):
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        return self.finish(request, response, start_time, queries, log)
+
+    async def __acall__(self, request):
+        start_time = time.perf_counter()
+        log = logger.isEnabledFor(logging.INFO)
+        if log:
+            # request.user would load the user synchronously
+            self.log_request(request, await request.auser())
+        queries = metrics.QueryTimer() if metrics.should_sample() else None
+        if queries:
+            with query_wrapper(queries):
+                response = await self.get_response(request)
+        else:
+            response = await self.get_response(request)
+        return self.finish(request, response, start_time, queries, log)
 
-        # Process the request
-        response = self.get_response(request)
+    def log_request(self, request, user):
+        user_info = user.username if user.is_authenticated else 'Anonymous'
+        logger.info('→ %s %s | User: %s | IP: %s', request.method, request.path, user_info, self.get_client_ip(request))
 
+    def finish(self, request, response, start_time, queries, log):
         # Calculate response time
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
+
+        route = metrics.route_name(request)
+        metrics.record_request(route, request.method, response.status_code)
+        if queries and response.streaming:
+            # Streamed bodies run their queries as they are sent, so the sample is complete only then
+            watch_streaming(response, queries, lambda sent: metrics.record_sample(
+                route, request.method, time.perf_counter() - start_time, queries, sent,
+            ))
+        elif queries:
+            metrics.record_sample(route, request.method, duration, queries, len(response.content))
 
         # Log response
-        logger.info(f"← {request.method} {request.path} | Status: {response.status_code} | Time: {duration:.3f}s")
+        if log:
+            logger.info('← %s %s | Status: %s | Time: %.3fs', request.method, request.path, response.status_code, duration)
 
         return response
 
@@ -40,4 +110,25 @@ class RequestLoggingMiddleware(MiddlewareMixin):
             ip = x_forwarded_for.split(',')[0]
         else:
             ip = request.META.get('REMOTE_ADDR')
-        return ip
\ No newline at end of file
+        return ip
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Profile the SQL (and optionally the Python) of requests picked by api/profiling.py:
+    ones sent with the X-Profile token header, or a sample while an admin has sampling on.
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, trace = profiling.wants_profile(request)
+        if not profile:
+            return self.get_response(request)
+        return profiling.profile_request(request, self.get_response, trace)
+
+    async def __acall__(self, request):
+        profile, trace = profiling.wants_profile(request)
+        if not profile:
+            return await self.get_response(request)
+        return await profiling.aprofile_request(request, self.get_response, trace)
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:08
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Book = apps.get_model('api', 'Book')
+    Review = apps.get_model('api', 'Review')
+    totals = {}
+    for row in Review.objects.values('book_id', 'rating').annotate(n=Count('id')).order_by():
+        book = totals.setdefault(row['book_id'], {'rating_sum': Decimal('0'), 'rating_count': 0})
+        rating = Decimal(str(row['rating']))
+        bucket = min(max(int(rating * 2 + Decimal('0.5')), 1), 10)
+        book['rating_sum'] += rating * row['n']
+        book['rating_count'] += row['n']
+        book[f'rating_hist_{bucket}'] = book.get(f'rating_hist_{bucket}', 0) + row['n']
+    for book_id, values in totals.items():
+        values['average_rating'] = float(values['rating_sum']) / values['rating_count']
+        Book.objects.filter(pk=book_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_genre_remove_book_genre_book_genres'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_10',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_6',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_7',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_8',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_hist_9',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:09
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_likes_count(apps, schema_editor):
+    Review = apps.get_model('api', 'Review')
+    ReviewLike = apps.get_model('api', 'ReviewLike')
+    likes = (
+        ReviewLike.objects.filter(review=OuterRef('pk'))
+        .order_by().values('review').annotate(n=Count('id')).values('n')
+    )
+    Review.objects.update(likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_book_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_likes_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE api_booksearch USING fts5(
+        title, authors, genres, description,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    "CREATE VIRTUAL TABLE api_booksearch_vocab USING fts5vocab(api_booksearch, 'row')",
+    """
+    INSERT INTO api_booksearch (rowid, title, authors, genres, description)
+    SELECT b.id, b.title,
+        COALESCE((SELECT group_concat(a.name, ' ') FROM api_book_authors ba
+                  JOIN api_author a ON a.id = ba.author_id WHERE ba.book_id = b.id), ''),
+        COALESCE((SELECT group_concat(g.name, ' ') FROM api_book_genres bg
+                  JOIN api_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), ''),
+        b.description
+    FROM api_book b
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS api_booksearch_vocab',
+    'DROP TABLE IF EXISTS api_booksearch',
+]
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE TABLE api_booksearch (
+        book_id bigint PRIMARY KEY REFERENCES api_book (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL,
+        terms text NOT NULL
+    )
+    """,
+    """
+    INSERT INTO api_booksearch (book_id, document, terms)
+    SELECT b.id,
+        setweight(to_tsvector('simple', b.title), 'A')
+        || setweight(to_tsvector('simple', COALESCE(a.names, '')), 'B')
+        || setweight(to_tsvector('simple', COALESCE(g.names, '')), 'C')
+        || setweight(to_tsvector('simple', b.description), 'D'),
+        b.title || ' ' || COALESCE(a.names, '')
+    FROM api_book b
+    LEFT JOIN (
+        SELECT ba.book_id, string_agg(au.name, ' ') AS names FROM api_book_authors ba
+        JOIN api_author au ON au.id = ba.author_id GROUP BY ba.book_id
+    ) a ON a.book_id = b.id
+    LEFT JOIN (
+        SELECT bg.book_id, string_agg(ge.name, ' ') AS names FROM api_book_genres bg
+        JOIN api_genre ge ON ge.id = bg.genre_id GROUP BY bg.book_id
+    ) g ON g.book_id = b.id
+    """,
+    'CREATE INDEX api_booksearch_document_gin ON api_booksearch USING gin (document)',
+    'CREATE INDEX api_booksearch_terms_trgm ON api_booksearch USING gin (terms gin_trgm_ops)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP TABLE IF EXISTS api_booksearch',
+]
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        vendor_statements = statements.get(schema_editor.connection.vendor, [])
+        for statement in vendor_statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_review_likes_count'),
+    ]
+
+    operations = [
+        # The search table depends on the database vendor (see api/search.py); other backends fall back to LIKE
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_statements({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
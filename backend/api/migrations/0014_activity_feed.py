@@ -0,0 +1,108 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# Activities derived from the existing reviews, likes and follows, keeping their timestamps
+ACTIVITY_BACKFILL = [
+    """
+    INSERT INTO api_activity (user_id, action, book_id, target_user_id, review_id, created_at)
+    SELECT user_id, 'reviewed', book_id, NULL, id, created_at FROM api_review
+    """,
+    """
+    INSERT INTO api_activity (user_id, action, book_id, target_user_id, review_id, created_at)
+    SELECT l.user_id, 'liked_review', r.book_id, r.user_id, r.id, l.created_at
+    FROM api_reviewlike l JOIN api_review r ON r.id = l.review_id
+    """,
+    """
+    INSERT INTO api_activity (user_id, action, book_id, target_user_id, review_id, created_at)
+    SELECT follower_id, 'followed', NULL, followed_id, NULL, created_at FROM api_follow
+    """,
+]
+
+
+def backfill_followers_count(apps, schema_editor):
+    Profile = apps.get_model('api', 'Profile')
+    Follow = apps.get_model('api', 'Follow')
+    followers = (
+        Follow.objects.filter(followed=OuterRef('user'))
+        .order_by().values('followed').annotate(n=Count('id')).values('n')
+    )
+    Profile.objects.update(followers_count=Coalesce(Subquery(followers, output_field=IntegerField()), Value(0)))
+
+
+def backfill_activities(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in ACTIVITY_BACKFILL:
+            cursor.execute(statement)
+
+
+def remove_activities(apps, schema_editor):
+    Activity = apps.get_model('api', 'Activity')
+    Activity.objects.filter(action__in=['reviewed', 'liked_review', 'followed']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_book_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='review',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='api.review'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='api_activity_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['target_user', 'action', '-created_at'], name='api_activity_target_recent'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='activity',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.activity'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-created_at', '-activity'], name='api_feedentry_user_recent'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='feedentry',
+            unique_together={('user', 'activity')},
+        ),
+        migrations.RunPython(backfill_followers_count, migrations.RunPython.noop),
+        # Feeds themselves are filled by `manage.py rebuild_feeds`, which caps each one
+        migrations.RunPython(backfill_activities, remove_activities),
+    ]
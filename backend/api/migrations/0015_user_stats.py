@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_activity_feed'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_hist_1', models.PositiveIntegerField(default=0)),
+                ('rating_hist_2', models.PositiveIntegerField(default=0)),
+                ('rating_hist_3', models.PositiveIntegerField(default=0)),
+                ('rating_hist_4', models.PositiveIntegerField(default=0)),
+                ('rating_hist_5', models.PositiveIntegerField(default=0)),
+                ('rating_hist_6', models.PositiveIntegerField(default=0)),
+                ('rating_hist_7', models.PositiveIntegerField(default=0)),
+                ('rating_hist_8', models.PositiveIntegerField(default=0)),
+                ('rating_hist_9', models.PositiveIntegerField(default=0)),
+                ('rating_hist_10', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('likes_received', models.PositiveIntegerField(default=0)),
+                ('books_read_by_year', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
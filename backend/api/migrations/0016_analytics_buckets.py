@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:37
+
+from datetime import timezone
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Trunc
+
+# (metric, model, timestamp field) counted into buckets from the existing rows
+BACKFILL_SOURCES = [
+    ('reviews', ('api', 'Review'), 'created_at'),
+    ('likes', ('api', 'ReviewLike'), 'created_at'),
+    ('signups', settings.AUTH_USER_MODEL.split('.'), 'date_joined'),
+]
+
+
+def backfill_buckets(apps, schema_editor):
+    AnalyticsBucket = apps.get_model('api', 'AnalyticsBucket')
+    for metric, model_name, field in BACKFILL_SOURCES:
+        model = apps.get_model(*model_name)
+        for granularity in ('hour', 'day'):
+            rows = (
+                model.objects.order_by().annotate(bucket=Trunc(field, granularity, tzinfo=timezone.utc))
+                .values('bucket').annotate(n=Count('pk')).values_list('bucket', 'n')
+            )
+            AnalyticsBucket.objects.bulk_create(
+                [AnalyticsBucket(metric=metric, granularity=granularity, start=bucket, count=n) for bucket, n in rows],
+                batch_size=1000,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_user_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=32)),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('metric', 'granularity', 'start')},
+            },
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
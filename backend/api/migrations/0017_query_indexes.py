@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_analytics_buckets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activity',
+            name='api_activity_target_recent',
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['target_user', 'action', '-created_at', '-id'], name='api_activity_target_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-average_rating', 'id'], name='api_book_top_rated'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('isbn__isnull', True)), fields=['title'], name='api_book_title_no_isbn'),
+        ),
+        migrations.AddIndex(
+            model_name='diaryentry',
+            index=models.Index(fields=['user', 'status', 'read_date'], name='api_diaryentry_user_status'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', '-likes_count', '-created_at', 'id'], name='api_review_book_popular'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-created_at', 'id'], name='api_review_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['-created_at', 'id'], name='api_review_recent'),
+        ),
+    ]
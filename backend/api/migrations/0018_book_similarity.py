@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='api.book')),
+                ('similar_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-score'], name='api_booksimilarity_top')],
+                'unique_together': {('book', 'similar_book')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_review_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day_score', models.FloatField()),
+                ('week_score', models.FloatField()),
+                ('all_score', models.FloatField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.book')),
+                ('genre', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.genre')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['genre', '-day_score', 'book'], name='api_trending_day'), models.Index(fields=['genre', '-week_score', 'book'], name='api_trending_week'), models.Index(fields=['genre', '-all_score', 'book'], name='api_trending_all')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'genre'), name='api_trendingscore_book_genre'), models.UniqueConstraint(condition=models.Q(('genre', None)), fields=('book',), name='api_trendingscore_book_catalog')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_id', models.IntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='api_facetchange_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:36
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_cover_keys(apps, schema_editor):
+    # As api.covers.source_key() computes them
+    Book = apps.get_model('api', 'Book')
+    books = Book.objects.exclude(Q(cover='') | Q(cover=None), Q(cover_url='') | Q(cover_url=None)).only('cover', 'cover_url')
+    batch = []
+    for book in books.iterator(chunk_size=1000):
+        source = f'file:{book.cover.name}' if book.cover else f'url:{book.cover_url}'
+        book.cover_key = hashlib.sha256(source.encode()).hexdigest()[:24]
+        batch.append(book)
+        if len(batch) == 1000:
+            Book.objects.bulk_update(batch, ['cover_key'])
+            batch = []
+    Book.objects.bulk_update(batch, ['cover_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_facet_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_key',
+            field=models.CharField(blank=True, default='', max_length=24),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['cover_key'], name='api_book_cover_key'),
+        ),
+        migrations.RunPython(backfill_cover_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def flag_pulled_activity(apps, schema_editor):
+    # Feeds pulled the activity of accounts over the limit on read, so it was never fanned out
+    Activity = apps.get_model('api', 'Activity')
+    Activity.objects.filter(user__profile__followers_count__gt=settings.FEED_FANOUT_LIMIT).update(fanned_out=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_book_cover_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='fanned_out',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['user', '-created_at', '-id'], name='api_activity_pulled'),
+        ),
+        migrations.RunPython(flag_pulled_activity, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models import Avg
+from django.utils import timezone
 
 class Author(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -24,7 +24,32 @@ class Genre(models.Model):
     def __str__(self):
         return self.name
 
-class Book(models.Model):
+class RatingAggregate(models.Model):
+    """
+    Running rating totals kept up to date with F-expression deltas (see api/ratings.py).
+    rating_hist_N counts ratings that round to N half stars, so rating_hist_10 is 5.0.
+    """
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_hist_1 = models.PositiveIntegerField(default=0)
+    rating_hist_2 = models.PositiveIntegerField(default=0)
+    rating_hist_3 = models.PositiveIntegerField(default=0)
+    rating_hist_4 = models.PositiveIntegerField(default=0)
+    rating_hist_5 = models.PositiveIntegerField(default=0)
+    rating_hist_6 = models.PositiveIntegerField(default=0)
+    rating_hist_7 = models.PositiveIntegerField(default=0)
+    rating_hist_8 = models.PositiveIntegerField(default=0)
+    rating_hist_9 = models.PositiveIntegerField(default=0)
+    rating_hist_10 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def rating_histogram(self):
+        return {str(k / 2): getattr(self, f'rating_hist_{k}') for k in range(1, 11)}
+
+class Book(RatingAggregate):
     title = models.CharField(max_length=255)
     # TODO: decide whether to change authors to author which is a ForeignKey to Author
     authors = models.ManyToManyField(Author, related_name='books')
@@ -35,9 +60,35 @@ class Book(models.Model):
     description = models.TextField(blank=True)
     cover = models.ImageField(upload_to='covers/', blank=True, null=True)
     cover_url = models.URLField(blank=True, null=True)  # CDN URL for book covers
+    # Hash of the cover source (cover, else cover_url) naming its resized variants (see api/covers.py)
+    cover_key = models.CharField(max_length=24, blank=True, default='')
     page_count = models.PositiveIntegerField(null=True, blank=True)
     average_rating = models.FloatField(null=True, blank=True, default=None)  # Cached average rating
 
+    class Meta:
+        indexes = [
+            # ?ordering=-average_rating (top rated), with the id the cursor paginator appends
+            models.Index(fields=['-average_rating', 'id'], name='api_book_top_rated'),
+            # Importers match books without an ISBN on their title (see api/ingestion.py)
+            models.Index(fields=['title'], condition=models.Q(isbn__isnull=True), name='api_book_title_no_isbn'),
+            # The source of a cover variant that isn't cached yet
+            models.Index(fields=['cover_key'], name='api_book_cover_key'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from .covers import source_key
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'cover', 'cover_url'} & set(update_fields):
+            self.cover_key = source_key(self.cover.name, self.cover_url)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'cover_key'}
+        super().save(*args, **kwargs)
+
+    @property
+    def reviews_count(self):
+        # Every review carries a rating, so the running rating count doubles as the review counter
+        return self.rating_count
+
     def __str__(self):
         return self.title
 
@@ -49,9 +100,34 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_spoiler = models.BooleanField(default=False)
+    likes_count = models.PositiveIntegerField(default=0)  # Maintained by the ReviewLike signals
 
     class Meta:
         unique_together = ('user', 'book')
+        indexes = [
+            # A book's reviews, most liked first (?book=), with the id the cursor paginator appends
+            models.Index(fields=['book', '-likes_count', '-created_at', 'id'], name='api_review_book_popular'),
+            # A user's reviews newest first (?user=) and all reviews newest first, in ReviewPagination order
+            models.Index(fields=['user', '-created_at', 'id'], name='api_review_user_recent'),
+            models.Index(fields=['-created_at', 'id'], name='api_review_recent'),
+            # Reviews written since the last incremental similarity update (see api/similarity.py)
+            models.Index(fields=['updated_at'], name='api_review_updated'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Remember what is currently counted in the book aggregates so edits only apply the difference.
+        # Read __dict__ directly so deferred fields don't trigger a query.
+        self._loaded_rating = (self.__dict__.get('book_id'), self.__dict__.get('rating'))
+
+    def save(self, *args, **kwargs):
+        # Run the counter signals in the same transaction as the write
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user.username}'s review of {self.book.title}"
@@ -64,6 +140,14 @@ class ReviewLike(models.Model):
     class Meta:
         unique_together = ('user', 'review')
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.username} liked {self.review.user.username}'s review"
 
@@ -86,6 +170,15 @@ class Follow(models.Model):
     class Meta:
         unique_together = ('follower', 'followed')
 
+    def save(self, *args, **kwargs):
+        # Run the counter and feed signals in the same transaction as the write
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.follower.username} follows {self.followed.username}"
 
@@ -111,14 +204,44 @@ class ReviewTag(models.Model):
 
 class Activity(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    action = models.CharField(max_length=255)  # e.g., 'reviewed', 'added_to_list', 'followed'
+    action = models.CharField(max_length=255)  # e.g., 'reviewed', 'liked_review', 'added_to_list', 'followed'
     book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True, blank=True)
     target_user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='activity_targets')
-    created_at = models.DateTimeField(auto_now_add=True)
+    review = models.ForeignKey(Review, on_delete=models.CASCADE, null=True, blank=True, related_name='activities')
+    created_at = models.DateTimeField(default=timezone.now)  # Settable, so backfills keep the original time
+    # False when the actor was over the fan-out limit, so followers' feeds pull it on read (see api/feed.py)
+    fanned_out = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            # Newest activity of a user, for feed backfills and rebuilds (see api/feed.py)
+            models.Index(fields=['user', '-created_at', '-id'], name='api_activity_user_recent'),
+            # Newest activity of a user that feeds pull on read
+            models.Index(
+                fields=['user', '-created_at', '-id'], condition=models.Q(fanned_out=False), name='api_activity_pulled',
+            ),
+            # Likes received, for the activity panel
+            models.Index(fields=['target_user', 'action', '-created_at', '-id'], name='api_activity_target_recent'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} {self.action}"
 
+class FeedEntry(models.Model):
+    """An activity copied into a follower's home feed when it happened (fan-out on write)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE, related_name='feed_entries')
+    created_at = models.DateTimeField()  # Copy of activity.created_at, so a feed page is one index range scan
+
+    class Meta:
+        unique_together = ('user', 'activity')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-activity'], name='api_feedentry_user_recent'),
+        ]
+
+    def __str__(self):
+        return f"{self.activity} in {self.user.username}'s feed"
+
 class Profile(models.Model):
     ROLE_CHOICES = [
         ('user', 'User'),
@@ -128,10 +251,33 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
     is_verified = models.BooleanField(default=False)  # For authors only
+    followers_count = models.PositiveIntegerField(default=0)  # Maintained by the Follow signals
 
     def __str__(self):
         return f"{self.user.username} - {self.role}"
 
+class UserStats(RatingAggregate):
+    """
+    Per-user rollup behind /api/user/stats/, kept current by the Review, ReviewLike and
+    DiaryEntry signals (see api/stats.py). The rating fields cover the user's own reviews.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    likes_received = models.PositiveIntegerField(default=0)
+    books_read_by_year = models.JSONField(default=dict)  # {"2024": 12, ...} from 'read' diary entries
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def books_reviewed(self):
+        # One review per user and book, so every review is a distinct book
+        return self.rating_count
+
+    @property
+    def average_rating(self):
+        return float(self.rating_sum) / self.rating_count if self.rating_count else None
+
+    def __str__(self):
+        return f"{self.user.username}'s stats"
+
 class DiaryEntry(models.Model):
     STATUS_CHOICES = [
         ('to-read', 'To Read'),
@@ -145,16 +291,407 @@ class DiaryEntry(models.Model):
 
     class Meta:
         unique_together = ('user', 'book')  # One entry per user-book
+        indexes = [
+            # A user's entries by status, and their 'read' entries by date for the stats rollup (see api/stats.py)
+            models.Index(fields=['user', 'status', 'read_date'], name='api_diaryentry_user_status'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Status the entry was loaded with, so saves can tell a status transition from other edits
+        self._loaded_status = self.__dict__.get('status')
 
     def __str__(self):
         return f"{self.user.username}'s diary: {self.book.title} ({self.status})"
 
-from django.db.models.signals import post_save, post_delete
+class BookSimilarity(models.Model):
+    """
+    One of a book's nearest neighbours by readers in common ("readers also liked"),
+    rewritten by `manage.py rebuild_similarities` (see api/similarity.py).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similarities')
+    similar_book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()  # Cosine similarity of the two books' reader vectors, 0 to 1
+
+    class Meta:
+        unique_together = ('book', 'similar_book')
+        indexes = [
+            # A book's neighbours best first, read as one range scan
+            models.Index(fields=['book', '-score'], name='api_booksimilarity_top'),
+        ]
+
+    def __str__(self):
+        return f"{self.similar_book_id} is like {self.book_id} ({self.score:.3f})"
+
+class TrendingScore(models.Model):
+    """
+    A book's trending scores, for the whole catalog (genre null) or copied for one of its
+    genres so each genre has a leaderboard of its own; kept current by signals (see api/trending.py).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    genre = models.ForeignKey(Genre, null=True, on_delete=models.CASCADE, related_name='+')
+    # Natural logs of the decayed sums of event weights, only comparable with each other
+    day_score = models.FloatField()
+    week_score = models.FloatField()
+    all_score = models.FloatField(default=0)  # Plain sum of event weights
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'genre'], name='api_trendingscore_book_genre'),
+            # NULLs never collide in the constraint above, so the catalog rows need their own
+            models.UniqueConstraint(fields=['book'], condition=models.Q(genre=None), name='api_trendingscore_book_catalog'),
+        ]
+        indexes = [
+            # Top N of one leaderboard per window, read as one range scan
+            models.Index(fields=['genre', '-day_score', 'book'], name='api_trending_day'),
+            models.Index(fields=['genre', '-week_score', 'book'], name='api_trending_week'),
+            models.Index(fields=['genre', '-all_score', 'book'], name='api_trending_all'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} in {self.genre_id or 'all genres'}: {self.all_score:g}"
+
+class FacetChange(models.Model):
+    """
+    A book whose genres, publication date or page count may have changed, or that was
+    deleted; every process's facet bitmaps catch up by reading these (see api/facets.py).
+    """
+    book_id = models.IntegerField()  # Not a foreign key: deleted books are logged too
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Changes since a process last caught up, and old ones to prune
+            models.Index(fields=['created_at'], name='api_facetchange_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} at {self.created_at:%Y-%m-%d %H:%M:%S}"
+
+class AnalyticsBucket(models.Model):
+    """
+    Event count of one metric over one hour or day, kept current by signals (see api/analytics.py).
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    metric = models.CharField(max_length=32)
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    start = models.DateTimeField()  # Start of the bucket in UTC
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        # Also the index every window and series query scans
+        unique_together = ('metric', 'granularity', 'start')
+
+    def __str__(self):
+        return f"{self.metric} per {self.granularity} at {self.start:%Y-%m-%d %H:%M}: {self.count}"
+
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 
 @receiver([post_save, post_delete], sender=Review)
-def update_book_average_rating(sender, instance, **kwargs):
-    book = instance.book
-    avg = book.reviews.aggregate(Avg('rating'))['rating__avg']
-    book.average_rating = avg
-    book.save(update_fields=['average_rating'])
+def invalidate_reviewed_book_cache(sender, instance, created=False, **kwargs):
+    # Registered before the rating receivers below, which reset _loaded_rating
+    from .caching import bump_versions
+    old_book_id, old_rating = instance._loaded_rating
+    if kwargs['signal'] is post_save and not created and (old_book_id, old_rating) == (instance.book_id, instance.rating):
+        return  # Only the text changed, which book responses don't include
+    bump_versions({old_book_id, instance.book_id} - {None})
+
+@receiver([post_save, post_delete], sender=Review)
+def update_user_stats_ratings(sender, instance, created=False, update_fields=None, **kwargs):
+    # Also registered before the book rating receivers, which reset _loaded_rating
+    from .stats import apply_user_rating_change, refresh_user_stats
+    _, old_rating = instance._loaded_rating
+    if kwargs['signal'] is post_delete:
+        if old_rating is None:
+            refresh_user_stats(instance.user_id)
+        else:
+            apply_user_rating_change(instance.user_id, old_rating, None)
+    elif created:
+        apply_user_rating_change(instance.user_id, None, instance.rating)
+    elif update_fields is not None and 'rating' not in update_fields:
+        return
+    elif old_rating is None:
+        refresh_user_stats(instance.user_id)
+    else:
+        apply_user_rating_change(instance.user_id, old_rating, instance.rating)
+
+@receiver(post_save, sender=Review)
+def update_book_rating_on_save(sender, instance, created, update_fields=None, **kwargs):
+    from .ratings import apply_rating_change, rebuild_book_ratings
+    old_book_id, old_rating = instance._loaded_rating
+    if created:
+        apply_rating_change(instance.book_id, None, instance.rating)
+    elif update_fields is not None and not {'rating', 'book'} & set(update_fields):
+        return
+    elif old_rating is None:
+        # Rating was deferred when the review was loaded, so there is no old value to diff against
+        rebuild_book_ratings({old_book_id, instance.book_id} - {None})
+    elif old_book_id != instance.book_id:
+        # Review moved to another book: take it off the old one, add it to the new one
+        apply_rating_change(old_book_id, old_rating, None)
+        apply_rating_change(instance.book_id, None, instance.rating)
+    else:
+        apply_rating_change(instance.book_id, old_rating, instance.rating)
+    instance._loaded_rating = (instance.book_id, instance.rating)
+
+@receiver(post_delete, sender=Review)
+def update_book_rating_on_delete(sender, instance, **kwargs):
+    from .ratings import apply_rating_change, rebuild_book_ratings
+    book_id, rating = instance._loaded_rating
+    if rating is None:
+        rebuild_book_ratings([instance.book_id])
+    else:
+        apply_rating_change(book_id, rating, None)
+
+@receiver(post_save, sender=ReviewLike)
+def increment_review_likes_count(sender, instance, created, **kwargs):
+    if created:
+        Review.objects.filter(pk=instance.review_id).update(likes_count=F('likes_count') + 1)
+
+@receiver(post_delete, sender=ReviewLike)
+def decrement_review_likes_count(sender, instance, **kwargs):
+    Review.objects.filter(pk=instance.review_id, likes_count__gt=0).update(likes_count=F('likes_count') - 1)
+
+@receiver(post_save, sender=ReviewLike)
+def increment_likes_received(sender, instance, created, **kwargs):
+    from .stats import apply_likes_received
+    if created:
+        apply_likes_received(instance.review_id, 1)
+
+@receiver(post_delete, sender=ReviewLike)
+def decrement_likes_received(sender, instance, **kwargs):
+    from .stats import apply_likes_received
+    apply_likes_received(instance.review_id, -1)
+
+@receiver([post_save, post_delete], sender=DiaryEntry)
+def update_user_stats_reading(sender, instance, **kwargs):
+    from .stats import update_books_read_by_year
+    update_books_read_by_year(instance.user_id)
+
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=ReviewLike)
+@receiver(post_save, sender=User)
+def count_created_row(sender, instance, created, **kwargs):
+    from .analytics import record_row
+    if created:
+        record_row(instance)
+
+@receiver(pre_delete, sender=Review)
+@receiver(pre_delete, sender=ReviewLike)
+@receiver(pre_delete, sender=User)
+def load_deleted_row_timestamp(sender, instance, **kwargs):
+    # The receivers below read it once the row is gone, when a deferred field can't be loaded
+    from .analytics import SOURCES
+    for model, field in SOURCES.values():
+        if isinstance(instance, model) and field in instance.get_deferred_fields():
+            instance.refresh_from_db(fields=[field])
+
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=ReviewLike)
+@receiver(post_delete, sender=User)
+def uncount_deleted_row(sender, instance, **kwargs):
+    from .analytics import record_row
+    record_row(instance, -1)
+
+@receiver(post_save, sender=DiaryEntry)
+def add_diary_transition_to_trending(sender, instance, created, update_fields=None, **kwargs):
+    # Registered before count_diary_transition, which resets _loaded_status
+    from .trending import DIARY_WEIGHTS, add_event
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    if created or instance._loaded_status not in (None, instance.status):
+        add_event(instance.book_id, DIARY_WEIGHTS[instance.status])
+
+@receiver(post_save, sender=DiaryEntry)
+def count_diary_transition(sender, instance, created, update_fields=None, **kwargs):
+    from .analytics import DIARY_METRICS, record_event
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    # A deferred status (None) leaves nothing to compare with, so the save isn't counted
+    if created or instance._loaded_status not in (None, instance.status):
+        record_event(DIARY_METRICS[instance.status])
+    instance._loaded_status = instance.status
+
+@receiver(post_save, sender=Review)
+def add_review_to_trending(sender, instance, created, **kwargs):
+    from .trending import REVIEW_WEIGHT, add_event
+    if created:
+        add_event(instance.book_id, REVIEW_WEIGHT, instance.created_at)
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_trending(sender, instance, **kwargs):
+    from .trending import REVIEW_WEIGHT, remove_event
+    remove_event(instance.book_id, REVIEW_WEIGHT, instance.created_at)
+
+@receiver(post_save, sender=ReviewLike)
+def add_like_to_trending(sender, instance, created, **kwargs):
+    from .trending import LIKE_WEIGHT, add_event, liked_book_id
+    if created:
+        add_event(liked_book_id(instance.review_id), LIKE_WEIGHT, instance.created_at)
+
+@receiver(post_delete, sender=ReviewLike)
+def remove_like_from_trending(sender, instance, **kwargs):
+    from .trending import LIKE_WEIGHT, liked_book_id, remove_event
+    book_id = liked_book_id(instance.review_id)
+    if book_id is not None:  # The review may be gone already, e.g. in a cascade
+        remove_event(book_id, LIKE_WEIGHT, instance.created_at)
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.filter(user_id=instance.followed_id).update(followers_count=F('followers_count') + 1)
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    Profile.objects.filter(user_id=instance.followed_id, followers_count__gt=0).update(followers_count=F('followers_count') - 1)
+
+@receiver(post_save, sender=Review)
+def record_review_activity(sender, instance, created, **kwargs):
+    from .feed import REVIEWED, record_activity
+    if created:
+        record_activity(instance.user_id, REVIEWED, book_id=instance.book_id, review_id=instance.pk)
+
+@receiver(post_save, sender=ReviewLike)
+def record_like_activity(sender, instance, created, **kwargs):
+    from .feed import LIKED_REVIEW, record_activity
+    if created:
+        author_id, book_id = Review.objects.values_list('user_id', 'book_id').get(pk=instance.review_id)
+        record_activity(instance.user_id, LIKED_REVIEW, book_id=book_id, target_user_id=author_id, review_id=instance.review_id)
+
+@receiver(post_delete, sender=ReviewLike)
+def remove_like_activity(sender, instance, **kwargs):
+    from .feed import LIKED_REVIEW
+    # Its feed entries go with it through the cascade
+    Activity.objects.filter(user_id=instance.user_id, action=LIKED_REVIEW, review_id=instance.review_id).delete()
+
+@receiver(post_save, sender=Follow)
+def record_follow_activity(sender, instance, created, **kwargs):
+    from .feed import FOLLOWED, backfill_feed, record_activity
+    if created:
+        record_activity(instance.follower_id, FOLLOWED, target_user_id=instance.followed_id)
+        backfill_feed(instance.follower_id, instance.followed_id)
+
+@receiver(post_delete, sender=Follow)
+def remove_follow_activity(sender, instance, **kwargs):
+    from .feed import FOLLOWED, forget_feed
+    Activity.objects.filter(user_id=instance.follower_id, action=FOLLOWED, target_user_id=instance.followed_id).delete()
+    forget_feed(instance.follower_id, instance.followed_id)
+
+@receiver(m2m_changed, sender=List.books.through)
+def record_list_activity(sender, instance, action, reverse, pk_set, **kwargs):
+    from .feed import ADDED_TO_LIST, record_activity
+    if action != 'post_add' or not pk_set:
+        return
+    if not reverse:
+        if instance.is_public:
+            for book_id in pk_set:
+                record_activity(instance.user_id, ADDED_TO_LIST, book_id=book_id)
+    else:
+        # Added from the book side: pk_set holds the lists
+        for list_id, user_id in List.objects.filter(pk__in=pk_set, is_public=True).values_list('pk', 'user_id'):
+            record_activity(user_id, ADDED_TO_LIST, book_id=instance.pk)
+
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    from .caching import bump_versions
+    bump_versions([instance.pk])
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Publisher)
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Publisher)
+def invalidate_related_book_cache(sender, instance, created=False, **kwargs):
+    from .caching import bump_versions
+    if created:
+        return  # A new author, genre or publisher isn't attached to any book yet
+    relation = {Author: 'authors', Genre: 'genres', Publisher: 'publisher'}[sender]
+    book_ids = list(Book.objects.filter(**{relation: instance}).values_list('pk', flat=True))
+    bump_versions(book_ids, catalog=bool(book_ids))
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def invalidate_book_relations_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    from .caching import bump_versions
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_versions([instance.pk])
+    else:
+        # Changed from the author/genre side: pk_set holds the books, except for clear()
+        bump_versions(pk_set or ())
+
+@receiver(post_save, sender=Book)
+def update_book_search_index(sender, instance, **kwargs):
+    from .search import reindex_books
+    reindex_books([instance.pk])
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_search_index(sender, instance, **kwargs):
+    from .search import unindex_books
+    unindex_books([instance.pk])
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def update_related_books_search_index(sender, instance, created=False, **kwargs):
+    from .search import reindex_books
+    if not created:
+        reindex_books(instance.books.values_list('pk', flat=True))
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def update_book_relations_search_index(sender, instance, action, reverse, pk_set, **kwargs):
+    from .search import reindex_books
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reindex_books([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        reindex_books(pk_set)
+    elif action == 'pre_clear':
+        # Changed from the author/genre side: collect the books before clear() detaches them
+        reindex_books(instance.books.values_list('pk', flat=True))
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def update_trending_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    from .trending import sync_genres
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            sync_genres([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        sync_genres(pk_set)
+    elif action == 'post_clear':
+        # Changed from the genre side: the books that had it are those with a copy for it
+        sync_genres(TrendingScore.objects.filter(genre=instance).values_list('book_id', flat=True))
+
+@receiver([post_save, post_delete], sender=Book)
+def record_book_facet_change(sender, instance, update_fields=None, **kwargs):
+    from .facets import FACET_FIELDS, record_changes
+    if update_fields is not None and not set(update_fields) & set(FACET_FIELDS):
+        return
+    record_changes([instance.pk])
+
+@receiver(pre_delete, sender=Genre)
+def record_genre_facet_changes(sender, instance, **kwargs):
+    # The cascade drops the genre's through rows without m2m signals
+    from .facets import record_changes
+    record_changes(instance.books.values_list('pk', flat=True))
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def record_book_genres_facet_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    from .facets import record_changes
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            record_changes([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        record_changes(pk_set)
+    elif action == 'pre_clear':
+        # Changed from the genre side: collect the books before clear() detaches them
+        record_changes(instance.books.values_list('pk', flat=True))
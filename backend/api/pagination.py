@@ -0,0 +1,173 @@
+"""
+Keyset (seek) pagination.
+
+Pages are selected with a WHERE clause on the ordering columns of the last row
+seen instead of OFFSET, so a deep page costs the same as the first one, and no
+COUNT(*) query runs. The ordering always ends in the primary key, which makes it
+total and keeps pages stable while rows are inserted.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Orders by the queryset's own order_by() when it has one (e.g. ?ordering= or a view
+    default), otherwise by `ordering`, with 'id' appended as a tiebreaker.
+
+    Only active when the client sends ?cursor= or ?page_size=; other requests keep
+    getting the plain unpaginated list that existing clients expect.
+    """
+    ordering = ('-id',)
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(self.ordering)
+        fields = []
+        for term in ordering:
+            if not isinstance(term, str):
+                raise ValidationError('Cursor pagination only supports ordering by plain model fields.')
+            name = term.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            try:
+                field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not field.concrete or field.is_relation:
+                raise ValidationError(f'Cannot paginate by cursor when ordering by "{name}".')
+            fields.append((field, term.startswith('-')))
+        if not any(field.primary_key for field, _ in fields):
+            fields.append((queryset.model._meta.pk, False))
+        return fields
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = self.get_ordering(queryset)
+        values, reverse = self.decode_cursor(request)
+
+        # Walking backwards is the same query with every direction (and NULL placement) flipped
+        directions = [descending != reverse for _, descending in self.fields]
+        nulls_last = not reverse
+        null_placement = {'nulls_last': True} if nulls_last else {'nulls_first': True}
+        queryset = queryset.order_by(*[
+            F(field.attname).desc(**null_placement) if descending else F(field.attname).asc(**null_placement)
+            for (field, _), descending in zip(self.fields, directions)
+        ])
+        if values is not None:
+            queryset = queryset.filter(self.after(values, directions, nulls_last))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            # A cursor in the request means there is a page on the side we came from
+            has_next, has_previous = has_more, values is not None
+
+        self.next_values = self.position(rows[-1]) if rows and has_next else None
+        self.previous_values = self.position(rows[0]) if rows and has_previous else None
+        return rows
+
+    def after(self, values, directions, nulls_last):
+        """Rows strictly after `values` in the (possibly flipped) ordering."""
+        condition = Q(pk__in=[])
+        equal_so_far = Q()
+        for (field, _), descending, value in zip(self.fields, directions, values):
+            name = field.attname
+            if value is None:
+                if not nulls_last:
+                    condition |= equal_so_far & Q(**{f'{name}__isnull': False})
+                equal_so_far &= Q(**{f'{name}__isnull': True})
+                continue
+            beyond = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+            if field.null and nulls_last:
+                beyond |= Q(**{f'{name}__isnull': True})
+            condition |= equal_so_far & beyond
+            equal_so_far &= Q(**{name: value})
+        return condition
+
+    def position(self, row):
+        # Rows are model instances, or dicts when the view reads values() (see api/fastpath.py)
+        if isinstance(row, dict):
+            return [row[field.attname] for field, _ in self.fields]
+        return [getattr(row, field.attname) for field, _ in self.fields]
+
+    def encode_cursor(self, values, reverse):
+        # Full-precision values: DjangoJSONEncoder would cut datetimes to milliseconds
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        payload = json.dumps({'v': values, 'r': reverse}, default=str, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            raw_values, reverse = payload['v'], bool(payload.get('r'))
+            if len(raw_values) != len(self.fields):
+                raise ValueError
+            values = [
+                None if value is None else field.to_python(value)
+                for (field, _), value in zip(self.fields, raw_values)
+            ]
+        except Exception:
+            raise NotFound('Invalid cursor')
+        return values, reverse
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return self.encode_cursor(self.next_values, False)
+
+    def get_previous_link(self):
+        if self.previous_values is None:
+            return None
+        return self.encode_cursor(self.previous_values, True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
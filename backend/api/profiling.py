@@ -0,0 +1,248 @@
+"""
+Opt-in request profiling for production, where django-silk isn't installed.
+
+A request is profiled when it carries 'X-Profile: <PROFILING_TOKEN>', or when an admin
+has turned sampling on through /api/profiling/ (a share of requests for a number of
+minutes). A profiled request records every SQL statement with its time and the line
+of our code that ran it, groups statements by shape (literals stripped) to point out
+N+1 patterns, and can add a cProfile or pyinstrument trace of the whole request.
+
+Profiles are kept in a ring buffer of settings.PROFILING_BUFFER_SIZE slots in the
+default cache, so with a shared cache every worker's profiles show up in one list.
+Requests that aren't profiled only pay for reading the toggle, which each worker
+keeps in memory for TOGGLE_REFRESH seconds.
+"""
+import cProfile
+import hmac
+import io
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .concurrency import query_wrapper
+from .streaming import watch_streaming
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # Optional: pip install pyinstrument
+    PyinstrumentProfiler = None
+
+TOGGLE_KEY = 'profiling:toggle'
+CURSOR_KEY = 'profiling:cursor'
+TOGGLE_REFRESH = 5
+PROFILE_TIMEOUT = 24 * 60 * 60
+
+TRACES = ('cprofile', 'pyinstrument')
+
+# Bounds on what one profile keeps
+MAX_QUERIES = 1000
+MAX_SQL_LENGTH = 2000
+MAX_ORIGINS = 5
+
+APP_DIR = Path(__file__).resolve().parent
+# Our own code that wraps every query rather than issues it: whole files, and single functions
+INSTRUMENTATION_FILES = {str(APP_DIR / name) for name in ('profiling.py', 'metrics.py', 'middleware.py', 'concurrency.py')}
+INSTRUMENTATION_FUNCTIONS = {(str(APP_DIR / 'streaming.py'), 'stream')}
+
+# Quoted strings, numbers and placeholders become ?, then lists of them become (...)
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+_toggle = {'read_at': 0.0, 'value': None}
+
+
+def slot_key(slot):
+    return f'profiling:slot:{slot}'
+
+
+def get_toggle():
+    """Current sampling settings, or None when sampling is off."""
+    now = time.monotonic()
+    if now - _toggle['read_at'] > TOGGLE_REFRESH:
+        _toggle.update(read_at=now, value=cache.get(TOGGLE_KEY))
+    return _toggle['value']
+
+
+def set_toggle(sample_rate, minutes, trace=None):
+    """Profile sample_rate of all requests for the next minutes; sample_rate=0 turns sampling off."""
+    value = None
+    if sample_rate > 0:
+        until = timezone.now() + timedelta(minutes=minutes)
+        value = {'sample_rate': sample_rate, 'trace': trace, 'until': until.isoformat()}
+        cache.set(TOGGLE_KEY, value, minutes * 60)
+    else:
+        cache.delete(TOGGLE_KEY)
+    _toggle.update(read_at=time.monotonic(), value=value)  # Other workers catch up within TOGGLE_REFRESH
+    return value
+
+
+def wants_profile(request):
+    """(whether to profile the request, trace to take or None)."""
+    token = settings.PROFILING_TOKEN
+    header = request.META.get('HTTP_X_PROFILE')
+    if token and header and hmac.compare_digest(header, token):
+        return True, request.META.get('HTTP_X_PROFILE_TRACE')
+    toggle = get_toggle()
+    if toggle and random.random() < toggle['sample_rate']:
+        return True, toggle['trace']
+    return False, None
+
+
+def query_origin():
+    """'api/views.py:123 in list' for the innermost frame of our own code that ran the query."""
+    frame = sys._getframe(1)
+    while frame:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(str(APP_DIR))
+            and filename not in INSTRUMENTATION_FILES
+            and (filename, frame.f_code.co_name) not in INSTRUMENTATION_FUNCTIONS
+        ):
+            return f'{Path(filename).relative_to(settings.BASE_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def query_shape(sql):
+    return VALUE_LISTS.sub('(...)', LITERALS.sub('?', sql))
+
+
+class QueryRecorder:
+    """Query wrapper (see api/concurrency.py) keeping each query's SQL, time and origin."""
+
+    def __init__(self):
+        self.queries = []
+        self.dropped = 0
+        self.lock = threading.Lock()  # Async views run queries on several threads at once
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            query = {'sql': sql[:MAX_SQL_LENGTH], 'ms': round(duration * 1000, 3), 'origin': query_origin()}
+            with self.lock:
+                if len(self.queries) < MAX_QUERIES:
+                    self.queries.append(query)
+                else:
+                    self.dropped += 1
+
+
+def repeated_queries(queries):
+    """Query shapes run at least PROFILING_REPEAT_THRESHOLD times, most frequent first: likely N+1s."""
+    shapes = {}
+    for query in queries:
+        shape = shapes.setdefault(query_shape(query['sql']), {'count': 0, 'ms': 0.0, 'origins': []})
+        shape['count'] += 1
+        shape['ms'] += query['ms']
+        if query['origin'] and query['origin'] not in shape['origins'] and len(shape['origins']) < MAX_ORIGINS:
+            shape['origins'].append(query['origin'])
+    return sorted(
+        (
+            {'shape': sql, 'count': shape['count'], 'ms': round(shape['ms'], 3), 'origins': shape['origins']}
+            for sql, shape in shapes.items() if shape['count'] >= settings.PROFILING_REPEAT_THRESHOLD
+        ),
+        key=lambda shape: -shape['count'],
+    )
+
+
+def run_traced(trace, call):
+    """(result of call(), text of the requested trace or an explanation of why there is none)."""
+    if trace == 'cprofile':
+        profiler = cProfile.Profile()
+        result = profiler.runcall(call)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+        return result, output.getvalue()
+    if trace == 'pyinstrument':
+        if PyinstrumentProfiler is None:
+            return call(), 'pyinstrument is not installed'
+        profiler = PyinstrumentProfiler()
+        profiler.start()
+        try:
+            result = call()
+        finally:
+            profiler.stop()
+        return result, profiler.output_text()
+    return call(), None
+
+
+def profile_request(request, get_response, trace=None):
+    recorder = QueryRecorder()
+    started = timezone.now()
+    start = time.perf_counter()
+    with query_wrapper(recorder):
+        response, trace_output = run_traced(trace if trace in TRACES else None, lambda: get_response(request))
+    return finish_profile(request, response, recorder, started, start, trace_output)
+
+
+async def aprofile_request(request, get_response, trace=None):
+    """profile_request() for the async middleware stack. An async request hops between threads, so no trace is taken."""
+    recorder = QueryRecorder()
+    started = timezone.now()
+    start = time.perf_counter()
+    with query_wrapper(recorder):
+        response = await get_response(request)
+    trace_output = 'Traces are only taken of requests served synchronously (WSGI)' if trace in TRACES else None
+    return finish_profile(request, response, recorder, started, start, trace_output)
+
+
+def finish_profile(request, response, recorder, started, start, trace_output):
+    profile_id = uuid.uuid4().hex[:12]
+    response['X-Profile-Id'] = profile_id
+
+    def finish(sent=None):
+        match = getattr(request, 'resolver_match', None)
+        store({
+            'id': profile_id,
+            'started': started.isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'route': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            'query_count': len(recorder.queries) + recorder.dropped,
+            'query_ms': round(sum(query['ms'] for query in recorder.queries), 3),
+            'repeated_queries': repeated_queries(recorder.queries),
+            'queries': recorder.queries,
+            'queries_dropped': recorder.dropped,
+            'trace': trace_output,
+        })
+
+    if response.streaming:
+        # The body's queries run while it is sent; the trace only covers the view itself
+        watch_streaming(response, recorder, finish)
+    else:
+        finish()
+    return response
+
+
+def store(profile):
+    """Write a profile into the next slot of the ring buffer, replacing the oldest one."""
+    cache.add(CURSOR_KEY, 0, None)
+    try:
+        slot = cache.incr(CURSOR_KEY) % settings.PROFILING_BUFFER_SIZE
+    except ValueError:  # Evicted between add() and incr()
+        slot = 0
+    cache.set(slot_key(slot), profile, PROFILE_TIMEOUT)
+
+
+def list_profiles():
+    """Every profile in the buffer, newest first."""
+    profiles = cache.get_many([slot_key(slot) for slot in range(settings.PROFILING_BUFFER_SIZE)]).values()
+    return sorted(profiles, key=lambda profile: profile['started'], reverse=True)
+
+
+def get_profile(profile_id):
+    return next((profile for profile in list_profiles() if profile['id'] == profile_id), None)
@@ -0,0 +1,200 @@
+"""
+Incremental book rating aggregates.
+
+Every Review write turns into a single UPDATE on the book row that adds or removes
+the review's contribution with F-expressions, so the cost no longer grows with the
+number of reviews a book has. rebuild_book_ratings() recomputes everything from the
+reviews table for repairs and backfills, and recount_book_ratings() does the same for
+a whole set of books in two UPDATE statements after bulk loads.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.lookups import GreaterThan
+
+from .models import Book, Review
+
+HALF_STAR_BUCKETS = range(1, 11)
+RATING_FIELDS = ['rating_sum', 'rating_count', 'average_rating'] + [f'rating_hist_{k}' for k in HALF_STAR_BUCKETS]
+
+
+def to_rating(value):
+    if value is None:
+        return None
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def rating_bucket(rating):
+    """Number of half stars a rating rounds to (half up), clamped to 1..10."""
+    half_stars = int(to_rating(rating) * 2 + Decimal('0.5'))
+    return min(max(half_stars, 1), 10)
+
+
+def bucket_filter(k):
+    """Q on Review.rating matching rating_bucket() == k, for aggregating in SQL."""
+    q = Q()
+    if k > 1:
+        q &= Q(rating__gte=Decimal(2 * k - 1) / 4)
+    if k < 10:
+        q &= Q(rating__lt=Decimal(2 * k + 1) / 4)
+    return q
+
+
+def rating_deltas(old_rating, new_rating):
+    """
+    F-expression updates moving RatingAggregate fields from old_rating to new_rating.
+    old_rating=None adds a rating, new_rating=None removes one.
+    """
+    old_rating, new_rating = to_rating(old_rating), to_rating(new_rating)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    count_delta = (new_rating is not None) - (old_rating is not None)
+
+    hist_deltas = {}
+    if old_rating is not None:
+        k = rating_bucket(old_rating)
+        hist_deltas[k] = hist_deltas.get(k, 0) - 1
+    if new_rating is not None:
+        k = rating_bucket(new_rating)
+        hist_deltas[k] = hist_deltas.get(k, 0) + 1
+
+    updates = {
+        f'rating_hist_{k}': F(f'rating_hist_{k}') + delta
+        for k, delta in hist_deltas.items() if delta
+    }
+    if count_delta:
+        updates['rating_count'] = F('rating_count') + count_delta
+    if sum_delta:
+        updates['rating_sum'] = F('rating_sum') + sum_delta
+    return updates
+
+
+def apply_rating_change(book_id, old_rating, new_rating):
+    """
+    Move a book's aggregates from old_rating to new_rating in one UPDATE.
+    old_rating=None adds a review, new_rating=None removes one.
+    """
+    old_rating, new_rating = to_rating(old_rating), to_rating(new_rating)
+    if book_id is None or old_rating == new_rating:
+        return
+    Book.objects.filter(pk=book_id).update(**book_rating_updates(old_rating, new_rating))
+
+
+def apply_rating_changes(changes):
+    """
+    apply_rating_change() for reviews written in bulk, {book_id: (old_rating, new_rating)}.
+    Books with the same change share one UPDATE.
+    """
+    books = {}
+    for book_id, (old_rating, new_rating) in changes.items():
+        old_rating, new_rating = to_rating(old_rating), to_rating(new_rating)
+        if old_rating != new_rating:
+            books.setdefault((old_rating, new_rating), []).append(book_id)
+    for (old_rating, new_rating), book_ids in books.items():
+        Book.objects.filter(pk__in=book_ids).update(**book_rating_updates(old_rating, new_rating))
+
+
+def book_rating_updates(old_rating, new_rating):
+    updates = rating_deltas(old_rating, new_rating)
+    new_sum = updates.get('rating_sum', F('rating_sum'))
+    new_count = updates.get('rating_count', F('rating_count'))
+    # The right-hand side sees the pre-update row, so the average is derived from the same new totals
+    updates['average_rating'] = Case(
+        When(GreaterThan(new_count, 0), then=Cast(new_sum, FloatField()) / Cast(new_count, FloatField())),
+        default=Value(None),
+        output_field=FloatField(),
+    )
+    return updates
+
+
+def aggregate_reviews(book_ids):
+    """Recompute rating aggregates for the given books straight from the reviews table."""
+    rows = (
+        Review.objects.filter(book_id__in=book_ids)
+        .values('book_id')
+        .annotate(
+            rating_sum=Sum('rating'),
+            rating_count=Count('id'),
+            **{f'rating_hist_{k}': Count('id', filter=bucket_filter(k)) for k in HALF_STAR_BUCKETS},
+        )
+    )
+    result = {}
+    for row in rows:
+        values = {field: row[field] for field in RATING_FIELDS if field != 'average_rating'}
+        values['rating_sum'] = to_rating(values['rating_sum'])
+        values['average_rating'] = float(values['rating_sum']) / values['rating_count']
+        result[row['book_id']] = values
+    return result
+
+
+def empty_aggregates():
+    """
+    Aggregates of a book with no reviews. average_rating is left out: until the first
+    review it holds the rating an import seeded, which a recount has nothing to replace with.
+    """
+    values = {field: 0 for field in RATING_FIELDS if field != 'average_rating'}
+    values['rating_sum'] = Decimal('0')
+    return values
+
+
+def _matches(field, current, value):
+    if field == 'average_rating' and current is not None and value is not None:
+        return abs(current - value) < 1e-9
+    if field == 'rating_sum':
+        return to_rating(current) == value
+    return current == value
+
+
+def drifted_fields(book, values):
+    """Names of the fields in values that differ from what is stored on book."""
+    return [field for field, value in values.items() if not _matches(field, getattr(book, field), value)]
+
+
+def diff_book_ratings(books):
+    """Yield (book, expected_values) for every book whose stored aggregates have drifted."""
+    expected = aggregate_reviews([book.pk for book in books])
+    for book in books:
+        values = expected.get(book.pk) or empty_aggregates()
+        if drifted_fields(book, values):
+            yield book, values
+
+
+def rebuild_book_ratings(book_ids):
+    """Rewrite drifted aggregates for the given books. Returns the number of books fixed."""
+    with transaction.atomic():
+        # Locking the rows first means concurrent review writes either land before the recount
+        # or apply their delta on top of it, never in between
+        books = list(Book.objects.select_for_update().filter(pk__in=book_ids).only('pk', *RATING_FIELDS))
+        fixed = []
+        for book, values in diff_book_ratings(books):
+            for field, value in values.items():
+                setattr(book, field, value)
+            fixed.append(book)
+        if fixed:
+            Book.objects.bulk_update(fixed, RATING_FIELDS)
+    return len(fixed)
+
+
+def recount_book_ratings(books):
+    """
+    Recompute the aggregates of every book in the queryset with set-based UPDATEs,
+    for bulk loads that bypassed the review signals. Returns the number of books updated.
+    Like rebuild_book_ratings(), it keeps the imported average_rating of unreviewed books.
+    """
+    reviews = Review.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+    def subquery(aggregate, output_field):
+        return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value'), output_field=output_field), Value(0))
+
+    updated = books.update(
+        rating_sum=subquery(Sum('rating'), DecimalField(max_digits=12, decimal_places=1)),
+        rating_count=subquery(Count('id'), IntegerField()),
+        **{f'rating_hist_{k}': subquery(Count('id', filter=bucket_filter(k)), IntegerField()) for k in HALF_STAR_BUCKETS},
+    )
+    books.update(average_rating=Case(
+        When(rating_count__gt=0, then=Cast('rating_sum', FloatField()) / Cast('rating_count', FloatField())),
+        default=F('average_rating'),
+        output_field=FloatField(),
+    ))
+    return updated
@@ -0,0 +1,60 @@
+"""
+"Readers also liked" recommendations, served from the BookSimilarity table.
+
+`manage.py rebuild_similarities` (see api/similarity.py) computes each book's nearest
+neighbours offline. Here a book's similar books are one index range scan, and a
+user's recommendations add up the neighbours of the books they liked most, weighted
+by how much they liked them, leaving out every book they already have.
+
+How much an interaction says a reader liked a book is defined once here and used by
+both sides: a review's rating counts when there is one, with two stars or less
+meaning not liked, and otherwise the diary status does.
+"""
+from .models import BookSimilarity, DiaryEntry, Review
+
+STATUS_WEIGHTS = {'read': 1.0, 'reading': 0.8, 'to-read': 0.5}
+
+# Ratings at or below this say nothing in favour of a book
+RATING_FLOOR = 2.0
+
+# A user's best liked books whose neighbours are combined into their recommendations
+MAX_SEEDS = 100
+
+
+def rating_weight(rating):
+    return max(float(rating) - RATING_FLOOR, 0.0) / (5.0 - RATING_FLOOR)
+
+
+def similar_book_ids(book_id, limit):
+    """Ids of a book's nearest neighbours, best first."""
+    return list(
+        BookSimilarity.objects.filter(book_id=book_id).order_by('-score')
+        .values_list('similar_book_id', flat=True)[:limit]
+    )
+
+
+def user_weights(user):
+    """{book_id: weight} of every book the user reviewed or put in their diary, weight 0 included."""
+    weights = {
+        book_id: STATUS_WEIGHTS[status]
+        for book_id, status in DiaryEntry.objects.filter(user=user).values_list('book_id', 'status')
+    }
+    # A review's rating says more than a diary status
+    weights.update(
+        (book_id, rating_weight(rating))
+        for book_id, rating in Review.objects.filter(user=user).values_list('book_id', 'rating')
+    )
+    return weights
+
+
+def recommended_book_ids(user, limit):
+    """Ids of the books most similar to what the user liked, that they haven't reviewed or listed, best first."""
+    weights = user_weights(user)
+    seeds = sorted((book_id for book_id, weight in weights.items() if weight > 0), key=lambda pk: -weights[pk])[:MAX_SEEDS]
+    scores = {}
+    for book_id, similar_id, score in BookSimilarity.objects.filter(book_id__in=seeds).values_list(
+        'book_id', 'similar_book_id', 'score',
+    ):
+        if similar_id not in weights:
+            scores[similar_id] = scores.get(similar_id, 0.0) + weights[book_id] * score
+    return sorted(scores, key=lambda pk: (-scores[pk], pk))[:limit]
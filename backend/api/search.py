@@ -0,0 +1,225 @@
+"""
+Full-text book search.
+
+Each book gets one row in a dedicated search table built from its title, author
+names, genre names and description:
+
+- PostgreSQL: api_booksearch holds a weighted tsvector with a GIN index, plus a
+  plain `terms` column (title and authors) with a pg_trgm index for typo-tolerant
+  fallback matching.
+- SQLite: api_booksearch is an FTS5 virtual table (rowid = book id) ranked with
+  bm25, and api_booksearch_vocab exposes its vocabulary for spelling correction.
+
+Every query term is matched as a prefix, so partial input works for autocomplete.
+When a strict search finds too few books, misspelled terms are corrected (SQLite)
+or matched by trigram similarity (PostgreSQL). The tables are created by migration
+0013 and kept in sync from the Book/Author/Genre signals in models.py.
+"""
+import re
+
+from django.db import connection, transaction
+
+from .models import Book
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return WORD_RE.findall(query.lower())[:8]
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance, giving up with limit + 1 once it is clearly larger than limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def book_documents(book_ids):
+    """(book_id, title, authors, genres, description) for each existing book."""
+    books = Book.objects.filter(pk__in=book_ids).only('pk', 'title', 'description').prefetch_related('authors', 'genres')
+    for book in books:
+        yield (
+            book.pk,
+            book.title,
+            ' '.join(author.name for author in book.authors.all()),
+            ' '.join(genre.name for genre in book.genres.all()),
+            book.description or '',
+        )
+
+
+class PostgresBookIndex:
+    DOCUMENT_SQL = (
+        "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') || "
+        "setweight(to_tsvector('simple', %s), 'C') || setweight(to_tsvector('simple', %s), 'D')"
+    )
+
+    def index(self, book_ids):
+        rows = [
+            (book_id, title, authors, genres, description, f'{title} {authors}')
+            for book_id, title, authors, genres, description in book_documents(book_ids)
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO api_booksearch (book_id, document, terms) VALUES (%s, {self.DOCUMENT_SQL}, %s) '
+                'ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document, terms = EXCLUDED.terms',
+                rows,
+            )
+        missing = set(book_ids) - {row[0] for row in rows}
+        if missing:
+            self.remove(missing)
+
+    def remove(self, book_ids):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_booksearch WHERE book_id = ANY(%s)', [list(book_ids)])
+
+    def prune(self):
+        pass  # Rows go away with their book through ON DELETE CASCADE
+
+    def search(self, terms, limit):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT book_id FROM api_booksearch, to_tsquery('simple', %s) query "
+                'WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC, book_id LIMIT %s',
+                [tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def fuzzy_search(self, terms, limit):
+        phrase = ' '.join(terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT book_id FROM api_booksearch WHERE %s <%% terms '
+                'ORDER BY word_similarity(%s, terms) DESC, book_id LIMIT %s',
+                [phrase, phrase, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteBookIndex:
+    # Column weights for bm25(): title, authors, genres, description
+    RANK_SQL = 'bm25(api_booksearch, 10.0, 5.0, 2.0, 1.0)'
+
+    def index(self, book_ids):
+        rows = list(book_documents(book_ids))
+        with connection.cursor() as cursor:
+            # FTS5 has no upsert; deleting every requested id also drops books that no longer exist
+            cursor.executemany('DELETE FROM api_booksearch WHERE rowid = %s', [(book_id,) for book_id in book_ids])
+            cursor.executemany(
+                'INSERT INTO api_booksearch (rowid, title, authors, genres, description) VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, book_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM api_booksearch WHERE rowid = %s', [(book_id,) for book_id in book_ids])
+
+    def prune(self):
+        """Drop rows of books deleted without going through the signals."""
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_booksearch WHERE rowid NOT IN (SELECT id FROM api_book)')
+
+    def search(self, terms, limit):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM api_booksearch WHERE api_booksearch MATCH %s ORDER BY {self.RANK_SQL}, rowid LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def fuzzy_search(self, terms, limit):
+        corrected = [self.correct(term) for term in terms]
+        if corrected == terms:
+            return []
+        return self.search(corrected, limit)
+
+    def correct(self, term):
+        """The closest indexed word for a term that matches nothing as a prefix."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM api_booksearch_vocab WHERE term >= %s AND term < %s LIMIT 1',
+                [term, term + '\uffff'],
+            )
+            if cursor.fetchone():
+                return term
+            # Typos rarely hit the first letter, which keeps the candidate scan to one vocabulary range
+            limit = 1 if len(term) <= 5 else 2
+            cursor.execute(
+                'SELECT term, doc FROM api_booksearch_vocab WHERE term >= %s AND term < %s '
+                'AND length(term) BETWEEN %s AND %s',
+                [term[0], term[0] + '\uffff', len(term) - limit, len(term) + limit],
+            )
+            best = None
+            for candidate, docs in cursor.fetchall():
+                # Compare against the same-length prefix too, so a misspelt partial word still autocompletes
+                distance = min(edit_distance(term, candidate, limit), edit_distance(term, candidate[:len(term)], limit))
+                if distance <= limit and (best is None or (distance, -docs) < best[:2]):
+                    best = (distance, -docs, candidate)
+        return best[2] if best else term
+
+
+class FallbackBookIndex:
+    """Unindexed LIKE search for database backends without a search table."""
+
+    def index(self, book_ids):
+        pass
+
+    def remove(self, book_ids):
+        pass
+
+    def prune(self):
+        pass
+
+    def search(self, terms, limit):
+        queryset = Book.objects.all()
+        for term in terms:
+            queryset = queryset.filter(title__icontains=term)
+        return list(queryset.order_by('pk').values_list('pk', flat=True)[:limit])
+
+    def fuzzy_search(self, terms, limit):
+        return []
+
+
+def get_index():
+    if connection.vendor == 'postgresql':
+        return PostgresBookIndex()
+    if connection.vendor == 'sqlite':
+        return SQLiteBookIndex()
+    return FallbackBookIndex()
+
+
+def search_books(query, limit=20):
+    """Ranked book ids for a free-text query."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    index = get_index()
+    book_ids = index.search(terms, limit)
+    if len(book_ids) < limit:
+        book_ids += [book_id for book_id in index.fuzzy_search(terms, limit) if book_id not in book_ids]
+    return book_ids[:limit]
+
+
+def reindex_books(book_ids):
+    """Refresh the search rows of the given books once the current transaction commits."""
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    transaction.on_commit(lambda: get_index().index(book_ids))
+
+
+def unindex_books(book_ids):
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    transaction.on_commit(lambda: get_index().remove(book_ids))
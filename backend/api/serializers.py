@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from .covers import variant_urls
 from .models import Author, Publisher, Book, Review, List, Follow, Tag, BookTag, ReviewTag, Activity, Profile, DiaryEntry, ReviewLike, Genre
 
 class AuthorSerializer(serializers.ModelSerializer):
@@ -17,33 +18,76 @@ class GenreSerializer(serializers.ModelSerializer):
         model = Genre
         fields = '__all__'
 
-class BookSerializer(serializers.ModelSerializer):
+def split_names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets for a top-level serializer: ?fields=id,title returns only those fields and
+    ?expand=authors adds the named nested relations to them. Without ?fields= the full
+    representation is returned. Views use requested_fields() and model_columns() to skip the
+    prefetches and columns nobody asked for.
+    """
+    expandable_fields = ()
+
+    @classmethod
+    def requested_fields(cls, request):
+        """Names selected by the request, or None for all of them. Raises ValidationError on unknown names."""
+        if request is None or 'fields' not in request.query_params:
+            return None
+        fields = split_names(request.query_params['fields'])
+        expand = split_names(request.query_params.get('expand', ''))
+        errors = {}
+        if fields - set(cls.Meta.fields):
+            errors['fields'] = f'Unknown fields: {", ".join(sorted(fields - set(cls.Meta.fields)))}'
+        if expand - set(cls.expandable_fields):
+            errors['expand'] = f'Only {", ".join(cls.expandable_fields)} can be expanded'
+        if errors:
+            raise serializers.ValidationError(errors)
+        return fields | expand
+
+    @classmethod
+    def model_columns(cls, requested):
+        """Concrete model fields the requested serializer fields read, for QuerySet.only()."""
+        model_fields = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        serializer_fields = cls().fields
+        return [serializer_fields[name].source for name in requested if serializer_fields[name].source in model_fields]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Only the serializer of the view itself; the same serializer nested elsewhere stays whole
+        top_level = self.parent is None or (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+        requested = self.requested_fields(self.context.get('request')) if top_level else None
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+class CoverVariantsField(serializers.Field):
+    """{variant: URL} of the resized covers of a cover_key (see api/covers.py), or None without a cover."""
+    def to_representation(self, value):
+        return variant_urls(value)
+
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     authors = AuthorSerializer(many=True, read_only=True)
     publisher = PublisherSerializer(read_only=True)
     genres = GenreSerializer(many=True, read_only=True)
-    avg_rating = serializers.SerializerMethodField()
-    cover_url = serializers.SerializerMethodField()
-    reviews_count = serializers.SerializerMethodField()
-
-    def get_avg_rating(self, obj):
-        return obj.average_rating
+    avg_rating = serializers.FloatField(source='average_rating', read_only=True)
+    cover_url = serializers.CharField(read_only=True)
+    covers = CoverVariantsField(source='cover_key', read_only=True)
+    reviews_count = serializers.IntegerField(source='rating_count', read_only=True)
 
-    def get_cover_url(self, obj):
-        return obj.cover_url
-
-    def get_reviews_count(self, obj):
-        return obj.reviews.count()
+    expandable_fields = ('authors', 'publisher', 'genres')
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'description', 'isbn', 'genres', 'page_count', 'publication_date', 'publisher', 'authors', 'average_rating', 'avg_rating', 'cover_url', 'reviews_count']
+        fields = ['id', 'title', 'description', 'isbn', 'genres', 'page_count', 'publication_date', 'publisher', 'authors', 'average_rating', 'avg_rating', 'cover_url', 'covers', 'reviews_count']
 
 class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     user_id = serializers.SerializerMethodField()
     book = BookSerializer(read_only=True)
     book_id = serializers.IntegerField(required=False)  # Writable for POST, read-only for GET
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
     is_liked_by_user = serializers.SerializerMethodField()
 
     def __init__(self, *args, **kwargs):
@@ -62,9 +106,6 @@ class ReviewSerializer(serializers.ModelSerializer):
     def get_book_id(self, obj):
         return obj.book.id
 
-    def get_likes_count(self, obj):
-        return getattr(obj, 'likes_count', obj.likes.count())
-
     def get_is_liked_by_user(self, obj):
         # Use the annotated field if available, otherwise fall back to the query
         if hasattr(obj, 'is_liked_by_user'):
@@ -142,10 +183,11 @@ class ActivitySerializer(serializers.ModelSerializer):
     target_user = serializers.StringRelatedField(read_only=True)
     book_id = serializers.IntegerField(write_only=True, required=False)
     target_user_id = serializers.IntegerField(write_only=True, required=False)
+    review_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Activity
-        fields = ('id', 'user', 'action', 'book', 'target_user', 'book_id', 'target_user_id', 'created_at')
+        fields = ('id', 'user', 'action', 'book', 'target_user', 'book_id', 'target_user_id', 'review_id', 'created_at')
 
 class DiaryEntrySerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
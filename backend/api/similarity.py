@@ -0,0 +1,328 @@
+"""
+Offline item-item similarities for "readers also liked" (served by api/recommendations.py).
+
+Reviews and diary entries become a sparse user x book matrix holding how much each
+reader liked each book (the weights of api/recommendations.py). Once every book's
+column is scaled to unit length, the cosine similarity of two books is the dot product
+of their columns, so one block of books' similarities to every other book is a single
+sparse product. Each row of it keeps only its top_k scores before the next block is
+computed, which bounds memory by the matrix plus one block per worker.
+
+Workers are forked processes sharing the matrix, so it isn't copied to them. The
+parent writes each block as it comes back, in one transaction that replaces the rows
+of that block's books, so a reader never sees a book with half its neighbours. In a
+full rebuild a block covers a range of book ids, and books nobody reads anymore fall
+inside some block's range and lose theirs.
+
+Between full rebuilds, incremental updates bring in the reviews written since the
+last run, found by their updated_at, so new books get neighbours within minutes. Each
+review's weight replaces the one the matrix holds for its reader and book, the book's
+squared norm changes by the difference, and only the reviewed books have their
+neighbours recomputed. Other books' lists, including their scores for the reviewed
+books, wait for the next full rebuild, as do diary changes and deleted reviews.
+
+The raw matrix, its ids, the norms and the updated_at high-water mark are checkpointed
+to settings.SIMILARITY_CHECKPOINT_DIR as .npy files after every run, and the next run
+memory-maps them instead of reading every review again.
+
+numpy and scipy are only needed to run `manage.py rebuild_similarities`; the API
+reads the table without them.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+from scipy import sparse
+
+from .caching import bump_versions
+from .models import BookSimilarity, DiaryEntry, Review
+from .recommendations import RATING_FLOOR, STATUS_WEIGHTS
+
+LOAD_CHUNK_SIZE = 100_000
+WRITE_BATCH_SIZE = 5000
+
+# Reviews are read again from this long before the high-water mark, in case the clocks of
+# the servers that saved them disagree; applying a review twice changes nothing
+MARK_OVERLAP = timedelta(minutes=5)
+
+CHECKPOINT_ARRAYS = ('users', 'books', 'indptr', 'indices', 'data', 'norms')
+
+# (books x users, users x books) normalized matrices, set before the workers fork
+_matrices = None
+
+
+def read_interactions(queryset, to_weights):
+    """(user ids, book ids, weights) arrays of a values_list('user_id', 'book_id', <value>) queryset."""
+    user_ids, book_ids, weights = [], [], []
+    rows = queryset.order_by().iterator(chunk_size=LOAD_CHUNK_SIZE)
+    while chunk := list(islice(rows, LOAD_CHUNK_SIZE)):
+        users, books, values = zip(*chunk)
+        user_ids.append(np.array(users, dtype=np.int64))
+        book_ids.append(np.array(books, dtype=np.int64))
+        weights.append(to_weights(values))
+    if not user_ids:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    return np.concatenate(user_ids), np.concatenate(book_ids), np.concatenate(weights)
+
+
+def status_weights(statuses):
+    return np.array([STATUS_WEIGHTS[status] for status in statuses], dtype=np.float32)
+
+
+def rating_weights(ratings):
+    # recommendations.rating_weight(), for a whole chunk at once
+    return np.maximum(np.array(ratings, dtype=np.float32) - RATING_FLOOR, 0) / (5 - RATING_FLOOR)
+
+
+def latest_review_update():
+    return Review.objects.aggregate(mark=Max('updated_at'))['mark']
+
+
+class Interactions:
+    """
+    How much each user liked each book: a users x books CSR matrix of weights, the sorted
+    user and book ids of its rows and columns, each book's sum of squared weights, and
+    the updated_at of the latest review it includes.
+    """
+
+    def __init__(self, users, books, matrix, norms, mark):
+        self.users = users
+        self.books = books
+        self.matrix = matrix
+        self.norms = norms
+        self.mark = mark
+
+    @classmethod
+    def load(cls):
+        """Read every review and diary entry; a review's weight replaces the diary entry's for its book."""
+        # Taken first: a review saved while reading has a later updated_at and is applied again next run
+        mark = latest_review_update()
+        diary = read_interactions(DiaryEntry.objects.values_list('user_id', 'book_id', 'status'), status_weights)
+        reviews = read_interactions(Review.objects.values_list('user_id', 'book_id', 'rating'), rating_weights)
+        user_ids, book_ids, weights = (np.concatenate(columns) for columns in zip(diary, reviews))
+        users, user_index = np.unique(user_ids, return_inverse=True)
+        books, book_index = np.unique(book_ids, return_inverse=True)
+
+        is_review = np.r_[np.zeros(len(diary[0]), np.int8), np.ones(len(reviews[0]), np.int8)]
+        pairs = user_index * len(books) + book_index
+        order = np.lexsort((is_review, pairs))
+        last = order[np.diff(pairs[order], append=-1) != 0]
+        matrix = sparse.csr_matrix(
+            (weights[last], (user_index[last], book_index[last])), shape=(len(users), len(books)), dtype=np.float32,
+        )
+        matrix.eliminate_zeros()
+        norms = np.asarray(matrix.multiply(matrix).sum(axis=0), dtype=np.float64).ravel()
+        return cls(users, books, matrix, norms, mark)
+
+    @classmethod
+    def open(cls, directory):
+        """The checkpoint saved in directory, its arrays memory-mapped, or None if there is none."""
+        directory = Path(directory)
+        try:
+            version = directory / (directory / 'current').read_text()
+        except FileNotFoundError:
+            return None
+        # Copy-on-write, so changes stay in memory until the next save()
+        arrays = {name: np.load(version / f'{name}.npy', mmap_mode='c') for name in CHECKPOINT_ARRAYS}
+        meta = json.loads((version / 'meta.json').read_text())
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']))
+        mark = datetime.fromisoformat(meta['mark']) if meta['mark'] else None
+        return cls(arrays['users'], arrays['books'], matrix, arrays['norms'], mark)
+
+    def save(self, directory):
+        """Checkpoint into a new version directory, then point directory/current at it and remove the older ones."""
+        directory = Path(directory)
+        version = directory / str(time.time_ns())
+        version.mkdir(parents=True)
+        arrays = {
+            'users': self.users, 'books': self.books, 'norms': self.norms,
+            'indptr': self.matrix.indptr, 'indices': self.matrix.indices, 'data': self.matrix.data,
+        }
+        for name in CHECKPOINT_ARRAYS:
+            np.save(version / f'{name}.npy', arrays[name])
+        meta = {'shape': list(self.matrix.shape), 'mark': self.mark.isoformat() if self.mark else None}
+        (version / 'meta.json').write_text(json.dumps(meta))
+        (directory / 'current.tmp').write_text(version.name)
+        os.replace(directory / 'current.tmp', directory / 'current')
+        for path in directory.iterdir():
+            if path.is_dir() and path != version:
+                shutil.rmtree(path)
+
+    def apply_reviews(self):
+        """Bring in the reviews saved since the mark. Returns the sorted columns of the books they are about."""
+        mark = latest_review_update()
+        reviews = Review.objects.all()
+        if self.mark:
+            reviews = reviews.filter(updated_at__gte=self.mark - MARK_OVERLAP)
+        user_ids, book_ids, weights = read_interactions(reviews.values_list('user_id', 'book_id', 'rating'), rating_weights)
+        self.mark = mark or self.mark
+        if not len(user_ids):
+            return book_ids
+        self.add_ids(np.unique(user_ids), np.unique(book_ids))
+
+        rows, columns = np.searchsorted(self.users, user_ids), np.searchsorted(self.books, book_ids)
+        old = np.asarray(self.matrix[rows, columns], dtype=np.float32).ravel()
+        shape = self.matrix.shape
+        # Old weights subtracted exactly, so a weight that drops to 0 leaves no residue behind
+        replaced = self.matrix.multiply(sparse.csr_matrix((np.ones(len(rows), np.float32), (rows, columns)), shape=shape))
+        self.matrix = (self.matrix - replaced + sparse.csr_matrix((weights, (rows, columns)), shape=shape)).tocsr()
+        self.matrix.eliminate_zeros()
+        self.norms = self.norms + np.bincount(
+            columns, weights.astype(np.float64) ** 2 - old.astype(np.float64) ** 2, minlength=len(self.books),
+        )
+        return np.unique(columns)
+
+    def add_ids(self, user_ids, book_ids):
+        """Add rows and columns for the user and book ids the matrix doesn't have yet."""
+        users, books = np.union1d(self.users, user_ids), np.union1d(self.books, book_ids)
+        if len(users) == len(self.users) and len(books) == len(self.books):
+            return
+        shape = (len(users), len(books))
+        if np.array_equal(users[:len(self.users)], self.users) and np.array_equal(books[:len(self.books)], self.books):
+            # Ids only ever grow, so new ones usually come last and the matrix just gets larger
+            indptr = np.r_[self.matrix.indptr, np.full(len(users) - len(self.users), self.matrix.indptr[-1])]
+            self.matrix = sparse.csr_matrix((self.matrix.data, self.matrix.indices, indptr), shape=shape)
+        else:
+            matrix = self.matrix.tocoo()
+            self.matrix = sparse.csr_matrix(
+                (matrix.data, (np.searchsorted(users, self.users[matrix.row]), np.searchsorted(books, self.books[matrix.col]))),
+                shape=shape,
+            )
+        norms = np.zeros(len(books))
+        norms[np.searchsorted(books, self.books)] = self.norms
+        self.users, self.books, self.norms = users, books, norms
+
+    def normalized(self, min_readers):
+        """The matrix with unit-length columns, and no columns for books liked by fewer than min_readers users."""
+        readers = np.bincount(self.matrix.indices, minlength=len(self.books))
+        liked = (readers >= max(min_readers, 1)) & (self.norms > 0)
+        scale = np.zeros(len(self.books), np.float32)
+        scale[liked] = 1 / np.sqrt(self.norms[liked])
+        matrix = (self.matrix @ sparse.diags(scale)).tocsr()
+        matrix.eliminate_zeros()
+        return matrix
+
+
+def block_neighbours(block):
+    """(columns, rows, neighbour columns, scores) of the top_k neighbours of the books in columns."""
+    columns, top_k = block
+    by_book, by_user = _matrices
+    product = (by_book[columns] @ by_user).tocsr()
+
+    rows, neighbours, scores = [], [], []
+    for row, column in enumerate(columns):
+        first, stop = product.indptr[row], product.indptr[row + 1]
+        indices, data = product.indices[first:stop], product.data[first:stop]
+        others = indices != column  # A book is not its own neighbour
+        indices, data = indices[others], data[others]
+        top = np.argpartition(-data, top_k)[:top_k] if len(data) > top_k else np.arange(len(data))
+        top = top[np.argsort(-data[top], kind='stable')]
+        rows.append(np.full(len(top), column))
+        neighbours.append(indices[top])
+        scores.append(data[top])
+    # Rounding can take a book's similarity to a copy of itself just over 1
+    return columns, np.concatenate(rows), np.concatenate(neighbours), np.minimum(np.concatenate(scores), 1.0)
+
+
+def compute_neighbours(matrix, blocks, workers):
+    """block_neighbours() of each block in turn, computed over workers processes."""
+    global _matrices
+    _matrices = (matrix.T.tocsr(), matrix)
+    pool = None
+    try:
+        if workers > 1:
+            # Forked children would otherwise share the parent's open connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+            yield from pool.map(block_neighbours, blocks)
+        else:
+            yield from map(block_neighbours, blocks)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        _matrices = None
+
+
+def write_neighbours(stale, book_ids, rows, neighbours, scores):
+    """Replace the BookSimilarity rows of the stale queryset with the given neighbours, in one transaction."""
+    with transaction.atomic():
+        stale.delete()
+        BookSimilarity.objects.bulk_create(
+            [
+                BookSimilarity(book_id=book_ids[row], similar_book_id=book_ids[neighbour], score=score)
+                for row, neighbour, score in zip(rows.tolist(), neighbours.tolist(), scores.tolist())
+            ],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+    return len(rows)
+
+
+def rebuild_similarities(top_k=50, block_size=256, workers=1, min_readers=2, progress=None):
+    """
+    Recompute the top_k neighbours of every book from all reviews and diary entries,
+    block_size books per block, over workers processes, then checkpoint the matrix.
+    progress(books done, books) is called after each block is written.
+    Returns (books with neighbours, rows written).
+    """
+    interactions = Interactions.load()
+    book_ids = interactions.books.tolist()
+    blocks = [(np.arange(start, min(start + block_size, len(book_ids))), top_k) for start in range(0, len(book_ids), block_size)]
+    if not blocks:
+        BookSimilarity.objects.all().delete()
+
+    books, written = 0, 0
+    for columns, rows, neighbours, scores in compute_neighbours(interactions.normalized(min_readers), blocks, workers):
+        end = columns[-1] + 1
+        id_range = {}
+        if columns[0] > 0:
+            id_range['book_id__gte'] = book_ids[columns[0]]
+        if end < len(book_ids):
+            id_range['book_id__lt'] = book_ids[end]
+        written += write_neighbours(BookSimilarity.objects.filter(**id_range), book_ids, rows, neighbours, scores)
+        books += len(np.unique(rows))
+        if progress:
+            progress(end, len(book_ids))
+
+    interactions.save(settings.SIMILARITY_CHECKPOINT_DIR)
+    bump_versions(catalog=True)
+    return books, written
+
+
+def update_similarities(top_k=50, block_size=256, workers=1, min_readers=2, progress=None):
+    """
+    Apply the reviews saved since the last run to the checkpoint and recompute the top_k
+    neighbours of their books only, then checkpoint again. progress(books done, books)
+    is called after each block is written. Returns (books recomputed, rows written), or
+    None when there is no checkpoint to update.
+    """
+    interactions = Interactions.open(settings.SIMILARITY_CHECKPOINT_DIR)
+    if interactions is None:
+        return None
+    touched = interactions.apply_reviews()
+    if not len(touched):
+        interactions.save(settings.SIMILARITY_CHECKPOINT_DIR)
+        return 0, 0
+    book_ids = interactions.books.tolist()
+    blocks = [(touched[start:start + block_size], top_k) for start in range(0, len(touched), block_size)]
+
+    done, written = 0, 0
+    for columns, rows, neighbours, scores in compute_neighbours(interactions.normalized(min_readers), blocks, workers):
+        stale = BookSimilarity.objects.filter(book_id__in=[book_ids[column] for column in columns.tolist()])
+        written += write_neighbours(stale, book_ids, rows, neighbours, scores)
+        done += len(columns)
+        if progress:
+            progress(done, len(touched))
+
+    interactions.save(settings.SIMILARITY_CHECKPOINT_DIR)
+    bump_versions(catalog=True)
+    return len(touched), written
@@ -0,0 +1,111 @@
+"""
+Per-user statistics rollup.
+
+UserStats holds one row per user with their review count, rating sum and
+histogram (the RatingAggregate fields), likes received and books read per year.
+Review and ReviewLike writes apply F-expression deltas to it, and diary writes
+recount that user's reading years, so /api/user/stats/ is a primary key lookup.
+
+Writes only touch existing rows: a user without one gets it built from the source
+tables on their first read. A row that can't be updated incrementally (e.g. the
+old rating was deferred) is rebuilt on the spot. `manage.py rebuild_user_stats`
+rebuilds everyone after bulk loads.
+"""
+from django.db.models import Count, F, Subquery, Sum
+from django.db.models.functions import ExtractYear
+
+from .models import DiaryEntry, Review, ReviewLike, UserStats
+from .ratings import HALF_STAR_BUCKETS, bucket_filter, rating_deltas, to_rating
+
+STATS_FIELDS = ['rating_sum', 'rating_count', 'likes_received', 'books_read_by_year'] + [
+    f'rating_hist_{k}' for k in HALF_STAR_BUCKETS
+]
+
+
+def apply_user_rating_change(user_id, old_rating, new_rating):
+    old_rating, new_rating = to_rating(old_rating), to_rating(new_rating)
+    if old_rating == new_rating:
+        return
+    UserStats.objects.filter(pk=user_id).update(**rating_deltas(old_rating, new_rating))
+
+
+def apply_likes_received(review_id, delta):
+    """Count a like given (+1) or taken back (-1) on a review towards its author."""
+    author = Review.objects.filter(pk=review_id).values('user_id')
+    stats = UserStats.objects.filter(pk=Subquery(author))
+    if delta < 0:
+        stats = stats.filter(likes_received__gt=0)
+    stats.update(likes_received=F('likes_received') + delta)
+
+
+def add_likes_received(counts):
+    """apply_likes_received() for likes given in bulk: {author's user id: likes}, one UPDATE per distinct count."""
+    by_count = {}
+    for user_id, count in counts.items():
+        by_count.setdefault(count, []).append(user_id)
+    for count, user_ids in by_count.items():
+        UserStats.objects.filter(pk__in=user_ids).update(likes_received=F('likes_received') + count)
+
+
+def reading_years(user_ids):
+    """{user_id: {year: books read}} from 'read' diary entries with a date."""
+    rows = (
+        DiaryEntry.objects.filter(user_id__in=user_ids, status='read', read_date__isnull=False)
+        .annotate(year=ExtractYear('read_date')).order_by()
+        .values('user_id', 'year').annotate(n=Count('id'))
+    )
+    years = {}
+    for row in rows:
+        years.setdefault(row['user_id'], {})[str(row['year'])] = row['n']
+    return years
+
+
+def update_books_read_by_year(user_id):
+    if UserStats.objects.filter(pk=user_id).exists():
+        UserStats.objects.filter(pk=user_id).update(books_read_by_year=reading_years([user_id]).get(user_id, {}))
+
+
+def refresh_user_stats(user_id):
+    """Rebuild a user's existing row; one that doesn't exist yet is built on first read."""
+    if UserStats.objects.filter(pk=user_id).exists():
+        rebuild_user_stats([user_id])
+
+
+def rebuild_user_stats(user_ids):
+    """Recompute the rollup of the given users from the source tables with one query per source."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    ratings = {
+        row['user_id']: row
+        for row in Review.objects.filter(user_id__in=user_ids).order_by().values('user_id').annotate(
+            rating_sum=Sum('rating'),
+            rating_count=Count('id'),
+            **{f'rating_hist_{k}': Count('id', filter=bucket_filter(k)) for k in HALF_STAR_BUCKETS},
+        )
+    }
+    likes = dict(
+        ReviewLike.objects.filter(review__user_id__in=user_ids).order_by()
+        .values('review__user_id').annotate(n=Count('id')).values_list('review__user_id', 'n')
+    )
+    years = reading_years(user_ids)
+
+    rows = []
+    for user_id in user_ids:
+        values = {field: 0 for field in STATS_FIELDS}
+        values.update({field: value for field, value in ratings.get(user_id, {}).items() if field != 'user_id'})
+        values['likes_received'] = likes.get(user_id, 0)
+        values['books_read_by_year'] = years.get(user_id, {})
+        rows.append(UserStats(user_id=user_id, **values))
+    UserStats.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['user'], update_fields=STATS_FIELDS + ['updated_at'],
+    )
+    return len(rows)
+
+
+def get_user_stats(user):
+    stats = UserStats.objects.filter(pk=user.pk).first()
+    if stats is None:
+        rebuild_user_stats([user.pk])
+        stats = UserStats.objects.get(pk=user.pk)
+    return stats
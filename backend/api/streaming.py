@@ -0,0 +1,119 @@
+"""
+Streaming JSON responses for large, unpaginated exports.
+
+Rows are read with QuerySet.iterator() and serialized one chunk at a time, so
+memory stays flat however many rows there are, and the first bytes are sent as
+soon as the first chunk is ready.
+
+Under ASGI Django reads a synchronous body to the end before sending any of it, so
+there the body is handed over as an async iterator that computes each chunk in the
+view's thread.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .concurrency import query_wrapper
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def wants_ndjson(request):
+    # A query param rather than the Accept header, which DRF content negotiation would reject
+    return request.GET.get('stream') == 'ndjson'
+
+
+def _dumps(item):
+    # Same encoding options as DRF's JSONRenderer, so items match the regular responses
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def _chunks(queryset, chunk_size):
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _json_array(queryset, serialize, chunk_size):
+    yield '['
+    first = True
+    for chunk in _chunks(queryset, chunk_size):
+        items = [_dumps(item) for item in serialize(chunk)]
+        yield ('' if first else ',') + ','.join(items)
+        first = False
+    yield ']'
+
+
+def _ndjson(queryset, serialize, chunk_size):
+    for chunk in _chunks(queryset, chunk_size):
+        yield ''.join(_dumps(item) + '\n' for item in serialize(chunk))
+
+
+async def _aiterate(iterator):
+    # Thread-sensitive, so every chunk runs on the thread (and database connection) of the view
+    next_part = sync_to_async(next)
+    done = object()
+    while (part := await next_part(iterator, done)) is not done:
+        yield part
+
+
+def stream_json(request, queryset, serialize, chunk_size=500):
+    """
+    Stream `queryset` as one JSON array, or as NDJSON with ?stream=ndjson.
+    serialize(objects) turns a chunk of model instances into a list of dicts.
+    """
+    if wants_ndjson(request):
+        content, content_type = _ndjson(queryset, serialize, chunk_size), NDJSON_MEDIA_TYPE
+    else:
+        content, content_type = _json_array(queryset, serialize, chunk_size), 'application/json'
+    content = (part.encode() for part in content)
+    if hasattr(request, 'scope'):  # Served by ASGI
+        content = _aiterate(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    # Let reverse proxies pass chunks through as they are produced
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def watch_streaming(response, execute_wrapper, finish):
+    """
+    Keep execute_wrapper installed while a streamed body runs its queries, then call
+    finish(bytes sent) once the body is done (or the client went away). Middleware
+    needs this because a streaming view does its work after get_response() returns.
+    """
+    content = response.streaming_content
+
+    if response.is_async:
+        async def astream():
+            sent = 0
+            try:
+                # Chunks are computed in other threads, which only see wrappers of the context
+                with query_wrapper(execute_wrapper):
+                    async for chunk in content:
+                        sent += len(chunk)
+                        yield chunk
+            finally:
+                await sync_to_async(finish)(sent)
+
+        response.streaming_content = astream()
+        return
+
+    def stream():
+        sent = 0
+        try:
+            with connection.execute_wrapper(execute_wrapper):
+                for chunk in content:
+                    sent += len(chunk)
+                    yield chunk
+        finally:
+            finish(sent)
+
+    response.streaming_content = stream()
@@ -1,3 +1,1379 @@
-from django.test import TestCase
+import json
+import math
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save
+from django.utils import timezone
+from django.http import QueryDict
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+import requests
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from . import bulk, covers, facets, profiling
+from .analytics import DIARY_METRICS, METRICS, SOURCES, rebuild_buckets, totals
+from .explain import FULL_SCAN, SORT, explain, explain_request, plan_findings
+from .facets import BookFilters, facet_counts
+from .fastpath import FastJSONRenderer
+from .feed import read_feed, rebuild_feeds
+from .fetching import CatalogFetcher
+from .ingestion import CatalogIngestor
+from .models import (
+    Activity, AnalyticsBucket, Author, Book, BookSimilarity, DiaryEntry, FeedEntry, Follow, Genre, Profile,
+    Publisher, Review, ReviewLike, TrendingScore, UserStats,
+)
+from .ratings import RATING_FIELDS, diff_book_ratings
+from .recommendations import user_weights
+from .search import search_books
+from .serializers import BookSerializer, ReviewSerializer
+from .similarity import Interactions, rebuild_similarities, update_similarities
+from .stats import STATS_FIELDS, get_user_stats, rebuild_user_stats
+from .trending import rebuild_scores
+from .views import ReviewViewSet
+
+
+class APITestMixin:
+    """Users with profiles, API clients logged in as them, and a clean response cache."""
+
+    def setUp(self):
+        cache.clear()
+
+    def make_user(self, username):
+        user = User.objects.create_user(username=username, password='password')
+        Profile.objects.create(user=user)
+        return user
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def review(self, user, book, rating):
+        return Review.objects.create(user=user, book=book, rating=Decimal(rating))
+
+
+class APITestCase(APITestMixin, TestCase):
+    pass
+
+
+class APITransactionTestCase(APITestMixin, TransactionTestCase):
+    """For async views, whose queries run on pool threads with connections of their own."""
+
+
+class BookRatingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [self.make_user(f'reader{i}') for i in range(3)]
+        self.book = Book.objects.create(title='Dune')
+        self.other = Book.objects.create(title='Emma')
+
+    def assertRatingsFresh(self):
+        stale = [book.pk for book, _ in diff_book_ratings(list(Book.objects.all()))]
+        self.assertEqual(stale, [], 'stored rating aggregates differ from a recount')
+
+    def test_create_update_move_delete(self):
+        reviews = [self.review(user, self.book, rating) for user, rating in zip(self.users, ['4.5', '3.0', '0.5'])]
+        self.assertRatingsFresh()
+
+        reviews[0].rating = Decimal('2.0')
+        reviews[0].save()
+        self.assertRatingsFresh()
+
+        reviews[1].book = self.other
+        reviews[1].save()
+        self.assertRatingsFresh()
+
+        reviews[2].delete()
+        self.assertRatingsFresh()
+        Review.objects.all().delete()
+        self.assertRatingsFresh()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.average_rating), (0, None))
+
+    def test_update_with_deferred_rating(self):
+        review = self.review(self.users[0], self.book, '4.0')
+        review = Review.objects.only('pk', 'user', 'book').get(pk=review.pk)
+        review.rating = Decimal('1.5')
+        review.save()
+        self.assertRatingsFresh()
+
+    def test_text_only_update_leaves_aggregates(self):
+        review = self.review(self.users[0], self.book, '3.5')
+        review.text = 'Better on a second read'
+        review.save(update_fields=['text'])
+        self.assertRatingsFresh()
+
+    def test_api_writes(self):
+        client = self.client_for(self.users[0])
+        response = client.post('/api/reviews/', {'book_id': self.book.pk, 'rating': '4.0', 'text': ''}, format='json')
+        self.assertEqual(response.status_code, 201)
+        review_id = response.data['id']
+        self.assertRatingsFresh()
+
+        response = client.patch(f'/api/reviews/{review_id}/', {'rating': '2.5'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRatingsFresh()
+
+        self.assertEqual(client.delete(f'/api/reviews/{review_id}/').status_code, 204)
+        self.assertRatingsFresh()
+
+    def test_rebuild_command(self):
+        for user, rating in zip(self.users, ['4.5', '3.0', '1.0']):
+            self.review(user, self.book, rating)
+        Book.objects.filter(pk=self.book.pk).update(rating_count=7, rating_hist_9=0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rating_aggregates', '--verify', stdout=StringIO())
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        self.assertRatingsFresh()
+        call_command('rebuild_rating_aggregates', '--verify', stdout=StringIO())
+
+    def test_rebuild_keeps_imported_average_until_reviewed(self):
+        CatalogIngestor().ingest([{'title': 'Persuasion', 'isbn': '9780141439686', 'average_rating': 4.1}])
+        book = Book.objects.get(isbn='9780141439686')
+        call_command('rebuild_rating_aggregates', '--verify', stdout=StringIO())
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        book.refresh_from_db()
+        self.assertEqual((book.rating_count, book.average_rating), (0, 4.1))
+
+        self.review(self.users[0], book, '2.0')
+        self.assertRatingsFresh()
+        book.refresh_from_db()
+        self.assertEqual(book.average_rating, 2.0)
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author, self.reader, self.other = (self.make_user(name) for name in ('author', 'reader', 'other'))
+        self.book = Book.objects.create(title='Dune')
+        self.review_obj = self.review(self.author, self.book, '4.0')
+
+    def assertLikesFresh(self):
+        for review in Review.objects.all():
+            self.assertEqual(review.likes_count, ReviewLike.objects.filter(review=review).count())
+
+    def assertFollowersFresh(self):
+        for profile in Profile.objects.all():
+            self.assertEqual(profile.followers_count, Follow.objects.filter(followed=profile.user).count())
+
+    def test_likes_count(self):
+        likes = [ReviewLike.objects.create(user=user, review=self.review_obj) for user in (self.reader, self.other)]
+        self.assertLikesFresh()
+        likes[0].delete()
+        self.assertLikesFresh()
+        response = self.client_for(self.reader).post('/api/review-likes/', {'review_id': self.review_obj.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLikesFresh()
+        ReviewLike.objects.filter(user=self.other).delete()
+        self.assertLikesFresh()
+
+    def test_followers_count(self):
+        follows = [Follow.objects.create(follower=user, followed=self.author) for user in (self.reader, self.other)]
+        Follow.objects.create(follower=self.author, followed=self.reader)
+        self.assertFollowersFresh()
+        follows[0].delete()
+        self.assertFollowersFresh()
+        Follow.objects.filter(followed=self.reader).delete()
+        self.assertFollowersFresh()
+
+    def test_reconcile_counters(self):
+        ReviewLike.objects.create(user=self.reader, review=self.review_obj)
+        Review.objects.filter(pk=self.review_obj.pk).update(likes_count=7)
+        Profile.objects.filter(user=self.author).update(followers_count=3)
+        Book.objects.filter(pk=self.book.pk).update(rating_count=99)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn(f'Review {self.review_obj.pk}: stored likes_count=7, actual=1', out.getvalue())
+        self.assertIn(f'User {self.author.pk}: stored followers_count=3, actual=0', out.getvalue())
+        self.assertIn(f'Book {self.book.pk}: stored rating_count=99', out.getvalue())
+        self.assertIn('1 reviews have a drifted likes_count, 1 profiles a drifted followers_count and 1 books', out.getvalue())
+        self.assertEqual(Review.objects.get(pk=self.review_obj.pk).likes_count, 7)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).rating_count, 99)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertLikesFresh()
+        self.assertFollowersFresh()
+        self.assertEqual(list(diff_book_ratings(list(Book.objects.all()))), [])
+
+    def test_reconcile_leaves_imported_average(self):
+        book = Book.objects.create(title='Emma', average_rating=4.1, rating_hist_8=2)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn(f'Book {book.pk}: stored rating_hist_8=2 (actual 0)\n', out.getvalue())
+
+        call_command('reconcile_counters', stdout=StringIO())
+        book.refresh_from_db()
+        self.assertEqual((book.rating_hist_8, book.average_rating), (0, 4.1))
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader')
+        self.client = self.client_for(self.user)
+        self.book = Book.objects.create(title='Dune')
+
+    def test_not_modified_until_a_write(self):
+        response = self.client.get('/api/books/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Dune Messiah'
+            self.book.save()
+        response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([book['title'] for book in response.json()], ['Dune Messiah'])
+
+    def test_review_invalidates_the_list(self):
+        etag = self.client.get('/api/books/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/reviews/', {'book_id': self.book.pk, 'rating': '4.0'}, format='json')
+        response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['average_rating'], 4.0)
+
+    def test_other_query_is_another_entry(self):
+        etag = self.client.get('/api/books/')['ETag']
+        response = self.client.get('/api/books/?ordering=title', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CursorPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader')
+        self.client = self.client_for(self.user)
+        ratings = [None, 4.0, 2.5, None, 4.0, 3.0, 4.0]
+        self.books = [
+            Book.objects.create(title=f'Book {i % 3}', average_rating=rating) for i, rating in enumerate(ratings)
+        ]
+
+    def walk(self, url):
+        """Ids of every page following next links from url, and the last response."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        return pages, data
+
+    def walk_back(self, data):
+        pages = []
+        while data['previous']:
+            data = self.client.get(data['previous']).json()
+            pages.append([row['id'] for row in data['results']])
+        return pages[::-1]
+
+    def assertRoundTrip(self, url, expected_ids):
+        pages, last = self.walk(url)
+        self.assertEqual([pk for page in pages for pk in page], expected_ids)
+        self.assertTrue(all(pages))
+        self.assertEqual(self.walk_back(last), pages[:-1])
+
+    def test_books(self):
+        ordered = Book.objects.order_by('pk')
+        self.assertRoundTrip('/api/books/?page_size=2', list(ordered.values_list('pk', flat=True)))
+
+    def test_books_by_nullable_column(self):
+        # Ties and NULLs in the ordering column: the id tiebreaker keeps every book on exactly one page
+        expected = sorted(
+            self.books, key=lambda book: (book.average_rating is None, -(book.average_rating or 0), book.pk),
+        )
+        self.assertRoundTrip('/api/books/?page_size=2&ordering=-average_rating', [book.pk for book in expected])
+
+    def test_books_by_title(self):
+        expected = sorted(self.books, key=lambda book: (book.title, book.pk))
+        self.assertRoundTrip('/api/books/?page_size=3&ordering=title', [book.pk for book in expected])
+
+    def test_book_reviews(self):
+        book = self.books[0]
+        readers = [self.make_user(f'reader{i}') for i in range(5)]
+        reviews = [self.review(reader, book, '4.0') for reader in readers]
+        for review in reviews[1:3]:
+            ReviewLike.objects.create(user=self.user, review=review)
+        expected = Review.objects.filter(book=book).order_by('-likes_count', '-created_at', 'id')
+        self.assertRoundTrip(f'/api/reviews/?book={book.pk}&page_size=2', list(expected.values_list('pk', flat=True)))
+
+    def test_diary_entries(self):
+        entries = [DiaryEntry.objects.create(user=self.user, book=book) for book in self.books]
+        self.assertRoundTrip('/api/diary-entries/?page_size=3', [entry.pk for entry in reversed(entries)])
+
+    def test_feed(self):
+        author = self.make_user('author')
+        Follow.objects.create(follower=self.user, followed=author)
+        for book in self.books:
+            self.review(author, book, '4.0')
+        pages, _ = self.walk('/api/feed/?page_size=2')
+        self.assertEqual([pk for page in pages for pk in page], [activity.pk for activity in read_feed(self.user, limit=50)])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/books/?cursor=not-a-cursor').status_code, 404)
+
+
+class ReviewExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, other = self.make_user('reader'), self.make_user('other')
+        self.client = self.client_for(self.user)
+        for i in range(5):
+            book = Book.objects.create(title=f'Book {i}')
+            self.review(self.user, book, '4.0')
+            self.review(other, book, '2.0')
+        self.expected = list(Review.objects.filter(user=self.user).values_list('pk', flat=True))
+
+    def export(self, url):
+        # A chunk size that doesn't divide the row count exercises the chunk joins and the remainder
+        with mock.patch.object(ReviewViewSet, 'stream_chunk_size', 2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_json_array(self):
+        response, body = self.export('/api/reviews/?user=me')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(sorted(row['id'] for row in json.loads(body)), sorted(self.expected))
+
+    def test_ndjson(self):
+        response, body = self.export('/api/reviews/?user=me&stream=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(self.expected))
+
+    def test_paginated_request_is_not_streamed(self):
+        response = self.client.get('/api/reviews/?user=me&page_size=10')
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.json()['results']), len(self.expected))
+
+
+class SearchIndexTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = Author.objects.create(name='Ursula Le Guin')
+            self.genre = Genre.objects.create(name='Fantasy')
+            self.book = Book.objects.create(title='A Wizard of Earthsea', description='A young mage')
+            self.book.authors.add(self.author)
+            self.book.genres.add(self.genre)
+
+    def test_book_indexed(self):
+        for query in ('wizard', 'earth', 'guin', 'fantasy', 'mage'):
+            self.assertEqual(search_books(query), [self.book.pk], query)
+
+    def test_ranking_and_typos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            mention = Book.objects.create(title='Field Notes', description='Reads like a wizard tale')
+        # A title hit outranks a description hit
+        self.assertEqual(search_books('wizard'), [self.book.pk, mention.pk])
+        self.assertEqual(search_books('wizrd earthsee'), [self.book.pk])
+
+    def test_author_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.name = 'Ursula K. Le Guin'
+            self.author.save()
+        self.assertEqual(search_books('ursula k'), [self.book.pk])
+
+        other = Author.objects.create(name='Ted Chiang')
+        with self.captureOnCommitCallbacks(execute=True):
+            other.books.add(self.book)  # From the author side
+        self.assertEqual(search_books('chiang'), [self.book.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(search_books('chiang'), [])
+
+    def test_genre_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.name = 'Speculative'
+            self.genre.save()
+        self.assertEqual(search_books('speculative'), [self.book.pk])
+        self.assertEqual(search_books('fantasy'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.books.clear()
+        self.assertEqual(search_books('speculative'), [])
+
+    def test_book_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.delete()
+        self.assertEqual(search_books('wizard'), [])
+
+    def test_autocomplete_items(self):
+        client = self.client_for(self.make_user('reader'))
+        response = client.get('/api/books/search/?q=wiz&autocomplete=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'id': self.book.pk, 'title': 'A Wizard of Earthsea', 'cover_url': None, 'covers': None},
+        ])
+
+
+class IngestionTests(APITestCase):
+    records = [
+        {'title': 'Dune', 'isbn': '9780441172719', 'authors': ['Frank Herbert'], 'genres': ['Science Fiction'],
+         'publisher': 'Ace', 'average_rating': 4.2},
+        {'title': 'Emma', 'authors': ['Jane Austen'], 'genres': ['Classics', 'Romance']},
+        {'title': 'Dune', 'isbn': '9780441172719'},  # Same ISBN twice in one batch
+        {'title': ''},
+    ]
+
+    def ingest(self, records, batch_size=2):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CatalogIngestor(batch_size=batch_size).ingest(records)
+
+    def test_creates_books_and_links(self):
+        self.assertEqual(self.ingest(self.records, batch_size=10), (2, 0, 2))
+        dune = Book.objects.get(isbn='9780441172719')
+        self.assertEqual(list(dune.authors.values_list('name', flat=True)), ['Frank Herbert'])
+        self.assertEqual(dune.publisher.name, 'Ace')
+        self.assertEqual(dune.average_rating, 4.2)
+        emma = Book.objects.get(title='Emma')
+        self.assertEqual(sorted(emma.genres.values_list('name', flat=True)), ['Classics', 'Romance'])
+        self.assertEqual(search_books('austen'), [emma.pk])
+
+    def test_reimport_updates_in_place(self):
+        self.ingest(self.records, batch_size=10)
+        Review.objects.create(user=self.make_user('reader'), book=Book.objects.get(title='Emma'), rating=Decimal('2.0'))
+        updated = [
+            {'title': 'Dune (Deluxe)', 'isbn': '9780441172719', 'authors': ['Frank Herbert', 'Brian Herbert'],
+             'average_rating': 1.0},
+            {'title': 'Emma', 'authors': ['Jane Austen'], 'genres': ['Classics'], 'average_rating': 5.0},
+            {'title': 'Persuasion', 'authors': ['Jane Austen']},
+        ]
+        self.assertEqual(self.ingest(updated), (1, 2, 0))
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(Author.objects.filter(name='Jane Austen').count(), 1)
+
+        dune = Book.objects.get(isbn='9780441172719')
+        self.assertEqual(dune.title, 'Dune (Deluxe)')
+        self.assertEqual(sorted(dune.authors.values_list('name', flat=True)), ['Brian Herbert', 'Frank Herbert'])
+        # Ratings of existing books are left alone: seeded ones and the review aggregates alike
+        self.assertEqual(dune.average_rating, 4.2)
+        emma = Book.objects.get(title='Emma')
+        self.assertEqual(emma.average_rating, 2.0)
+        self.assertEqual(list(emma.genres.values_list('name', flat=True)), ['Classics'])
+        self.assertEqual(search_books('deluxe'), [dune.pk])
+
+
+class CheckpointResumeTests(APITestCase):
+    base_url = 'https://openlibrary.org/search.json'
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.replay_dir = tmp.name
+        self.checkpoint = os.path.join(tmp.name, 'checkpoint.json')
+
+    def record_page(self, offset, titles):
+        docs = [{'title': title, 'isbn': [f'978{i + offset:010d}']} for i, title in enumerate(titles)]
+        params = {'q': 'fantasy novel', 'limit': 2, 'offset': offset}
+        path = CatalogFetcher().fixture_path(self.replay_dir, self.base_url, params)
+        with open(path, 'w') as f:
+            json.dump({'docs': docs}, f)
+        return path
+
+    def populate(self):
+        out = StringIO()
+        call_command(
+            'populate_from_openlibrary', '--max-books=4', '--page-size=2', '--concurrency=1',
+            f'--replay={self.replay_dir}', f'--checkpoint={self.checkpoint}', stdout=out,
+        )
+        return out.getvalue()
+
+    def test_resume_after_failed_pages(self):
+        first_page = self.record_page(0, ['Book A', 'Book B'])
+        output = self.populate()
+        self.assertIn('re-run with the same --checkpoint', output)
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertEqual(Book.objects.count(), 2)
+
+        # The finished page is skipped on resume: its recording is gone, so fetching it again would fail
+        os.remove(first_page)
+        self.record_page(2, ['Book C', 'Book D'])
+        output = self.populate()
+        self.assertIn('Resuming from checkpoint with 2 books already ingested', output)
+        self.assertIn('Successfully ingested 4', output)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['Book A', 'Book B', 'Book C', 'Book D'])
+
+
+class GeneratorTests(APITestCase):
+    def populate(self, seed):
+        call_command(
+            'populate_users_reviews', '--books=30', '--users=15', '--reviews=120', '--likes=200', '--follows=40',
+            '--diary-entries=40', '--batch-size=17', f'--seed={seed}', stdout=StringIO(),
+        )
+
+    def test_counters_settled_after_bulk_load(self):
+        self.populate(seed=1)
+        self.populate(seed=2)  # A second run adds to the data already there
+        self.assertEqual((User.objects.count(), Book.objects.count()), (30, 60))
+        self.assertGreater(Review.objects.count(), 120)
+        self.assertTrue(ReviewLike.objects.exists() and Follow.objects.exists() and DiaryEntry.objects.exists())
+
+        self.assertEqual(list(diff_book_ratings(list(Book.objects.all()))), [])
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('0 reviews have a drifted likes_count, 0 profiles a drifted followers_count and 0 books', out.getvalue())
+
+    def test_recount_keeps_imported_averages(self):
+        CatalogIngestor().ingest([{'title': f'Book {i}', 'average_rating': 4.1} for i in range(30)])
+        call_command(
+            'populate_users_reviews', '--books=0', '--users=5', '--reviews=10', '--likes=0', '--follows=0',
+            '--diary-entries=0', '--seed=1', stdout=StringIO(),
+        )
+        self.assertEqual(list(diff_book_ratings(list(Book.objects.all()))), [])
+        unreviewed = Book.objects.filter(rating_count=0)
+        self.assertTrue(unreviewed.exists())
+        self.assertEqual(set(unreviewed.values_list('average_rating', flat=True)), {4.1})
+
+
+class FeedTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader, self.author, self.other = (self.make_user(name) for name in ('reader', 'author', 'other'))
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(3)]
+
+    def feed(self):
+        return set(FeedEntry.objects.filter(user=self.reader).values_list('activity_id', 'created_at'))
+
+    def assertFeedFresh(self):
+        stored = self.feed()
+        rebuild_feeds([self.reader.pk])
+        self.assertEqual(stored, self.feed())
+
+    def test_fan_out(self):
+        self.review(self.author, self.books[0], '4.0')  # Before the follow: backfilled
+        Follow.objects.create(follower=self.reader, followed=self.author)
+        self.assertFeedFresh()
+        other_review = self.review(self.other, self.books[1], '3.0')
+        self.review(self.author, self.books[1], '2.0')
+        like = ReviewLike.objects.create(user=self.author, review=other_review)
+        Follow.objects.create(follower=self.author, followed=self.other)
+        self.assertFeedFresh()
+        self.assertEqual(len(self.feed()), 4)
+
+        like.delete()
+        self.assertFeedFresh()
+        Follow.objects.filter(follower=self.reader).delete()
+        self.assertEqual(self.feed(), set())
+
+    def test_fan_out_on_read_matches(self):
+        Follow.objects.create(follower=self.reader, followed=self.author)
+        with override_settings(FEED_FANOUT_LIMIT=0):
+            self.review(self.author, self.books[0], '4.0')
+            self.review(self.author, self.books[1], '3.0')
+        # Back under the limit: the activity from before is still pulled, the new one is fanned out
+        self.review(self.author, self.books[2], '2.0')
+        self.assertEqual(len(self.feed()), 1)
+        self.assertFeedFresh()
+
+        expected = list(Activity.objects.filter(user=self.author).order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual([activity.pk for activity in read_feed(self.reader)], expected)
+        page = read_feed(self.reader, limit=2)
+        page += read_feed(self.reader, position=(page[-1].created_at, page[-1].pk), limit=2)
+        self.assertEqual([activity.pk for activity in page], expected)
+
+        Follow.objects.create(follower=self.other, followed=self.author)
+        self.assertEqual([activity.pk for activity in read_feed(self.other)], expected)
+
+
+class UserStatsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, self.reader = self.make_user('author'), self.make_user('reader')
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(3)]
+        get_user_stats(self.user)  # Rows only exist once read, and writes only update existing rows
+
+    def assertStatsFresh(self):
+        stored = UserStats.objects.values(*STATS_FIELDS).get(pk=self.user.pk)
+        rebuild_user_stats([self.user.pk])
+        self.assertEqual(stored, UserStats.objects.values(*STATS_FIELDS).get(pk=self.user.pk))
+
+    def test_reviews(self):
+        reviews = [self.review(self.user, book, rating) for book, rating in zip(self.books, ['5.0', '2.5', '1.0'])]
+        self.assertStatsFresh()
+        reviews[0].rating = Decimal('3.0')
+        reviews[0].save()
+        self.assertStatsFresh()
+        reviews[1].delete()
+        self.assertStatsFresh()
+
+    def test_likes_received(self):
+        review = self.review(self.user, self.books[0], '4.0')
+        like = ReviewLike.objects.create(user=self.reader, review=review)
+        ReviewLike.objects.create(user=self.user, review=review)
+        self.assertStatsFresh()
+        like.delete()
+        self.assertStatsFresh()
+
+    def test_books_read_by_year(self):
+        entry = DiaryEntry.objects.create(user=self.user, book=self.books[0], status='read', read_date=date(2023, 5, 1))
+        DiaryEntry.objects.create(user=self.user, book=self.books[1], status='read', read_date=date(2024, 1, 2))
+        DiaryEntry.objects.create(user=self.user, book=self.books[2], status='reading')
+        self.assertStatsFresh()
+        entry.status = 'reading'
+        entry.save()
+        self.assertStatsFresh()
+        entry.delete()
+        self.assertStatsFresh()
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).books_read_by_year, {'2024': 1})
+
+
+class AnalyticsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [self.make_user(f'reader{i}') for i in range(3)]
+        self.book = Book.objects.create(title='Dune')
+
+    def bucket_counts(self):
+        buckets = AnalyticsBucket.objects.filter(metric__in=SOURCES).exclude(count=0)
+        return set(buckets.values_list('metric', 'granularity', 'start', 'count'))
+
+    def assertBucketsFresh(self):
+        stored = self.bucket_counts()
+        rebuild_buckets()
+        self.assertEqual(stored, self.bucket_counts())
+
+    def test_rows_counted_and_uncounted(self):
+        reviews = [self.review(user, self.book, '4.0') for user in self.users]
+        like = ReviewLike.objects.create(user=self.users[1], review=reviews[0])
+        ReviewLike.objects.create(user=self.users[2], review=reviews[0])
+        self.assertBucketsFresh()
+        like.delete()
+        reviews[0].delete()  # Takes its remaining like with it
+        self.users[2].delete()
+        self.assertBucketsFresh()
+
+    def test_delete_with_deferred_timestamp(self):
+        reviews = [self.review(user, self.book, '4.0') for user in self.users]
+        ReviewLike.objects.create(user=self.users[1], review=reviews[0])
+        Review.objects.only('pk', 'user', 'book').get(pk=reviews[1].pk).delete()
+        ReviewLike.objects.only('pk', 'user', 'review').get(user=self.users[1]).delete()
+        User.objects.only('pk', 'username').get(pk=self.users[2].pk).delete()
+        self.assertBucketsFresh()
+
+    def test_diary_transitions(self):
+        metrics = list(DIARY_METRICS.values())
+        entry = DiaryEntry.objects.create(user=self.users[0], book=self.book)
+        entry.status = 'reading'
+        entry.save()
+        entry.read_date = date(2024, 1, 1)
+        entry.save()  # Same status: not a transition
+        entry.status = 'read'
+        entry.save()
+        self.assertEqual(totals(metrics), {'diary_to_read': 1, 'diary_reading': 1, 'diary_read': 1})
+
+
+@override_settings(METRICS_TOKEN='secret', METRICS_SAMPLE_RATE=1.0)
+class MetricsEndpointTests(APITestCase):
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def requests_total(self, body, route):
+        prefix = f'api_requests_total{{route="{route}",method="GET",status="200"}} '
+        return next((int(line[len(prefix):]) for line in body.splitlines() if line.startswith(prefix)), 0)
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_refused_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_requests_counted(self):
+        client = self.client_for(self.make_user('reader'))
+        # Counters live for the whole process, so compare against the count before
+        before = self.requests_total(self.scrape(), 'book-list')
+        client.get('/api/books/')
+        client.get('/api/books/')
+        body = self.scrape()
+        self.assertEqual(self.requests_total(body, 'book-list'), before + 2)
+        self.assertIn('api_request_duration_seconds_bucket{route="book-list",method="GET",le="+Inf"}', body)
+
+
+@override_settings(PROFILING_TOKEN='secret', PROFILING_REPEAT_THRESHOLD=3)
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_user('admin')
+        self.admin.profile.role = 'admin'
+        self.admin.profile.save()
+        self.client = self.client_for(self.admin)
+        self.addCleanup(profiling.set_toggle, 0, 1)
+        for i in range(3):
+            self.review(self.admin, Book.objects.create(title=f'Book {i}'), '4.0')
+
+    def test_token_header(self):
+        response = self.client.get('/api/books/', HTTP_X_PROFILE='secret', HTTP_X_PROFILE_TRACE='cprofile')
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/books/', HTTP_X_PROFILE='wrong'))
+        profile = self.client.get(f'/api/profiling/{response["X-Profile-Id"]}/').json()
+        self.assertEqual((profile['route'], profile['status']), ('book-list', 200))
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+        self.assertTrue(profile['queries'])
+        self.assertTrue(all(query['origin'].startswith('api/') for query in profile['queries'] if query['origin']))
+        self.assertIn('cumulative', profile['trace'])
+
+    def test_streamed_response(self):
+        response = self.client.get('/api/reviews/?user=me', HTTP_X_PROFILE='secret')
+        profile_id = response['X-Profile-Id']
+        # Stored once the body has been sent, with the queries run while streaming it
+        self.assertIsNone(profiling.get_profile(profile_id))
+        b''.join(response.streaming_content)
+        self.assertTrue(profiling.get_profile(profile_id)['queries'])
+
+    def test_sampling_toggle(self):
+        reader = self.client_for(self.make_user('reader'))
+        self.assertEqual(reader.post('/api/profiling/', {'sample_rate': 1}, format='json').status_code, 403)
+        response = self.client.post('/api/profiling/', {'sample_rate': 1, 'minutes': 5}, format='json')
+        self.assertEqual(response.json()['sampling']['sample_rate'], 1)
+        self.assertIn('X-Profile-Id', reader.get('/api/books/'))
+
+        self.client.post('/api/profiling/', {'sample_rate': 0}, format='json')
+        self.assertNotIn('X-Profile-Id', reader.get('/api/books/'))
+        # The reader's request and the POST that turned sampling off
+        self.assertEqual(len(self.client.get('/api/profiling/').json()['profiles']), 2)
+
+    def test_repeated_queries(self):
+        queries = [
+            {'sql': f'SELECT * FROM api_author WHERE id = {pk}', 'ms': 1.0, 'origin': 'api/views.py:1 in list'}
+            for pk in range(4)
+        ] + [{'sql': 'SELECT * FROM api_book WHERE id IN (1, 2, 3)', 'ms': 2.0, 'origin': None}]
+        self.assertEqual(profiling.repeated_queries(queries), [{
+            'shape': 'SELECT * FROM api_author WHERE id = ?', 'count': 4, 'ms': 4.0, 'origins': ['api/views.py:1 in list'],
+        }])
+
+
+# PostgreSQL rightly prefers sequential scans on tables this small, so plans are only checked on SQLite
+@skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+class ExplainTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader')
+        self.client = self.client_for(self.user)
+        self.book = Book.objects.create(title='Dune')
+        self.review(self.user, self.book, '4.0')
+
+    def assertIndexed(self, path):
+        status_code, queries = explain_request(self.client, path)
+        self.assertEqual(status_code, 200)
+        self.assertTrue(queries)
+        self.assertEqual([query['findings'] for query in queries if query['findings']], [], path)
+
+    def test_hot_queries_use_indexes(self):
+        for path in (
+            f'/api/reviews/?book={self.book.pk}',
+            '/api/reviews/?user=me',
+            '/api/books/?ordering=-average_rating&limit=10',
+            '/api/diary-entries/',
+        ):
+            self.assertIndexed(path)
+
+    def test_findings(self):
+        findings = plan_findings(explain('SELECT id FROM api_review ORDER BY text', []))
+        self.assertEqual([kind for kind, _ in findings], [FULL_SCAN, SORT])
+        self.assertEqual(plan_findings(explain('SELECT id FROM api_review WHERE id = %s', [1])), [])
+
+
+class SparseFieldsTests(APITransactionTestCase):  # Book detail is an async view
+    def setUp(self):
+        super().setUp()
+        self.client = self.client_for(self.make_user('reader'))
+        author = Author.objects.create(name='Frank Herbert')
+        for i, rating in enumerate([3.0, 4.5, None]):
+            book = Book.objects.create(title=f'Book {i}', average_rating=rating, description='Long text')
+            book.authors.add(author)
+        self.book = book
+
+    def test_fields(self):
+        response = self.client.get('/api/books/?fields=id,title,avg_rating')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0], {'id': Book.objects.order_by('pk')[0].pk, 'title': 'Book 0', 'avg_rating': 3.0})
+        response = self.client.get(f'/api/books/{self.book.pk}/?fields=title&expand=authors')
+        self.assertEqual(set(response.json()), {'title', 'authors'})
+        self.assertEqual(response.json()['authors'][0]['name'], 'Frank Herbert')
+
+    def test_unrequested_relations_are_not_loaded(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/books/?fields=id,title')
+        full = self.client.get('/api/books/?ordering=title').json()
+        self.assertIn('authors', full[0])
+        self.assertIn('description', full[0])
+
+    def test_paginated_by_an_unrequested_column(self):
+        response = self.client.get('/api/books/?fields=title&ordering=-average_rating&page_size=2')
+        data = response.json()
+        self.assertEqual([row['title'] for row in data['results']], ['Book 1', 'Book 0'])
+        self.assertEqual([row['title'] for row in self.client.get(data['next']).json()['results']], ['Book 2'])
+
+    def test_unknown_names(self):
+        self.assertEqual(self.client.get('/api/books/?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/books/?fields=id&expand=reviews').status_code, 400)
+
+
+class CompiledReadPathTests(APITestCase):
+    """The compiled list path must answer with the very bytes the serializers and JSONRenderer would."""
+
+    def setUp(self):
+        super().setUp()
+        self.user, other = self.make_user('reader'), self.make_user('Zoë')
+        self.client = self.client_for(self.user)
+        publisher = Publisher.objects.create(name='Ace', website='https://ace.example')
+        authors = [Author.objects.create(name=name, bio='') for name in ('Frank Herbert', 'Ursula Le Guin')]
+        genre = Genre.objects.create(name='Science Fiction')
+        books = [
+            Book.objects.create(
+                title='Dune', publisher=publisher, publication_date=date(1965, 8, 1), page_count=412,
+                description='Spice \u2028 and "sand" \U0001f3dc', cover_url='https://covers.example/dune.jpg',
+            ),
+            Book.objects.create(title='Emma', average_rating=1e16),
+            Book.objects.create(title='Walden', average_rating=0.00001),
+        ]
+        books[0].authors.add(*authors)
+        books[0].genres.add(genre)
+        books[1].authors.add(authors[1])
+        for user, book, rating in [(self.user, books[0], '4.5'), (other, books[0], '3.0'), (other, books[1], '1.0')]:
+            Review.objects.create(user=user, book=book, rating=Decimal(rating), text='Über gut', is_spoiler=False)
+        ReviewLike.objects.create(user=self.user, review=Review.objects.get(user=other, book=books[0]))
+
+    def serializer_bytes(self, path, serializer_class, queryset):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, self.user)
+        request = Request(request)
+        request.user = self.user
+        data = serializer_class(queryset, many=True, context={'request': request}).data
+        return JSONRenderer().render(data)
+
+    def assertSameBytes(self, path, serializer_class, queryset):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(content, self.serializer_bytes(path, serializer_class, queryset))
+
+    def test_books(self):
+        books = Book.objects.order_by('title')
+        self.assertSameBytes('/api/books/?ordering=title', BookSerializer, books)
+        self.assertSameBytes('/api/books/?ordering=title&fields=title,avg_rating&expand=publisher', BookSerializer, books)
+
+    def test_reviews(self):
+        liked = Exists(ReviewLike.objects.filter(review=OuterRef('pk'), user=self.user))
+        reviews = Review.objects.annotate(is_liked_by_user=liked).order_by('id')
+        self.assertSameBytes('/api/reviews/?ordering=id', ReviewSerializer, reviews)
+        self.assertSameBytes('/api/reviews/?ordering=id&include_book=true', ReviewSerializer, reviews)
+        self.assertSameBytes('/api/reviews/?user=me', ReviewSerializer, reviews.filter(user=self.user))
+
+    def test_renderer_fallbacks(self):
+        for data in ([{'a': 1e16, 'b': 1e-05, 'c': 0.1}], {'big': 2 ** 70}, {1: 'non-string key'}, ['\u2028\u2029']):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data), data)
+
+
+class AsyncViewTests(APITransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, self.admin = self.make_user('reader'), self.make_user('admin')
+        self.admin.profile.role = 'admin'
+        self.admin.profile.save()
+        self.client = self.client_for(self.user)
+        self.book = Book.objects.create(title='Dune', publication_date=date(1965, 8, 1))
+        self.book.authors.add(Author.objects.create(name='Frank Herbert'))
+        self.book.genres.add(Genre.objects.create(name='Science Fiction'))
+
+    def test_book_detail(self):
+        response = self.client.get(f'/api/books/{self.book.pk}/')
+        self.assertEqual(response.status_code, 200)
+        expected = JSONRenderer().render(BookSerializer(Book.objects.get(pk=self.book.pk)).data)
+        self.assertEqual(response.content, expected)
+        self.assertEqual(self.client.get(f'/api/books/{self.book.pk}/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/api/books/0/').status_code, 404)
+        self.assertEqual(APIClient().get(f'/api/books/{self.book.pk}/').status_code, 401)
+
+    def test_book_writes_fall_back_to_the_viewset(self):
+        url = f'/api/books/{self.book.pk}/'
+        self.assertEqual(self.client.patch(url, {'title': 'Nope'}, format='json').status_code, 403)
+        admin = self.client_for(self.admin)
+        response = admin.patch(url, {'title': 'Dune Messiah'}, format='json')
+        self.assertEqual((response.status_code, response.json()['title']), (200, 'Dune Messiah'))
+        response = admin.put(url, {'title': 'Children of Dune', 'author_ids': [], 'genre_ids': []}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).json()['title'], 'Children of Dune')
+        self.assertEqual(admin.delete(url).status_code, 204)
+        self.assertFalse(Book.objects.filter(pk=self.book.pk).exists())
+
+    def test_user_stats_and_activity(self):
+        review = self.review(self.user, self.book, '4.0')
+        ReviewLike.objects.create(user=self.admin, review=review)
+        stats = self.client.get('/api/user/stats/').json()
+        self.assertEqual((stats['total_reviews'], stats['likes_received'], stats['avg_rating']), (1, 1, 4.0))
+        activity = self.client.get('/api/user/activity/').json()
+        self.assertEqual([row['description'] for row in activity], ['admin liked your review of "Dune"', 'You reviewed "Dune"'])
+
+    def test_analytics(self):
+        self.review(self.user, self.book, '4.0')
+        self.assertEqual(self.client.get('/api/analytics/').status_code, 403)
+        overview = self.client_for(self.admin).get('/api/analytics/').json()['overview']
+        self.assertEqual(overview, {'total_reviews': 1, 'total_books': 1, 'total_users': 2, 'total_likes': 0})
+
+    async def test_async_client(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(f'/api/books/{self.book.pk}/')
+        self.assertEqual((response.status_code, response.json()['title']), (200, 'Dune'))
+        response = await client.get('/api/reviews/?user=me')
+        self.assertEqual(b''.join([part async for part in response.streaming_content]), b'[]')
+
+
+class BulkWriteTests(APITestCase):
+    """Bulk endpoints must leave every counter and rollup as the same writes made one at a time would."""
+
+    def setUp(self):
+        super().setUp()
+        self.single, self.bulk, self.follower = (self.make_user(name) for name in ('single', 'bulk', 'follower'))
+        for user in (self.single, self.bulk):
+            Follow.objects.create(follower=self.follower, followed=user)
+            get_user_stats(user)
+        self.single_book, self.bulk_book = Book.objects.create(title='Dune'), Book.objects.create(title='Emma')
+
+    def assertSameEffects(self, single_user, bulk_user):
+        def book_state(book):
+            values = Book.objects.values(*RATING_FIELDS).get(pk=book.pk)
+            values['all_score'] = TrendingScore.objects.get(book=book, genre=None).all_score
+            return values
+
+        def user_state(user):
+            return (
+                UserStats.objects.values(*STATS_FIELDS).get(pk=user.pk),
+                sorted(Activity.objects.filter(user=user).values_list('action', flat=True)),
+                FeedEntry.objects.filter(user=self.follower, activity__user=user).count(),
+            )
+
+        self.assertEqual(book_state(self.single_book), book_state(self.bulk_book))
+        self.assertEqual(user_state(single_user), user_state(bulk_user))
+
+    def test_reviews_and_diary_entries(self):
+        single, bulk = self.client_for(self.single), self.client_for(self.bulk)
+        before = totals(METRICS)
+
+        response = single.post('/api/reviews/', {'book_id': self.single_book.pk, 'rating': '4.5', 'text': 'Yes'}, format='json')
+        review_id = response.data['id']
+        single.patch(f'/api/reviews/{review_id}/', {'rating': '2.0'}, format='json')
+        single.post('/api/diary-entries/', {'book_id': self.single_book.pk, 'status': 'reading'}, format='json')
+        entry_id = DiaryEntry.objects.get(user=self.single).pk
+        single.patch(f'/api/diary-entries/{entry_id}/', {'status': 'read'}, format='json')
+        middle = totals(METRICS)
+
+        response = bulk.post('/api/reviews/bulk/', [{'book_id': self.bulk_book.pk, 'rating': '4.5', 'text': 'Yes'}], format='json')
+        self.assertEqual(response.data, {'created': 1, 'updated': 0})
+        response = bulk.post('/api/reviews/bulk/', [{'book_id': self.bulk_book.pk, 'rating': '2.0'}], format='json')
+        self.assertEqual(response.data, {'created': 0, 'updated': 1})
+        bulk.post('/api/diary-entries/bulk/', [{'book_id': self.bulk_book.pk, 'status': 'reading'}], format='json')
+        bulk.post('/api/diary-entries/bulk/', [{'book_id': self.bulk_book.pk, 'status': 'read'}], format='json')
+        after = totals(METRICS)
+
+        self.assertEqual({m: middle[m] - before[m] for m in METRICS}, {m: after[m] - middle[m] for m in METRICS})
+        self.assertSameEffects(self.single, self.bulk)
+        self.assertEqual(
+            DiaryEntry.objects.values('status', 'read_date').get(user=self.single),
+            DiaryEntry.objects.values('status', 'read_date').get(user=self.bulk),
+        )
+
+    def test_diary_entry_saved_once(self):
+        saves = []
+        post_save.connect(
+            lambda instance, **kwargs: saves.append(instance.pk), sender=DiaryEntry, weak=False, dispatch_uid='count_saves',
+        )
+        self.addCleanup(post_save.disconnect, sender=DiaryEntry, dispatch_uid='count_saves')
+        client = self.client_for(self.single)
+        today = timezone.now().date().isoformat()
+
+        response = client.post('/api/diary-entries/', {'book_id': self.single_book.pk, 'status': 'read'}, format='json')
+        self.assertEqual((len(saves), response.data['read_date']), (1, today))
+        entry_id = response.data['id']
+        response = client.patch(f'/api/diary-entries/{entry_id}/', {'read_date': None}, format='json')
+        self.assertEqual((len(saves), response.data['read_date']), (2, today))  # Still read
+        response = client.patch(f'/api/diary-entries/{entry_id}/', {'read_date': '2024-03-01'}, format='json')
+        self.assertEqual((len(saves), response.data['read_date']), (3, '2024-03-01'))
+
+    def test_likes(self):
+        single_review = self.review(self.single, self.single_book, '4.0')
+        bulk_review = self.review(self.bulk, self.bulk_book, '4.0')
+        liker = self.make_user('liker')
+        Follow.objects.create(follower=self.follower, followed=liker)
+        client = self.client_for(liker)
+
+        client.post('/api/review-likes/', {'review_id': single_review.pk}, format='json')
+        response = client.post('/api/review-likes/bulk/', [{'review_id': bulk_review.pk}], format='json')
+        self.assertEqual(response.data, {'created': 1, 'unchanged': 0})
+        self.assertSameEffects(self.single, self.bulk)
+        self.assertEqual(Review.objects.get(pk=single_review.pk).likes_count, Review.objects.get(pk=bulk_review.pk).likes_count)
+        self.assertEqual(
+            sorted(Activity.objects.filter(user=liker).values_list('target_user_id', flat=True)),
+            sorted([self.single.pk, self.bulk.pk]),
+        )
+
+        # Liking again changes nothing
+        response = client.post('/api/review-likes/bulk/', [{'review_id': bulk_review.pk}], format='json')
+        self.assertEqual(response.data, {'created': 0, 'unchanged': 1})
+        self.assertEqual(Review.objects.get(pk=bulk_review.pk).likes_count, 1)
+        self.assertEqual(UserStats.objects.get(pk=self.bulk.pk).likes_received, 1)
+
+    def test_like_missed_by_the_read_is_not_counted(self):
+        review = self.review(self.single, self.single_book, '4.0')
+        liker = self.make_user('liker')
+        ReviewLike.objects.create(user=liker, review=review)
+        # As if the like had committed between reading the user's likes and inserting the new ones
+        unread = mock.patch.object(ReviewLike.objects, 'filter', return_value=ReviewLike.objects.none())
+        with unread, self.assertRaises(IntegrityError):
+            bulk.add_review_likes(liker, [review.pk])
+        self.assertEqual(Review.objects.get(pk=review.pk).likes_count, 1)
+        self.assertEqual(Activity.objects.filter(user=liker).count(), 1)
+
+    def test_batch_is_validated_as_a_whole(self):
+        client = self.client_for(self.bulk)
+        response = client.post(
+            '/api/reviews/bulk/',
+            [{'book_id': self.bulk_book.pk, 'rating': '4.0'}, {'book_id': self.bulk_book.pk, 'rating': '3.0'}, {'book_id': 0}],
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Review.objects.exists())
+
+
+class SimilarityTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        checkpoint_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(checkpoint_dir.cleanup)
+        self.enterContext(override_settings(SIMILARITY_CHECKPOINT_DIR=checkpoint_dir.name))
+        self.users = [self.make_user(f'reader{i}') for i in range(4)]
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(5)]
+        for user, ratings in zip(self.users, [
+            {0: '5.0', 1: '4.5', 2: '2.0'},
+            {0: '4.0', 1: '5.0', 3: '3.5'},
+            {1: '3.0', 2: '5.0', 3: '4.0'},
+            {0: '1.0', 3: '5.0'},
+        ]):
+            for book, rating in ratings.items():
+                self.review(user, self.books[book], rating)
+        # A diary entry counts for a book the reader hasn't reviewed, and loses to a review of one they have
+        DiaryEntry.objects.create(user=self.users[3], book=self.books[2], status='reading')
+        DiaryEntry.objects.create(user=self.users[0], book=self.books[0], status='to-read')
+
+    def stored(self):
+        return {
+            (book_id, similar_id): score
+            for book_id, similar_id, score in BookSimilarity.objects.values_list('book_id', 'similar_book_id', 'score')
+        }
+
+    def brute_force(self, min_readers=2):
+        """Cosine similarity of every pair of book columns, straight from the definition."""
+        columns = {}
+        for user in self.users:
+            for book_id, weight in user_weights(user).items():
+                if weight > 0:
+                    columns.setdefault(book_id, {})[user.pk] = weight
+        columns = {book_id: column for book_id, column in columns.items() if len(column) >= min_readers}
+        norms = {book_id: math.sqrt(sum(w * w for w in column.values())) for book_id, column in columns.items()}
+        scores = {}
+        for a, column in columns.items():
+            for b, other in columns.items():
+                dot = sum(weight * other.get(user_id, 0) for user_id, weight in column.items())
+                if a != b and dot:
+                    scores[(a, b)] = dot / (norms[a] * norms[b])
+        return scores
+
+    def assertScoresEqual(self, stored, expected):
+        self.assertEqual(stored.keys(), expected.keys())
+        for key, score in expected.items():
+            self.assertAlmostEqual(stored[key], score, places=5)
+
+    def test_rebuild_matches_cosine(self):
+        books, rows = rebuild_similarities(top_k=10, block_size=2)
+        expected = self.brute_force()
+        self.assertEqual(rows, len(expected))
+        self.assertScoresEqual(self.stored(), expected)
+
+        # Blocking and top_k only decide which neighbours are kept, never their scores
+        rebuild_similarities(top_k=1, block_size=10)
+        best = {}
+        for (book_id, similar_id), score in expected.items():
+            if score > best.get(book_id, (0, None))[0]:
+                best[book_id] = (score, similar_id)
+        self.assertScoresEqual(self.stored(), {(book_id, similar_id): score for book_id, (score, similar_id) in best.items()})
+
+    def test_endpoints(self):
+        rebuild_similarities(top_k=10)
+        client = self.client_for(self.users[3])
+        book = self.books[0]
+        expected = sorted(
+            ((score, similar_id) for (book_id, similar_id), score in self.stored().items() if book_id == book.pk),
+            reverse=True,
+        )
+        response = client.get(f'/api/books/{book.pk}/similar/')
+        self.assertEqual([row['id'] for row in response.json()], [similar_id for _, similar_id in expected])
+        self.assertEqual(client.get('/api/books/0/similar/').status_code, 404)
+
+        # Reader 3 has every book but Book 1 and Book 4, and Book 4 has no neighbours
+        self.assertEqual([row['id'] for row in client.get('/api/recommendations/').json()], [self.books[1].pk])
+
+    def test_incremental_update_matches_rebuild(self):
+        # Older reviews fall outside the overlap re-read before the high-water mark; the latest one doesn't
+        Review.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        Review.objects.filter(book=self.books[0]).update(updated_at=timezone.now() - timedelta(days=1))
+        rebuild_similarities(top_k=2, block_size=2)
+        self.assertEqual(update_similarities(top_k=2)[0], 1)
+
+        newcomer = self.make_user('newcomer')
+        changed = Review.objects.get(user=self.users[3], book=self.books[0])
+        changed.rating = Decimal('4.5')
+        changed.save()
+        for user, book, rating in [(newcomer, 4, '5.0'), (self.users[1], 4, '4.0'), (newcomer, 0, '1.5')]:
+            self.review(user, self.books[book], rating)
+        touched = {self.books[0].pk, self.books[4].pk}
+
+        books, _ = update_similarities(top_k=2, block_size=1)
+        self.assertEqual(books, len(touched))
+        updated = Interactions.open(settings.SIMILARITY_CHECKPOINT_DIR)
+        incremental = {key: score for key, score in self.stored().items() if key[0] in touched}
+
+        rebuild_similarities(top_k=2, block_size=2)
+        loaded = Interactions.load()
+        self.assertEqual((updated.users.tolist(), updated.books.tolist()), (loaded.users.tolist(), loaded.books.tolist()))
+        self.assertEqual((updated.matrix != loaded.matrix).nnz, 0)
+        for norm, expected in zip(updated.norms, loaded.norms):
+            self.assertAlmostEqual(norm, expected, places=5)
+        self.assertScoresEqual(incremental, {key: score for key, score in self.stored().items() if key[0] in touched})
+
+
+class TrendingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [self.make_user(f'reader{i}') for i in range(3)]
+        self.genre = Genre.objects.create(name='Science Fiction')
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(2)]
+        self.books[0].genres.add(self.genre)
+
+    def scores(self):
+        rows = TrendingScore.objects.filter(all_score__gt=0).values_list(
+            'book_id', 'genre_id', 'day_score', 'week_score', 'all_score',
+        )
+        return {(book_id, genre_id): scores for book_id, genre_id, *scores in rows}
+
+    def assertScoresFresh(self):
+        stored = self.scores()
+        rebuild_scores()
+        rebuilt = self.scores()
+        self.assertEqual(stored.keys(), rebuilt.keys())
+        for key, scores in rebuilt.items():
+            for stored_score, score in zip(stored[key], scores):
+                self.assertAlmostEqual(stored_score, score, places=6)
+
+    def test_reviews_and_likes(self):
+        reviews = [self.review(user, book, '4.0') for user in self.users for book in self.books]
+        ReviewLike.objects.create(user=self.users[1], review=reviews[0])
+        like = ReviewLike.objects.create(user=self.users[2], review=reviews[0])
+        self.assertScoresFresh()
+        like.delete()
+        reviews[0].delete()
+        reviews[1].delete()
+        self.assertScoresFresh()
+
+    def test_genre_copies_follow_the_book(self):
+        self.review(self.users[0], self.books[1], '4.0')
+        self.books[1].genres.add(self.genre)
+        self.assertScoresFresh()
+        self.books[0].genres.remove(self.genre)
+        self.review(self.users[0], self.books[0], '4.0')
+        self.assertScoresFresh()
+
+    def test_endpoint(self):
+        for user in self.users:
+            self.review(user, self.books[1], '4.0')
+        self.review(self.users[0], self.books[0], '4.0')
+        client = self.client_for(self.users[0])
+        ranked = [row['id'] for row in client.get('/api/books/trending/?window=day').json()]
+        self.assertEqual(ranked, [self.books[1].pk, self.books[0].pk])
+        ranked = [row['id'] for row in client.get(f'/api/books/trending/?genre={self.genre.pk}').json()]
+        self.assertEqual(ranked, [self.books[0].pk])
+        self.assertEqual(client.get('/api/books/trending/?window=month').status_code, 400)
+
+
+class FacetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        facets._index = facets.FacetIndex()  # Other tests' books were rolled back under the process's index
+        self.genres = [Genre.objects.create(name=name) for name in ('Fantasy', 'History', 'Poetry')]
+        self.books = []
+        for i in range(12):
+            book = Book.objects.create(
+                title=f'Book {i}', publication_date=date(1950 + i * 7, 1, 1), page_count=100 + i * 40,
+            )
+            book.genres.add(*self.genres[:i % 3 + 1])
+            self.books.append(book)
+
+    def assertCountsFresh(self, query):
+        filters = BookFilters(QueryDict(query))
+        counts = facet_counts(filters)
+        books = Book.objects.filter(**filters.lookups()).distinct()
+        self.assertEqual(counts['count'], books.count())
+
+        # Each facet is counted with every filter but its own
+        lookups = {key: value for key, value in filters.lookups().items() if key != 'genres'}
+        expected_genres = {
+            genre.pk: Book.objects.filter(genres=genre, **lookups).distinct().count() for genre in Genre.objects.all()
+        }
+        self.assertEqual({row['id']: row['count'] for row in counts['genres']}, {
+            pk: n for pk, n in expected_genres.items() if n
+        })
+
+        lookups = {key: value for key, value in filters.lookups().items() if not key.startswith('publication_date')}
+        expected_decades = {}
+        for published in Book.objects.filter(**lookups).distinct().values_list('publication_date', flat=True):
+            if published is not None:
+                decade = published.year // 10 * 10
+                expected_decades[decade] = expected_decades.get(decade, 0) + 1
+        self.assertEqual({row['decade']: row['count'] for row in counts['decades']}, expected_decades)
+
+    def test_counts_follow_writes(self):
+        queries = ['', f'genre={self.genres[1].pk}', 'year_min=1970&year_max=1999', 'pages_min=200&pages_max=400']
+        for query in queries:
+            self.assertCountsFresh(query)
+
+        self.books[0].genres.add(self.genres[2])
+        self.books[1].publication_date = date(1801, 1, 1)
+        self.books[1].save()
+        self.books[2].delete()
+        self.genres[0].delete()
+        Book.objects.create(title='Undated', page_count=250)
+        for query in queries:
+            self.assertCountsFresh(query)
+
+    def test_counts_while_another_request_refreshes(self):
+        self.assertCountsFresh('')
+        Book.objects.create(title='Late', page_count=250)
+        # Counts come from the loaded bitmaps instead of waiting for the refreshing request
+        with facets._refresh_lock:
+            self.assertEqual(facet_counts(BookFilters(QueryDict('')))['count'], 12)
+        self.assertCountsFresh('')
+
+    def test_endpoint(self):
+        client = self.client_for(self.make_user('reader'))
+        query = f'genre={self.genres[2].pk}&year_min=1980'
+        data = client.get(f'/api/books/?{query}&facets=true').json()
+        expected = Book.objects.filter(**BookFilters(QueryDict(query)).lookups()).order_by('pk')
+        self.assertEqual([row['id'] for row in data['results']], list(expected.values_list('pk', flat=True)))
+        self.assertEqual(data['facets'], facet_counts(BookFilters(QueryDict(query))))
+        self.assertEqual(client.get('/api/books/?year_min=soon').status_code, 400)
+
+
+class CoverTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root, cache_dir = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.cache = covers.CoverCache(cache_dir.name, 1024 ** 2)
+        self.enterContext(mock.patch.object(covers, '_cache', self.cache))
+        self.client = self.client_for(self.make_user('reader'))
+
+        image = BytesIO()
+        Image.new('RGB', (600, 900), 'navy').save(image, 'PNG')
+        self.book = Book(title='Dune')
+        self.book.cover.name = default_storage.save('covers/dune.png', ContentFile(image.getvalue()))
+        self.book.save()
+
+    def test_variants_rendered_once(self):
+        urls = self.client.get('/api/books/?ordering=title').json()[0]['covers']
+        self.assertEqual(urls['thumbnail'], f'/api/covers/{self.book.cover_key}/200.webp')
+        for url, width in [(urls['thumbnail'], 200), (urls['large'], 600)]:  # Never scaled up
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            image = Image.open(BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual((image.format, image.width), ('WEBP', width))
+
+        with mock.patch.object(covers, 'render') as render:
+            self.assertEqual(self.client.get(urls['medium']).status_code, 200)
+        render.assert_not_called()
+        self.assertEqual(self.client.get(f'/api/covers/{self.book.cover_key}/300.webp').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/covers/{"0" * 24}/200.webp').status_code, 404)
+
+    def test_unreachable_source_redirects(self):
+        book = Book.objects.create(title='Emma', cover_url='http://127.0.0.1:9/emma.jpg')
+        for _ in range(2):  # The failure is remembered, so the second request doesn't fetch again
+            response = self.client.get(f'/api/covers/{book.cover_key}/200.webp')
+            self.assertEqual((response.status_code, response['Location']), (302, book.cover_url))
+            self.assertIn('no-cache', response['Cache-Control'])
+
+    def response(self, status, location=None, body=b''):
+        response = requests.Response()
+        response.status_code = status
+        if location:
+            response.headers['Location'] = location
+        response.raw = mock.Mock(read=mock.Mock(return_value=body))
+        return response
+
+    def test_only_allowed_hosts_fetched(self):
+        urls = [
+            'http://169.254.169.254/latest/meta-data/', 'http://localhost:8000/admin/', 'file:///etc/passwd',
+            'https://covers.openlibrary.org.example.com/b/id/1-L.jpg',
+        ]
+        with mock.patch.object(covers._session, 'get') as get:
+            for url in urls:
+                with self.assertRaises(covers.CoverError):
+                    covers.read_source('', url)
+        get.assert_not_called()
+
+        redirected = [self.response(302, 'https://ia800.us.archive.org/1-L.jpg'), self.response(200, body=b'jpeg')]
+        with mock.patch.object(covers._session, 'get', side_effect=redirected) as get:
+            self.assertEqual(covers.read_source('', 'https://covers.openlibrary.org/b/id/1-L.jpg'), b'jpeg')
+        self.assertEqual(get.call_args.args, ('https://ia800.us.archive.org/1-L.jpg',))
+
+        redirected = [self.response(302, 'http://127.0.0.1:6379/'), self.response(200, body=b'internal')]
+        with mock.patch.object(covers._session, 'get', side_effect=redirected) as get, self.assertRaises(covers.CoverError):
+            covers.read_source('', 'https://covers.openlibrary.org/b/id/1-L.jpg')
+        self.assertEqual(get.call_count, 1)
+
+    def test_least_recently_used_evicted(self):
+        lru = covers.CoverCache(self.cache.directory / 'lru', max_bytes=250)
+        lru.put('aa-200.webp', b'a' * 100)
+        lru.put('bb-200.webp', b'b' * 100)
+        os.utime(lru.path('aa-200.webp'), (1000, 1000))
+        os.utime(lru.path('bb-200.webp'), (2000, 2000))
+        lru.open('aa-200.webp').close()  # Reading a file makes it the most recently used
+        lru.put('cc-200.webp', b'c' * 100)
+        self.assertEqual(
+            [name for name in ('aa-200.webp', 'bb-200.webp', 'cc-200.webp') if lru.path(name).exists()],
+            ['aa-200.webp', 'cc-200.webp'],
+        )
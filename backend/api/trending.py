@@ -0,0 +1,195 @@
+"""
+Trending books: leaderboards of recent activity, read top N straight off an index.
+
+Every new review, review like and diary status change adds a weight to its book's
+score in each window. In the day and week windows a weight halves every
+HALF_LIVES[window], so a book's score now is the sum of weight * 2^-((now - t) / half_life)
+over its events. Scaling every book's score by the same 2^((now - EPOCH) / half_life)
+keeps their order, so what is stored is the sum of weight * 2^((t - EPOCH) / half_life):
+an event adds to it once, and nothing ever has to be decayed afterwards. Those sums
+grow exponentially with time, so they are stored as natural logs, and an event is
+added to one in SQL as ln(e^a + e^b) = max(a, b) + ln(1 + e^-|a - b|). The all
+window doesn't decay and is a plain sum.
+
+TrendingScore has a row per book for the whole catalog and a copy of it for each of
+the book's genres, each indexed on (genre, -score) per window, so a leaderboard with
+or without ?genre= is one index range scan. Every event updates all of a book's rows
+alike, and the genre signals in models.py add and drop copies as books change genres.
+
+Deleted reviews and likes take their weight back out, at their own time. Diary
+changes are only counted as they happen; `manage.py rebuild_trending` recomputes the
+scores from reviews and likes, e.g. after bulk loads that skip the signals.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Exp, Greatest, Least, Ln
+from django.utils import timezone
+
+from .models import Book, Review, ReviewLike, TrendingScore
+
+DAY = 'day'
+WEEK = 'week'
+ALL = 'all'
+WINDOWS = [DAY, WEEK, ALL]
+SCORE_FIELDS = {DAY: 'day_score', WEEK: 'week_score', ALL: 'all_score'}
+HALF_LIVES = {DAY: timedelta(days=1), WEEK: timedelta(days=7)}
+
+# Decayed scores are stored relative to this moment
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+REVIEW_WEIGHT = 3.0
+LIKE_WEIGHT = 1.0
+DIARY_WEIGHTS = {'to-read': 1.0, 'reading': 2.0, 'read': 2.0}
+
+# Log score of a row no event has reached yet
+EMPTY = -1e300
+# Past this difference between two logs, e^-difference is lost in rounding anyway;
+# also keeps EXP() clear of underflow, which PostgreSQL reports as an error
+LOG_CUTOFF = 50.0
+
+LOAD_CHUNK_SIZE = 10_000
+BATCH_SIZE = 1000
+
+
+def log_scores(weight, moment):
+    """{field: log of what an event of weight at moment adds} for the decaying windows."""
+    return {
+        SCORE_FIELDS[window]: math.log(weight) + (moment - EPOCH) / half_life * math.log(2)
+        for window, half_life in HALF_LIVES.items()
+    }
+
+
+def log_add(a, b):
+    """ln(e^a + e^b), without overflowing."""
+    return max(a, b) + math.log1p(math.exp(-min(abs(a - b), LOG_CUTOFF)))
+
+
+def log_add_expression(field, value):
+    """log_add() of a log score column and a value, in SQL."""
+    value = Value(value)
+    return Greatest(F(field), value) + Ln(Value(1.0) + Exp(-Least(Abs(F(field) - value), Value(LOG_CUTOFF))))
+
+
+def log_subtract_expression(field, value):
+    """ln(e^field - e^value) in SQL; a score that would drop to 0 or below ends up at e^-LOG_CUTOFF of itself."""
+    value = Value(value)
+    share = Value(1.0) - Exp(Greatest(Least(value - F(field), Value(0.0)), Value(-LOG_CUTOFF)))
+    return F(field) + Ln(Greatest(share, Value(math.exp(-LOG_CUTOFF))))
+
+
+def create_rows(book_ids):
+    """Create the catalog and genre rows of the given books that don't have them yet, all EMPTY."""
+    genres = Book.genres.through.objects.filter(book_id__in=book_ids).values_list('book_id', 'genre_id')
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(book_id=book_id, genre_id=None, day_score=EMPTY, week_score=EMPTY) for book_id in book_ids]
+        + [TrendingScore(book_id=book_id, genre_id=genre_id, day_score=EMPTY, week_score=EMPTY) for book_id, genre_id in genres],
+        ignore_conflicts=True,
+    )
+
+
+def add_events(events):
+    """
+    Add events [(book_id, weight, moment), ...] to their books' scores. Books with the same
+    total change are updated together, so a batch of events at one moment takes a handful of UPDATEs.
+    """
+    changes = {}
+    for book_id, weight, moment in events:
+        logs = log_scores(weight, moment)
+        if book_id in changes:
+            old, total = changes[book_id]
+            logs = {field: log_add(old[field], value) for field, value in logs.items()}
+            weight += total
+        changes[book_id] = (logs, weight)
+    if not changes:
+        return
+
+    groups = {}
+    for book_id, (logs, total) in changes.items():
+        groups.setdefault((tuple(sorted(logs.items())), total), []).append(book_id)
+    with transaction.atomic():
+        create_rows(list(changes))
+        for (logs, total), book_ids in groups.items():
+            TrendingScore.objects.filter(book_id__in=book_ids).update(
+                **{field: log_add_expression(field, value) for field, value in logs},
+                all_score=F('all_score') + total,
+            )
+
+
+def add_event(book_id, weight, moment=None):
+    add_events([(book_id, weight, moment or timezone.now())])
+
+
+def remove_event(book_id, weight, moment):
+    """Take back the weight an event at moment added to a book's scores."""
+    TrendingScore.objects.filter(book_id=book_id).update(
+        **{field: log_subtract_expression(field, value) for field, value in log_scores(weight, moment).items()},
+        all_score=Greatest(F('all_score') - weight, Value(0.0)),
+    )
+
+
+def liked_book_id(review_id):
+    """The book of a liked review, or None once the review is gone."""
+    return Review.objects.filter(pk=review_id).values_list('book_id', flat=True).first()
+
+
+def sync_genres(book_ids):
+    """Make the genre copies of the books' scores match the genres they have now."""
+    book_ids = list(book_ids)
+    genres = set(Book.genres.through.objects.filter(book_id__in=book_ids).values_list('book_id', 'genre_id'))
+    with transaction.atomic():
+        copies = TrendingScore.objects.filter(book_id__in=book_ids, genre__isnull=False)
+        existing = {(book_id, genre_id): pk for pk, book_id, genre_id in copies.values_list('pk', 'book_id', 'genre_id')}
+        TrendingScore.objects.filter(pk__in=[pk for key, pk in existing.items() if key not in genres]).delete()
+        catalog = {row.book_id: row for row in TrendingScore.objects.filter(book_id__in=book_ids, genre=None)}
+        TrendingScore.objects.bulk_create(
+            [
+                TrendingScore(
+                    book_id=book_id, genre_id=genre_id, day_score=catalog[book_id].day_score,
+                    week_score=catalog[book_id].week_score, all_score=catalog[book_id].all_score,
+                )
+                for book_id, genre_id in genres - set(existing) if book_id in catalog
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def trending_book_ids(window, genre_id=None, limit=20):
+    """Ids of the books at the top of a window's leaderboard, for the whole catalog or one genre."""
+    field = SCORE_FIELDS[window]
+    return list(
+        TrendingScore.objects.filter(genre_id=genre_id).order_by(f'-{field}', 'book_id')
+        .values_list('book_id', flat=True)[:limit]
+    )
+
+
+def rebuild_scores():
+    """Recompute every score from the reviews and likes, at their created_at. Returns the number of books scored."""
+    scores = {}
+    sources = [
+        (Review.objects.values_list('book_id', 'created_at'), REVIEW_WEIGHT),
+        (ReviewLike.objects.values_list('review__book_id', 'created_at'), LIKE_WEIGHT),
+    ]
+    for rows, weight in sources:
+        for book_id, moment in rows.order_by().iterator(chunk_size=LOAD_CHUNK_SIZE):
+            logs = log_scores(weight, moment)
+            old = scores.get(book_id)
+            if old:
+                logs = {field: log_add(old[field], value) for field, value in logs.items()}
+            logs['all_score'] = (old['all_score'] if old else 0) + weight
+            scores[book_id] = logs
+
+    genres = Book.genres.through.objects.values_list('book_id', 'genre_id')
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(book_id=book_id, genre_id=None, **fields) for book_id, fields in scores.items()]
+            + [
+                TrendingScore(book_id=book_id, genre_id=genre_id, **scores[book_id])
+                for book_id, genre_id in genres.iterator(chunk_size=LOAD_CHUNK_SIZE) if book_id in scores
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    return len(scores)
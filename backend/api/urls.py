@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from . import views
+from . import covers, views
 
 router = DefaultRouter()
 router.register(r'authors', views.AuthorViewSet)
@@ -11,11 +11,18 @@ router.register(r'review-likes', views.ReviewLikeViewSet)
 router.register(r'diary-entries', views.DiaryEntryViewSet)
 
 urlpatterns = [
+    # Async ahead of the router's books/<pk>/ route, which still takes ids that aren't numbers
+    path('books/<int:pk>/', views.book_detail, name='book_detail'),
     path('', include(router.urls)),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('register/', views.register_user, name='register'),
     path('user/stats/', views.user_stats, name='user_stats'),
     path('user/activity/', views.user_activity, name='user_activity'),
+    path('feed/', views.feed, name='feed'),
+    path('recommendations/', views.BookViewSet.as_view({'get': 'recommendations'}), name='recommendations'),
+    path('covers/<str:key>/<int:width>.webp', covers.cover_view, name='cover'),
     path('analytics/', views.request_analytics, name='request_analytics'),
+    path('profiling/', views.profiling_overview, name='profiling_overview'),
+    path('profiling/<str:profile_id>/', views.profiling_detail, name='profiling_detail'),
 ]
\ No newline at end of file
@@ -1,17 +1,39 @@
-from rest_framework import viewsets, status, permissions, pagination
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework import viewsets, status, permissions
+from rest_framework.decorators import action, api_view, permission_classes, renderer_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from functools import partial
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.http import Http404
 from rest_framework import serializers
-from django.db.models import Avg, Count, Exists, OuterRef
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
-from .models import Author, Book, Review, Profile, DiaryEntry, ReviewLike
+from . import analytics, bulk, profiling, trending
+from .caching import CATALOG_VERSION_KEY, acached_response, book_version_key, cached_response
+from .concurrency import async_api_view, run_queries
+from .covers import variant_urls
+from .facets import BookFilters, facet_counts
+from .fastpath import CompiledListMixin, get_reader
+from .feed import LIKED_REVIEW, REVIEWED, read_feed
+from .pagination import KeysetPagination
+from .recommendations import recommended_book_ids, similar_book_ids
+from .search import search_books
+from .stats import get_user_stats
+from .streaming import stream_json
+from .models import Activity, Author, Book, Review, Profile, DiaryEntry, ReviewLike
 from .serializers import (
-    AuthorSerializer, BookSerializer, ReviewSerializer,
+    ActivitySerializer, AuthorSerializer, BookSerializer, ReviewSerializer,
     ProfileSerializer, UserSerializer, DiaryEntrySerializer, ReviewLikeSerializer
 )
 
+def limit_param(request, default, maximum):
+    """?limit= as an int from 1 to maximum, or default when missing or not a number."""
+    try:
+        return min(max(int(request.query_params.get('limit', default)), 1), maximum)
+    except ValueError:
+        return default
+
 # Custom permission classes
 class IsAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -32,10 +54,38 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         # Write permissions are only allowed to the owner of the review
         return obj.user == request.user
 
-class ReviewPagination(pagination.PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 50
+class ReviewPagination(KeysetPagination):
+    # Views with ?book= order by (-likes_count, -created_at) and the paginator appends id
+    ordering = ('-created_at', 'id')
+
+class BookPagination(KeysetPagination):
+    ordering = ('id',)
+
+class DiaryEntryPagination(KeysetPagination):
+    ordering = ('-id',)
+
+class FeedPagination(KeysetPagination):
+    """
+    Always on and forward only: a feed page is merged from two sources (see api/feed.py)
+    rather than cut from one queryset, so only the next cursor is produced.
+    """
+    page_size = 20
+
+    def is_requested(self, request):
+        return True
+
+    def paginate_feed(self, user, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = [(Activity._meta.get_field('created_at'), True), (Activity._meta.pk, True)]
+        position, _ = self.decode_cursor(request)
+
+        activities = read_feed(user, position, self.page_size + 1)
+        has_more = len(activities) > self.page_size
+        activities = activities[:self.page_size]
+        self.next_values = self.position(activities[-1]) if activities and has_more else None
+        self.previous_values = None
+        return activities
 
 class UserSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(read_only=True)
@@ -67,39 +117,188 @@ class AuthorViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated(), IsAdmin()]  # Only admins can modify
         return super().get_permissions()
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(CompiledListMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = BookPagination
+    filters = None  # BookFilters of a list request
 
     def get_queryset(self):
-        # Use select_related() for ForeignKey relationships (publisher)
-        # Use prefetch_related() for ManyToMany and reverse relations (authors, reviews)
-        queryset = Book.objects.select_related('publisher').prefetch_related('authors', 'reviews')
-        
+        queryset = self.books(Book.objects.all())
+        if self.filters is not None:
+            queryset = queryset.filter(**self.filters.lookups())
+
         ordering = self.request.query_params.get('ordering', None)
         if ordering:
             queryset = queryset.order_by(ordering)
         
+        # Legacy ?limit= slice, only for unpaginated requests since pages can't be cut from a slice
         limit = self.request.query_params.get('limit', None)
-        if limit:
+        if limit and not self.paginator.is_requested(self.request):
             queryset = queryset[:int(limit)]
         
         return queryset
 
+    def books(self, queryset):
+        """
+        Load what the serializer will output: with ?fields= only the requested columns, and
+        only the relations among them are joined or prefetched.
+        """
+        requested = BookSerializer.requested_fields(self.request)
+        # Use select_related() for ForeignKey relationships (publisher)
+        # Use prefetch_related() for ManyToMany relations (authors, genres)
+        # reviews_count comes from the stored counter, so reviews are not loaded at all
+        if requested is None or 'publisher' in requested:
+            queryset = queryset.select_related('publisher')
+        queryset = queryset.prefetch_related(*(name for name in ('authors', 'genres') if requested is None or name in requested))
+        if requested is not None:
+            # Ordering columns too, which the cursor paginator reads from each row
+            ordering = [name.lstrip('-') for name in self.request.query_params.get('ordering', '').split(',') if name]
+            queryset = queryset.only('id', *BookSerializer.model_columns(requested), *ordering)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        The catalog, filtered by ?genre=, ?author=, ?year_min=, ?year_max=, ?pages_min= and ?pages_max=.
+        ?facets=true adds how many books match per genre and per decade (see api/facets.py).
+        """
+        try:
+            self.filters = BookFilters(request.query_params)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        build = super().list
+
+        def build_response():
+            response = build(request, *args, **kwargs)
+            if request.query_params.get('facets') == 'true':
+                facets = facet_counts(self.filters)
+                if isinstance(response.data, dict):
+                    response.data['facets'] = facets
+                else:
+                    response.data = {'results': response.data, 'facets': facets}
+            return response
+
+        return cached_response(request, 'books:list', [CATALOG_VERSION_KEY], build_response)
+
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        version_key = book_version_key(kwargs['pk'])
+        return cached_response(request, 'books:detail', [version_key], lambda: build(request, *args, **kwargs))
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked full-text search over titles, authors, genres and descriptions (see api/search.py).
+        ?autocomplete=true returns only id, title, cover_url and covers for type-ahead.
+        """
+        query = request.query_params.get('q', '').strip()
+        book_ids = search_books(query, limit_param(request, 20, 50))
+
+        if request.query_params.get('autocomplete') == 'true':
+            rows = Book.objects.filter(pk__in=book_ids).values('id', 'title', 'cover_url', 'cover_key')
+            by_id = {}
+            for row in rows:
+                key = row.pop('cover_key')
+                by_id[row['id']] = {**row, 'covers': variant_urls(key)}
+            return Response([by_id[book_id] for book_id in book_ids if book_id in by_id])
+        return Response(self.read_books(book_ids))
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        "Readers also liked": the books most similar to this one by who liked them, best
+        first (see api/recommendations.py). ?limit= up to the neighbours stored per book.
+        """
+        def build():
+            if not Book.objects.filter(pk=pk).exists():
+                raise Http404('No Book matches the given query.')
+            return Response(self.read_books(similar_book_ids(pk, limit_param(request, 10, 50))))
+
+        return cached_response(request, f'books:similar:{pk}', [CATALOG_VERSION_KEY], build)
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        """
+        Books with the most reviews, likes and reading activity lately, best first (see api/trending.py).
+        ?window=day|week|all (default week), ?genre=<genre id>, ?limit= up to 100.
+        """
+        window = request.query_params.get('window', trending.WEEK)
+        if window not in trending.WINDOWS:
+            return Response({'error': f'window must be one of {", ".join(trending.WINDOWS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        genre = request.query_params.get('genre') or None
+        if genre is not None and not genre.isdigit():
+            return Response({'error': 'genre must be a genre id'}, status=status.HTTP_400_BAD_REQUEST)
+        book_ids = trending.trending_book_ids(window, genre and int(genre), limit_param(request, 20, 100))
+        return Response(self.read_books(book_ids))
+
+    def recommendations(self, request):
+        """GET /api/recommendations/: books like those the user liked, best first. ?limit= up to 100."""
+        return Response(self.read_books(recommended_book_ids(request.user, limit_param(request, 20, 100))))
+
+    def read_books(self, book_ids):
+        """The given books on the compiled read path, in the order of book_ids."""
+        reader = self.get_reader()
+        rows = list(self.read_values(self.books(Book.objects.filter(pk__in=book_ids)), reader))
+        # Keyed on the row ids, since ?fields= may leave id out of the output
+        by_id = dict(zip((row['id'] for row in rows), reader.read(rows)))
+        return [by_id[book_id] for book_id in book_ids if book_id in by_id]
+
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
-            return [IsAuthenticated(), IsAdmin() | IsVerifiedAuthor()]
+            return [IsAuthenticated(), (IsAdmin | IsVerifiedAuthor)()]
         return super().get_permissions()
 
-class ReviewViewSet(viewsets.ModelViewSet):
+@async_api_view(fallback=BookViewSet.as_view({'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}))
+@permission_classes([IsAuthenticated])
+@renderer_classes(CompiledListMixin.renderer_classes)
+async def book_detail(request, pk):
+    """
+    GET /api/books/<id>/ as BookViewSet.retrieve() answers it, with the book row and its
+    authors and genres read concurrently. Writes go to BookViewSet.
+    """
+    async def build():
+        reader = get_reader(BookSerializer(context={'request': request}))
+        rows, *related = await run_queries(
+            lambda: list(Book.objects.filter(pk=pk).values(*reader.columns)),
+            *[partial(child.read_related, query_name, {pk}) for child, _, query_name in reader.many],
+        )
+        if not rows:
+            raise Http404('No Book matches the given query.')
+        return Response(reader.build(rows, related)[0])
+
+    return await acached_response(request, 'books:detail', [book_version_key(pk)], build)
+
+
+class ReviewViewSet(CompiledListMixin, bulk.BulkWriteMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = ReviewPagination
+    stream_chunk_size = 500
+    bulk_key = 'book_id'
+    bulk_target = Book
+    # What ReviewSerializer computes from the related objects and the is_liked_by_user annotation
+    read_columns = {
+        'user': 'user__username',
+        'user_id': 'user_id',
+        'book_id': 'book_id',
+        'is_liked_by_user': 'is_liked_by_user',
+    }
+
+    def list(self, request, *args, **kwargs):
+        # A user's own reviews (?user=me) are exported in full, so stream them instead of building one big response
+        if request.query_params.get('user') == 'me' and not self.paginator.is_requested(request):
+            reader = self.get_reader()
+            queryset = self.read_values(self.filter_queryset(self.get_queryset()), reader)
+            return stream_json(request, queryset, reader.read, chunk_size=self.stream_chunk_size)
+        return super().list(request, *args, **kwargs)
 
     def get_queryset(self):
-        # Optimize queries: select_related for ForeignKeys, prefetch_related for reverse relations
-        queryset = Review.objects.select_related('user', 'book').prefetch_related('likes').annotate(likes_count=Count('likes'))
+        # Optimize queries: select_related for ForeignKeys; likes_count is a stored counter
+        queryset = Review.objects.select_related('user', 'book')
+        if self.request.query_params.get('include_book') == 'true':
+            queryset = queryset.prefetch_related('book__authors', 'book__genres')
 
         # Annotate whether current user has liked each review to avoid N+1 queries
         user = self.request.user
@@ -130,26 +329,26 @@ class ReviewViewSet(viewsets.ModelViewSet):
         if ordering:
             queryset = queryset.order_by(ordering)
 
+        # Legacy ?limit= slice, only for unpaginated requests since pages can't be cut from a slice
         limit = self.request.query_params.get('limit', None)
-        if limit:
+        if limit and not self.paginator.is_requested(self.request):
             queryset = queryset[:int(limit)]
 
         return queryset
 
-    def get_paginated_response(self, data):
-        # Disable pagination for user reviews (user=me) to get all reviews
-        user_param = self.request.query_params.get('user', None)
-        if user_param == 'me':
-            return Response(data)
-        return super().get_paginated_response(data)
-
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class ReviewLikeViewSet(viewsets.ModelViewSet):
+    def bulk_write(self, items):
+        created, updated = bulk.upsert_reviews(self.request.user, items)
+        return {'created': created, 'updated': updated}
+
+class ReviewLikeViewSet(bulk.BulkWriteMixin, viewsets.ModelViewSet):
     queryset = ReviewLike.objects.all()
     serializer_class = ReviewLikeSerializer
     permission_classes = [IsAuthenticated]
+    bulk_key = 'review_id'
+    bulk_target = Review
 
     def get_queryset(self):
         return ReviewLike.objects.filter(user=self.request.user)
@@ -157,72 +356,88 @@ class ReviewLikeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class DiaryEntryViewSet(viewsets.ModelViewSet):
+    def bulk_write(self, items):
+        created, unchanged = bulk.add_review_likes(self.request.user, [item['review_id'] for item in items])
+        return {'created': created, 'unchanged': unchanged}
+
+class DiaryEntryViewSet(bulk.BulkWriteMixin, viewsets.ModelViewSet):
     queryset = DiaryEntry.objects.all()
     serializer_class = DiaryEntrySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DiaryEntryPagination
+    bulk_key = 'book_id'
+    bulk_target = Book
 
     def get_queryset(self):
-        return DiaryEntry.objects.filter(user=self.request.user)
+        return (
+            DiaryEntry.objects.filter(user=self.request.user)
+            .select_related('user', 'book__publisher')
+            .prefetch_related('book__authors', 'book__genres')
+        )
 
     def perform_create(self, serializer):
-        instance = serializer.save(user=self.request.user)
-        # Auto-set read_date when creating with status 'read'
-        if instance.status == 'read' and (instance.read_date is None or instance.read_date == ''):
-            instance.read_date = timezone.now().date()
-            instance.save()
+        self.save_entry(serializer, user=self.request.user)
 
     def perform_update(self, serializer):
-        instance = serializer.save()
-        # Auto-set read_date when status changes to 'read'
-        if instance.status == 'read' and (instance.read_date is None or instance.read_date == ''):
-            instance.read_date = timezone.now().date()
-            instance.save()
+        self.save_entry(serializer)
+
+    def save_entry(self, serializer, **kwargs):
+        # Auto-set read_date when the entry is saved with status 'read', in the same save
+        old = serializer.instance or DiaryEntry()
+        status = serializer.validated_data.get('status', old.status)
+        read_date = serializer.validated_data.get('read_date', old.read_date)
+        if status == 'read' and read_date is None:
+            kwargs['read_date'] = timezone.now().date()
+        serializer.save(**kwargs)
 
     def update(self, request, *args, **kwargs):
         return super().update(request, *args, **kwargs)
 
-@api_view(['GET'])
+    def bulk_write(self, items):
+        created, updated = bulk.upsert_diary_entries(self.request.user, items)
+        return {'created': created, 'updated': updated}
+
+@async_api_view()
 @permission_classes([IsAuthenticated])
-def user_stats(request):
-    user = request.user
-    reviews = Review.objects.filter(user=user)
-    total_reviews = reviews.count()
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-    books_reviewed = reviews.values('book').distinct().count()
-    likes_received = ReviewLike.objects.filter(review__user=user).count()
+async def user_stats(request):
+    # One primary key lookup on the rollup maintained by signals (see api/stats.py)
+    stats, = await run_queries(lambda: get_user_stats(request.user))
 
     return Response({
-        'total_reviews': total_reviews,
-        'avg_rating': round(avg_rating, 1) if avg_rating else 0,
-        'books_reviewed': books_reviewed,
-        'likes_received': likes_received,
+        'total_reviews': stats.rating_count,
+        'avg_rating': round(stats.average_rating, 1) if stats.average_rating else 0,
+        'books_reviewed': stats.books_reviewed,
+        'likes_received': stats.likes_received,
+        'rating_histogram': stats.rating_histogram,
+        'books_read_by_year': stats.books_read_by_year,
     })
 
-@api_view(['GET'])
+@async_api_view()
 @permission_classes([IsAuthenticated])
-def user_activity(request):
+async def user_activity(request):
     user = request.user
-    # Get recent activities: likes on user's reviews, user's new reviews, etc.
-    activities = []
-
-    # Recent likes on user's reviews - prefetch related objects to avoid N+1 queries
-    recent_likes = ReviewLike.objects.filter(review__user=user).select_related('user', 'review__book').order_by('-created_at')[:10]
-    for like in recent_likes:
-        activities.append({
-            'id': f'like_{like.id}',
-            'description': f'{like.user.username} liked your review of "{like.review.book.title}"',
-            'created_at': like.created_at,
-        })
-
-    # Recent reviews by user - prefetch book to avoid N+1 queries
-    recent_reviews = Review.objects.filter(user=user).select_related('book').order_by('-created_at')[:5]
-    for review in recent_reviews:
-        activities.append({
-            'id': f'review_{review.id}',
-            'description': f'You reviewed "{review.book.title}"',
-            'created_at': review.created_at,
-        })
+    # Read from the activity log: both lookups are index range scans, with no join through reviews
+    activities = Activity.objects.select_related('user', 'book').order_by('-created_at', '-id')
+    likes, reviews = await run_queries(
+        lambda: list(activities.filter(target_user=user, action=LIKED_REVIEW)[:10]),  # Recent likes on the user's reviews
+        lambda: list(activities.filter(user=user, action=REVIEWED)[:5]),  # Recent reviews by the user
+    )
+
+    activities = [
+        {
+            'id': f'like_{activity.id}',
+            'description': f'{activity.user.username} liked your review of "{activity.book.title}"',
+            'created_at': activity.created_at,
+        }
+        for activity in likes
+    ] + [
+        {
+            'id': f'review_{activity.review_id}',
+            'description': f'You reviewed "{activity.book.title}"',
+            'created_at': activity.created_at,
+        }
+        for activity in reviews
+    ]
 
     # Sort by created_at descending
     activities.sort(key=lambda x: x['created_at'], reverse=True)
@@ -230,36 +445,114 @@ def user_activity(request):
 
     return Response(activities)
 
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def request_analytics(request):
+def feed(request):
+    """
+    The user's home feed: reviews, likes, list additions and follows of the people they follow,
+    newest first, in cursor pages (?cursor=, ?page_size=).
+    """
+    paginator = FeedPagination()
+    activities = paginator.paginate_feed(request.user, request)
+    serializer = ActivitySerializer(activities, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@async_api_view()
+@permission_classes([IsAuthenticated])
+async def request_analytics(request):
     """
-    Analytics endpoint to show request patterns and usage statistics.
-    Requires admin permissions for security.
+    Analytics endpoint to show usage statistics over time, summed from the hourly and
+    daily buckets in api/analytics.py. Requires admin permissions for security.
+
+    ?range=24h|7d|90d|... picks the window ending now (default 24h) and
+    ?granularity=hour|day the spacing of its series (default hour up to 2 days, else day).
+    The five queries behind the response run concurrently.
     """
-    if not request.user.profile.role == 'admin':
+    role = await sync_to_async(lambda: request.user.profile.role)()
+    if not role == 'admin':
         return Response({'error': 'Admin access required'}, status=403)
 
-    # Get basic stats
-    total_reviews = Review.objects.count()
-    total_books = Book.objects.count()
-    total_users = User.objects.count()
-    total_likes = ReviewLike.objects.count()
+    range_param = request.query_params.get('range', '24h')
+    try:
+        span = analytics.parse_range(range_param)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    granularity = request.query_params.get('granularity') or (
+        analytics.HOUR if span <= timezone.timedelta(days=2) else analytics.DAY
+    )
+    if granularity not in analytics.GRANULARITIES:
+        return Response(
+            {'error': f'granularity must be one of {", ".join(analytics.GRANULARITIES)}'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if span / analytics.GRANULARITIES[granularity] > analytics.MAX_POINTS:
+        return Response(
+            {'error': f'range {range_param} has more than {analytics.MAX_POINTS} {granularity}s; use a coarser granularity'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    # Get popular endpoints (this would need actual request logging to be accurate)
-    # For now, show API usage patterns based on data
+    now = timezone.now()
+    start = now - span
+    overall, last_24h, book_count, totals, series = await run_queries(
+        partial(analytics.totals, [analytics.REVIEWS, analytics.LIKES, analytics.SIGNUPS], end=now),
+        partial(analytics.totals, [analytics.REVIEWS, analytics.LIKES], now - timezone.timedelta(days=1), now),
+        Book.objects.count,  # Books carry no timestamp to bucket by
+        partial(analytics.totals, analytics.METRICS, start, now),
+        partial(analytics.series, analytics.METRICS, start, now, granularity),
+    )
 
     return Response({
         'overview': {
-            'total_reviews': total_reviews,
-            'total_books': total_books,
-            'total_users': total_users,
-            'total_likes': total_likes,
+            'total_reviews': overall[analytics.REVIEWS],
+            'total_books': book_count,
+            'total_users': overall[analytics.SIGNUPS],
+            'total_likes': overall[analytics.LIKES],
         },
         'recent_activity': {
-            'reviews_last_24h': Review.objects.filter(created_at__gte=timezone.now() - timezone.timedelta(days=1)).count(),
-            'likes_last_24h': ReviewLike.objects.filter(created_at__gte=timezone.now() - timezone.timedelta(days=1)).count(),
+            'reviews_last_24h': last_24h[analytics.REVIEWS],
+            'likes_last_24h': last_24h[analytics.LIKES],
         },
-        'note': 'Enable full request logging by checking Railway logs after this deployment'
+        'range': range_param,
+        'granularity': granularity,
+        'start': start,
+        'end': now,
+        'totals': totals,
+        'series': series,
     })
+
+
+class ProfilingToggleSerializer(serializers.Serializer):
+    sample_rate = serializers.FloatField(min_value=0, max_value=1)
+    minutes = serializers.IntegerField(min_value=1, max_value=24 * 60, default=10)
+    trace = serializers.ChoiceField(choices=profiling.TRACES, allow_null=True, default=None)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated, IsAdmin])
+def profiling_overview(request):
+    """
+    GET lists the profiled requests in the ring buffer (newest first, without their queries).
+    POST {"sample_rate": 0.05, "minutes": 10, "trace": "cprofile"} profiles that share of all
+    requests for the given time; "sample_rate": 0 turns sampling off again.
+    """
+    if request.method == 'POST':
+        serializer = ProfilingToggleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        profiling.set_toggle(**serializer.validated_data)
+
+    summaries = [
+        {key: value for key, value in profile.items() if key not in ('queries', 'trace')}
+        for profile in profiling.list_profiles()
+    ]
+    return Response({'sampling': profiling.get_toggle(), 'profiles': summaries})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdmin])
+def profiling_detail(request, profile_id):
+    """One profiled request with all its queries and trace."""
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        return Response({'error': 'Profile not found; it may have been replaced by newer ones'}, status=404)
+    return Response(profile)
@@ -54,7 +54,7 @@ if DEBUG:
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.StaticFilesMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'api.middleware.RequestLoggingMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 # Add django-silk middleware only in development
@@ -97,6 +98,76 @@ DATABASES = {
 }
 
 
+# Cache
+# Local memory by default; set CACHE_URL (e.g. redis://localhost:6379/1) to share one cache between workers
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Seconds a cached book list/detail response is kept (see api/caching.py)
+BOOK_CACHE_TIMEOUT = env.int('BOOK_CACHE_TIMEOUT', default=300)
+
+# Home feeds (see api/feed.py): activity of users with more followers than this is read on
+# demand instead of being copied into every follower's feed
+FEED_FANOUT_LIMIT = env.int('FEED_FANOUT_LIMIT', default=5000)
+
+# Recent activities copied into a feed when following someone, or per user by rebuild_feeds
+FEED_BACKFILL_SIZE = env.int('FEED_BACKFILL_SIZE', default=100)
+
+# Threads per worker process that run the independent queries of async views concurrently
+# (see api/concurrency.py). Each keeps its own database connection.
+ASYNC_QUERY_THREADS = env.int('ASYNC_QUERY_THREADS', default=8)
+
+# Most items one request to a bulk write endpoint may carry (see api/bulk.py)
+BULK_MAX_ITEMS = env.int('BULK_MAX_ITEMS', default=5000)
+
+# Where `manage.py rebuild_similarities` checkpoints the reader x book matrix that its
+# --incremental runs update (see api/similarity.py). Must persist between runs.
+SIMILARITY_CHECKPOINT_DIR = env('SIMILARITY_CHECKPOINT_DIR', default=str(BASE_DIR / 'similarity_checkpoint'))
+
+# Resized WebP covers (see api/covers.py): the directory caching them, shared by every process,
+# and the bytes it may take before the least recently used are deleted
+COVER_CACHE_DIR = env('COVER_CACHE_DIR', default=str(BASE_DIR / 'cover_cache'))
+COVER_CACHE_MAX_BYTES = env.int('COVER_CACHE_MAX_BYTES', default=1024 ** 3)
+
+# Threads per worker process that fetch and resize covers, and seconds a cover request waits
+# for them before it is redirected to the original image
+COVER_WORKERS = env.int('COVER_WORKERS', default=2)
+COVER_RENDER_TIMEOUT = env.float('COVER_RENDER_TIMEOUT', default=5.0)
+
+# Hosts the cover workers may fetch a book's cover_url from, each with its subdomains. Anyone
+# who can set a cover_url picks what the server requests, so keep this to image hosts; a
+# redirect to any other host is refused too.
+COVER_SOURCE_HOSTS = env.list('COVER_SOURCE_HOSTS', default=[
+    'covers.openlibrary.org',
+    'archive.org',
+    'books.google.com',
+    'books.googleusercontent.com',
+])
+
+# Start of the cover URLs in API responses; point it at a CDN in front of /api/covers/
+COVER_URL_PREFIX = env('COVER_URL_PREFIX', default='/api/covers/')
+
+# Request metrics at /metrics (see api/metrics.py): every request is counted, and this share
+# of them also records latency, response size and SQL query count/time. Raise it towards 1.0
+# for exact latencies on low-traffic deployments; each sampled request costs a query wrapper.
+METRICS_SAMPLE_RATE = env.float('METRICS_SAMPLE_RATE', default=0.1)
+
+# /metrics requires 'Authorization: Bearer <METRICS_TOKEN>', and is refused when it isn't set
+# (unless DEBUG is on)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Request profiling (see api/profiling.py). Requests sent with 'X-Profile: <PROFILING_TOKEN>' are
+# always profiled; admins can also sample requests for a while through /api/profiling/
+PROFILING_TOKEN = env('PROFILING_TOKEN', default='')
+
+# Profiles kept (the oldest is replaced first) and how often one query shape must run in a
+# request before it is reported as a likely N+1
+PROFILING_BUFFER_SIZE = env.int('PROFILING_BUFFER_SIZE', default=50)
+PROFILING_REPEAT_THRESHOLD = env.int('PROFILING_REPEAT_THRESHOLD', default=5)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
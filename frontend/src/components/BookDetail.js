@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { useParams } from 'react-router-dom';
 import api from '../utils/api';
+import { coverUrl } from '../utils/covers';
 import { AuthContext } from '../context/AuthContext';
 import ReviewForm from './ReviewForm';
 import './BookDetail.css';
@@ -182,7 +183,7 @@ const BookDetail = () => {
               <div className="poster-container">
                 {book.cover_url ? (
                   <img
-                    src={book.cover_url}
+                    src={coverUrl(book, 'large')}
                     alt={book.title}
                     className="book-poster"
                   />
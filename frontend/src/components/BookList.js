@@ -5,6 +5,7 @@ import { Container, Row, Col, Form, ButtonGroup, Button, Offcanvas, InputGroup }
 import { FiFilter, FiSearch, FiChevronUp, FiChevronDown } from 'react-icons/fi';
 import { Range } from 'react-range';
 import api from '../utils/api';
+import { coverUrl } from '../utils/covers';
 import { AuthContext } from '../context/AuthContext';
 import './BookList.css';
 
@@ -426,7 +427,7 @@ const BookList = () => {
                 tabIndex={0}
               >
                 <img
-                  src={book.cover_url || '/placeholder.jpg'}
+                  src={coverUrl(book, 'thumbnail') || '/placeholder.jpg'}
                   alt={book.title}
                   className="poster-image"
                   loading="lazy"
@@ -445,7 +446,7 @@ const BookList = () => {
               {hoveredBook && hoveredBook.id === book.id && !isMobile && (
                 <div 
                   className="book-popup"
-                  style={{ backgroundImage: `linear-gradient(rgba(26,26,26,0.9), rgba(26,26,26,0.9)), url(${book.cover_url || '/placeholder.jpg'})` }}
+                  style={{ backgroundImage: `linear-gradient(rgba(26,26,26,0.9), rgba(26,26,26,0.9)), url(${coverUrl(book, 'thumbnail') || '/placeholder.jpg'})` }}
                   onMouseEnter={handlePopupMouseEnter}
                   onMouseLeave={handlePopupMouseLeave}
                   onClick={(e) => { e.stopPropagation(); window.location.href = `/books/${book.id}`; }}
@@ -548,7 +549,7 @@ const BookList = () => {
         return popupBook ? (
           <div 
             className="book-popup mobile-popup"
-            style={{ backgroundImage: `linear-gradient(rgba(26,26,26,0.98), rgba(26,26,26,0.98)), url(${popupBook.cover_url || '/placeholder.jpg'})` }}
+            style={{ backgroundImage: `linear-gradient(rgba(26,26,26,0.98), rgba(26,26,26,0.98)), url(${coverUrl(popupBook, 'thumbnail') || '/placeholder.jpg'})` }}
             onClick={(e) => { e.stopPropagation(); window.location.href = `/books/${popupBook.id}`; }}
           >
             <div className="popup-header">
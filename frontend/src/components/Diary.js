@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { Link } from 'react-router-dom';
 import api from '../utils/api';
+import { coverUrl } from '../utils/covers';
 import { AuthContext } from '../context/AuthContext';
 import './Diary.css';
 
@@ -176,7 +177,7 @@ const Diary = () => {
                 <Link to={`/books/${entry.book.id}`} className="entry-book-link">
                   <div className="entry-book-info">
                     <img
-                      src={entry.book.cover_url || '/placeholder-book.png'}
+                      src={coverUrl(entry.book, 'thumbnail') || '/placeholder-book.png'}
                       alt={entry.book.title}
                       className="entry-book-cover"
                     />
@@ -0,0 +1,6 @@
+// URL of a resized cover ('thumbnail', 'medium' or 'large'), or the original when the API has none
+export const coverUrl = (book, variant) => {
+  const url = book.covers && book.covers[variant];
+  if (!url) return book.cover_url;
+  return url.startsWith('/') ? `${process.env.REACT_APP_API_BASE_URL || ''}${url}` : url;
+};